@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 '''
 To build a compressed hashtable for protein databases.
-Input: one or more multi-fasta protein database(s)
-Output: compressed dictionary (hashtable) of kmers and reference proteins
+Input: one or more multi-fasta protein database(s), optionally gzip/bgzip compressed
+Output: compressed dictionary (hashtable) of kmers, its k-mer prefilter and reference proteins
 
 Author:
 	Mei-Yu Lai
@@ -13,15 +13,19 @@ E-mail:
 	yge15@jhmi.edu
 
 Usage:
-	$ python 6tbsps-build [-h] [-k [KMER]] --db DB protein.faa [protein.faa ...]
+	$ python 6tbsps-build [-h] [-k [KMER]] --db DB [-z COMPRESS] [--collapse]
+		[--shards SHARDS] protein.faa [protein.faa ...]
 	
 '''
 #%%
 import os
+import sys
 import argparse
 
 # custom src
 import src.file_io as fio
+from src.redundancy import collapse
+from src.shards import split_shards, write_manifest
 #%%
 def protein_kmer_table(seqs, k):
 	'''
@@ -45,6 +49,51 @@ def protein_kmer_table(seqs, k):
 
 	return table
 #%%
+def build_database(prot_seqs, k, out_dir, out_base, compress=0, collapsed=False):
+	'''
+	Write the k-mer index, as a dictionary and as integer-encoded arrays,
+	its prefilter and the protein sequences of a database
+
+	Args:
+		prot_seqs (dict): 	protein dictionary
+		k (int): 			an interger k for k-mer
+		out_dir (str): 		output directory name
+		out_base (str): 	database base name
+		compress (int): 	gzip level of the database files
+		collapsed (bool): 	index residues shared by several proteins once
+
+	Returns:
+		None
+	'''
+	# numpy is only needed here, not to start up
+	from src.prefilter import build_filter
+	from src.kmer_index import build_arrays
+
+	# a collapsed database stores segments and pieces in .nr instead of .prot
+	nr_name = os.path.join(out_dir, out_base+'.nr.pickle')
+	kidx_name = os.path.join(out_dir, out_base+'.kidx.pickle')
+	arrays = None
+	if collapsed:
+		segments, refs, prot_kmer = collapse(prot_seqs, k)
+		fio.write_dict({'k': k, 'segments': segments, 'refs': refs}, \
+			out_dir, out_base+'.nr', compress)
+	else:
+		if os.path.exists(nr_name):
+			os.remove(nr_name)
+		fio.write_dict(prot_seqs, out_dir, out_base+'.prot', compress)
+		prot_kmer = protein_kmer_table(prot_seqs, k)
+		# the integer-encoded index the query looks seeds up in
+		arrays = build_arrays(prot_kmer, k)
+	fio.write_dict(prot_kmer, out_dir, out_base+'.kmer', compress)
+	if arrays is not None:
+		fio.write_dict(arrays, out_dir, out_base+'.kidx', compress)
+	elif os.path.exists(kidx_name):
+		os.remove(kidx_name)
+	fio.write_dict(build_filter(prot_kmer.keys(), k), out_dir, out_base+'.filter', \
+		compress)
+
+	return
+#%%
 def main():
 	'''The main function for 6TBSPS-build'''
 
@@ -56,6 +105,13 @@ def main():
 		help='k-mer length (default:3)')
 	parser.add_argument('--db', '--database', \
 		help='database base name of k-mer indices', required = True)
+	parser.add_argument('-z', '--compress', default=0, type=int, \
+		help='gzip level (1-9) of the database files, 0 for uncompressed (default:0)')
+	parser.add_argument('--collapse', action='store_true', \
+		help='index residues shared by several proteins once')
+	parser.add_argument('--shards', default=1, type=int, \
+		help='split the database into SHARDS shards DB.0, DB.1, ... with a '
+			'manifest DB.manifest.json (default:1, unsharded)')
 
 	args = parser.parse_args()
 	in_files = args.prot_faa
@@ -65,11 +121,22 @@ def main():
 
 	prot_seqs = {}
 	for name in in_files:
-		fio.parse_fasta(name, prot_seqs)
-	fio.write_dict(prot_seqs, out_dir, out_base+'.prot')
+		prot_seqs.update(fio.read_fasta(name))
 
-	prot_kmer = protein_kmer_table(prot_seqs, k)
-	fio.write_dict(prot_kmer, out_dir, out_base+'.kmer')
+	manifest_name = os.path.join(out_dir, out_base+'.manifest.json')
+	if args.shards > 1:
+		shards = split_shards(prot_seqs, args.shards)
+		if len(shards) < args.shards:
+			print('{} proteins: building {} shards instead of {}'.format( \
+				len(prot_seqs), len(shards), args.shards), file=sys.stderr)
+		for i, shard in enumerate(shards):
+			build_database(shard, k, out_dir, '{}.{}'.format(out_base, i), \
+				args.compress, args.collapse)
+		write_manifest(os.path.join(out_dir, out_base), shards, k)
+	else:
+		if os.path.exists(manifest_name):
+			os.remove(manifest_name)
+		build_database(prot_seqs, k, out_dir, out_base, args.compress, args.collapse)
 
 	return
 #%%
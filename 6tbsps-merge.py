@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+'''
+To merge the query results of the shards of a sharded database.
+Input: the output directories of 6tbsps-query.py --shard, one per shard
+Output: one output directory with the hits of every read sorted by e-value
+
+Usage:
+	$ python 6tbsps-merge [-h] -o O shard_dir [shard_dir ...]
+
+'''
+#%%
+import argparse
+
+# custom src
+from src.shards import merge_results
+#%%
+def main():
+	'''The main function for 6TBSPS-merge'''
+
+	parser = argparse.ArgumentParser(prog = '6tbsps-merge', \
+		description='Merge the query results of the shards of a database.')
+	parser.add_argument('-o', required = True, help = 'merged output directory')
+	parser.add_argument('shard_dirs', metavar='shard_dir', nargs = '+', \
+		help='output directory of 6tbsps-query.py --shard, in shard order')
+
+	args = parser.parse_args()
+	reads = merge_results(args.shard_dirs, args.o)
+	print('merged {} reads from {} shards'.format(reads, len(args.shard_dirs)))
+
+	return
+#%%
+if __name__ == '__main__':
+	main()
@@ -13,23 +13,26 @@ E-mail:
 	hezt@jhu.edu
 
 Usage:
-	$ python 6tbsps-query [-h] --db DB -o O [-p [P]] [--sm [SM]] reads.fa [reads.fa ...]
+	$ python 6tbsps-query [-h] --db DB -o O [-p [P]] [--sm [SM]] [--batches BATCHES]
+		[--stats STATS] [--profile PROFILE] [--long-read] [--window WINDOW]
+		[--overlap OVERLAP] [--frameshift PENALTY] [--aligner ALIGNER]
+		[--gap-model {affine,linear}] [--evalue EVALUE] [--shard SHARD]
+		[--server SOCKET] [--resume] [--columnar {npz,parquet}]
+		reads.fa [reads.fa ...]
 
 '''
 #%%
 import os
-import pickle
 import argparse
-import multiprocessing
-from itertools import product
 import time
 
 # custom src
 import src.file_io as fio
-import src.six_frame_translation as sft
-from src.seed_and_extend import naive_seed_and_extend
-from src.local_alignment_affine import LocalAlignment
-from src.score_matrix import score_matrix, e_value_cal
+from src.aligners import ALIGNERS, GAP_MODELS
+from src.columnar import FORMATS
+from src.scheduler import print_utilization
+from src.search import Searcher
+from src.daemon import send_request
 #%%
 def main():
 	s_time = time.time()
@@ -42,68 +45,99 @@ def main():
 	parser.add_argument('-p', default=1, nargs='?', type=int, help = 'number of processes')
 	parser.add_argument('--sm', '--score-matrix', default='BLOSUM62', nargs='?', type=str, \
 		help = 'scoring matrix: BLOSUM45, BLOSUM62 (default), BLOSUM80')
+	parser.add_argument('--batches', default=4, type=int, \
+		help = 'number of read batches per process (default: 4)')
+	parser.add_argument('--stats', metavar='STATS', \
+		help = 'write per-read/frame counters and stage times to STATS.tsv and STATS.json')
+	parser.add_argument('--profile', metavar='PROFILE', \
+		help = 'run cProfile and tracemalloc in each worker, merged into PROFILE.prof and PROFILE.txt')
+	parser.add_argument('--long-read', action='store_true', \
+		help = 'split reads into overlapping windows searched independently')
+	parser.add_argument('--window', default=3000, type=int, \
+		help = 'long-read window length in bases (default: 3000)')
+	parser.add_argument('--overlap', default=300, type=int, \
+		help = 'overlap of long-read windows in bases (default: 300)')
+	parser.add_argument('--frameshift', metavar='PENALTY', type=float, \
+		help = 'align the 3 frames of each strand in one pass, with PENALTY '
+			'(e.g. -15) for a frameshift')
+	parser.add_argument('--aligner', default='reference', choices=sorted(ALIGNERS), \
+		help = 'local alignment backend (default: reference)')
+	parser.add_argument('--gap-model', default='affine', choices=sorted(GAP_MODELS), \
+		help = 'gap penalties: affine (open -12, extend -4, default) or linear '
+			'(-8 per gap residue), a cheaper first pass for large screens')
+	parser.add_argument('--evalue', type=float, \
+		help = 'report only the hits up to EVALUE, without aligning the candidates '
+			'whose best possible score is above it (default: all hits)')
+	parser.add_argument('--shard', type=int, \
+		help = 'search shard SHARD of a sharded database, see 6tbsps-merge.py')
+	parser.add_argument('--server', metavar='SOCKET', \
+		help = 'run the search on the 6tbsps-server.py daemon listening on SOCKET, '
+			'which uses its own number of processes')
+	parser.add_argument('--resume', action='store_true', \
+		help = 'skip the reads finished by an interrupted run into the same output '
+			'directory, as recorded in its 6tbsps.journal')
+	parser.add_argument('--columnar', choices=sorted(FORMATS), \
+		help = 'also write the hits as typed columns, one hits-*.npz or hits-*.parquet '
+			'table per batch (parquet needs pyarrow)')
 	parser.add_argument('reads', metavar = 'reads.fa', nargs = '+', \
 		help = 'DNA reads in FASTA format')
 
 	args = parser.parse_args()
-	sm = score_matrix(args.sm) # default BLOSUM62
-	out_dir = args.o
-	num_proc = args.p
-	in_files = args.reads
+	if args.frameshift is not None and args.long_read:
+		parser.error('--frameshift cannot be combined with --long-read')
+	if args.server:
+		# the daemon has the database open, send it the run with absolute paths
+		request = {
+			'db': os.path.abspath(args.db),
+			'shard': args.shard,
+			'sm_name': args.sm,
+			'reads': [os.path.abspath(name) for name in args.reads],
+			'batches': args.batches,
+			'options': run_options(args),
+		}
+		try:
+			print(send_request(args.server, request), end='')
+		except (ValueError, OSError) as e:
+			parser.exit(1, '6tbsps-query: error: {}\n'.format(e))
+		return
 
-	# get the pre-indexed protein database and sequences
-	prot_db = fio.read_dict(args.db+'.kmer')
-	prot_seq = fio.read_dict(args.db+'.prot')
-	# get the constant k
-	k = len(list(prot_db.keys())[0])
-
-	# calculate total length of protein database
-	n = sum([len(prot_seq[name]) for name in prot_seq])
+	# get the pre-indexed protein database and sequences, collapsed or not
+	try:
+		searcher = Searcher(args.db, args.shard, args.sm, args.p) # default BLOSUM62
+	except ValueError as e:
+		parser.error(str(e))
 
 	# get all reads
 	reads = {}
-	for name in in_files:
-		fio.parse_fasta(name, reads)
-	query_args = [[read_id, seq, out_dir, k, prot_db, sm, prot_seq, n] \
-		for read_id, seq in reads.items()]
-	with multiprocessing.Pool(processes=num_proc) as pool:
-		pool.starmap(query, query_args)	
+	for name in args.reads:
+		reads.update(fio.read_fasta(name))
+
+	with searcher:
+		try:
+			workers = searcher.write(reads, run_options(args), args.batches)
+		except ValueError as e:
+			parser.error(str(e))
 	print('running time: {}'.format(time.time() - s_time))
+	print_utilization(workers)
 
 	return
 #%%
-def query(read_id, seq, out_dir, k, prot_db, sm, prot_seq, n):
-	# query
-	# make directory
-	if not os.path.exists(out_dir):
-		os.makedirs(out_dir)
-	frames = sft.six_frames(seq)
-	with open(os.path.join(out_dir, read_id.replace('/', '|')+'.out'), 'w') as out_file, \
-		open(os.path.join(out_dir, read_id.replace('/', '|')+'.summary'), 'w') as sum_file:
-		output = [] # store output
-		# for each of the 6 frames:
-		for f in [-3, -2, -1, 1, 2, 3]:
-			frame = frames[f]
-			# 6-frame translation
-			query = sft.translation(sft.transcription(frame))
-			# calculate query length
-			m = len(query)
-			# seed and extend
-			regions = naive_seed_and_extend(query, prot_db, k)
-			# local alignment
-			for ref_id, (s, e) in regions:
-				subject = prot_seq[ref_id][s:e]
-				la = LocalAlignment(query, subject, sm)
-				S = la.fill_matrix()
-				evalue = e_value_cal(m, n, S)
-				
-				output.append([f, read_id, query, ref_id, prot_seq, s, la, S, evalue])
-		
-		# sort by evalue, then by raw score
-		output = sorted(output, key=lambda x: (x[-1], x[-2]))
-		fio.align_out(output, out_file, sum_file)
-	
-	return
+def run_options(args):
+	'''The options of Searcher.write() from the command line arguments'''
+	return {
+		'out_dir': os.path.abspath(args.o),
+		'stats': args.stats and os.path.abspath(args.stats),
+		'profile': args.profile and os.path.abspath(args.profile),
+		'long_read': args.long_read,
+		'window': args.window,
+		'overlap': args.overlap,
+		'frameshift': args.frameshift,
+		'aligner': args.aligner,
+		'gap_model': args.gap_model,
+		'max_evalue': args.evalue,
+		'resume': args.resume,
+		'columnar': args.columnar,
+	}
 #%%
 if __name__ == "__main__":
-	main()
+	main()
\ No newline at end of file
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+Serve query runs against one protein database from a persistent process.
+The database is loaded and the worker pool started once; runs are sent
+with 6tbsps-query.py --server SOCKET and searched one at a time.
+
+Usage:
+	$ python 6tbsps-server [-h] --db DB [-p [P]] [--sm [SM]] [--shard SHARD]
+		--socket SOCKET
+
+'''
+#%%
+import os
+import sys
+import signal
+import argparse
+
+# custom src
+from src.search import Searcher
+from src.daemon import SearchServer
+#%%
+def main():
+	'''Main function of the 6tbsps-server'''
+	parser = argparse.ArgumentParser(prog = '6tbsps-server', \
+		description = 'Serve searches against a pre-indexed protein database.')
+	parser.add_argument('--db', required = True, \
+		help='database base name of k-mer indices')
+	parser.add_argument('-p', default=1, nargs='?', type=int, help = 'number of processes')
+	parser.add_argument('--sm', '--score-matrix', default='BLOSUM62', nargs='?', type=str, \
+		help = 'scoring matrix: BLOSUM45, BLOSUM62 (default), BLOSUM80')
+	parser.add_argument('--shard', type=int, \
+		help = 'serve shard SHARD of a sharded database')
+	parser.add_argument('--socket', required = True, \
+		help = 'Unix socket to listen on')
+
+	args = parser.parse_args()
+	try:
+		searcher = Searcher(os.path.abspath(args.db), args.shard, args.sm, args.p)
+	except ValueError as e:
+		parser.error(str(e))
+
+	with searcher, SearchServer(args.socket, searcher) as server:
+		# stop on kill as on Ctrl-C, closing the pool and removing the socket
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+		print('serving {} on {}'.format(args.db, args.socket), flush=True)
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+
+	return
+#%%
+if __name__ == "__main__":
+	main()
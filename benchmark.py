@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""Stage-level micro and macro benchmarks for 6TBSPs.
+
+This module times each stage of the pipeline separately on reads simulated
+    from the bundled SARS2 references, and runs the query end to end on the
+    shipped test read sets, comparing the output against the shipped results
+    so that speedups cannot silently change hits. Everything runs offline.
+
+Usage:
+    $ python benchmark.py [-h] [-l L] [-c C] [-n N] [-p P] [-o O]
+                          [--check [SET ...]] [--aligners [NAME ...]]
+
+Attributes:
+    load_script(str): import one of the 6tbsps-*.py command line scripts
+
+    micro_benchmark(int, float, int): time each pipeline stage on simulated
+        reads and return a dictionary of stage results
+
+    macro_benchmark(str, int): run 6tbsps-query.py on a shipped read set and
+        compare the results against the shipped output directory
+
+    aligner_benchmark(list, int): check every aligner backend against the
+        reference implementation and time its DP cells per second
+
+    frameshift_check(int): check that reads with inserted codons get the
+        score of their translation in the frameshift alignment
+
+    startup_benchmark(int): time the imports of the command line scripts
+        against STARTUP_BUDGET
+
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import itertools
+import resource
+import tempfile
+import subprocess
+import importlib.util
+
+import numpy as np
+
+import read_simulator
+import src.file_io as fio
+import src.six_frame_translation as sft
+from src.seed_and_extend import naive_seed_and_extend, seed_frames
+from src.kmer_index import KmerArrayIndex, build_arrays
+from src.local_alignment_affine import LocalAlignment
+from src.frameshift_alignment import FrameshiftAlignment
+from src.aligners import ALIGNERS, GAP_MODELS, align_all
+from src.hits import Alignment, HitRecord
+from src.score_matrix import score_matrix, e_value_cal
+from src.journal import JOURNAL
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(ROOT, 'test', 'SARS2-reference', 'ncbi_dataset', 'data')
+DB = os.path.join(ROOT, 'test', 'sars2')
+# shipped read sets and the directories holding their expected results
+CHECKS = {
+    'genomic': ('sars2_genomic_l150_c01.fa', 'sars2_genomic_out'),
+    'cds': ('sars2_cds_l150_c01.fa', 'sars2_cds_out'),
+    'dissimilar': ('dissimilar_seqs.fasta', 'dissimilar_output'),
+    'metagenome': ('metagenome_seqs.fasta', 'metagenome_output'),
+}
+# seconds a command line script may take to start (imports and --help) on
+# top of a bare interpreter
+STARTUP_BUDGET = {
+    '6tbsps-query.py': 0.25,
+    '6tbsps-build.py': 0.1,
+}
+#%%
+def load_script(name):
+    """Import one of the command line scripts, whose file names are not valid
+        module names.
+
+    Args:
+        name (str):     script file name, e.g. '6tbsps-build.py'
+
+    Returns:
+        module:         the imported module
+
+    """
+    spec = importlib.util.spec_from_file_location(
+        name[:-3].replace('-', '_'), os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+#%%
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is in KB on Linux)"""
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024
+#%%
+class Stage:
+    """Context manager timing one stage and counting the items it processed"""
+    def __init__(self, results, name, unit):
+        self.results = results
+        self.name = name
+        self.unit = unit
+        self.items = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.results[self.name] = {
+            'seconds': seconds,
+            'items': self.items,
+            'unit': self.unit,
+            'throughput': self.items / seconds if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        return False
+#%%
+def micro_benchmark(read_len, cov, max_reads, sm_name='BLOSUM62'):
+    """Time each stage of the pipeline on reads simulated from the SARS2
+        genome, against an index built from the SARS2 proteins.
+
+    Args:
+        read_len (int):     simulated read length
+        cov (float):        simulated coverage
+        max_reads (int):    number of reads pushed through seeding, alignment
+                            and output (0 for all)
+        sm_name (str):      score matrix name
+
+    Returns:
+        stages (dict):      a dictionary that maps each stage name to its
+                            seconds, items, unit, throughput and peak RSS
+
+    """
+    build = load_script('6tbsps-build.py')
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # workload
+        genome = dict(fio.read_fasta(os.path.join(DATA, 'genomic.fna')))
+        reads_fn = os.path.join(tmp, 'reads.fa')
+        with open(reads_fn, 'w') as fh:
+            for read_id, seq in read_simulator.read_simulation(
+                    genome, read_len, cov):
+                fh.write('>' + read_id + '\n' + seq + '\n')
+
+        with Stage(stages, 'parse_proteins', 'residues') as st:
+            prot_seq = dict(fio.read_fasta(os.path.join(DATA, 'protein.faa')))
+            st.items = sum([len(s) for s in prot_seq.values()])
+
+        with Stage(stages, 'parse_reads', 'bases') as st:
+            reads = dict(fio.read_fasta(reads_fn))
+            st.items = sum([len(s) for s in reads.values()])
+
+        with Stage(stages, 'index_build', 'residues') as st:
+            prot_db = build.protein_kmer_table(prot_seq, 3)
+            st.items = stages['parse_proteins']['items']
+
+        with Stage(stages, 'index_write', 'residues') as st:
+            fio.write_dict(prot_seq, tmp, 'bench.prot')
+            fio.write_dict(prot_db, tmp, 'bench.kmer')
+            st.items = stages['parse_proteins']['items']
+
+        with Stage(stages, 'index_load', 'residues') as st:
+            prot_seq = fio.read_dict(os.path.join(tmp, 'bench.prot'))
+            prot_db = fio.read_dict(os.path.join(tmp, 'bench.kmer'))
+            st.items = stages['parse_proteins']['items']
+        stages['index_load']['matches_shipped'] = \
+            prot_db == fio.read_dict(DB + '.kmer') and \
+            prot_seq == fio.read_dict(DB + '.prot')
+
+        k = len(next(iter(prot_db)))
+        n = sum([len(s) for s in prot_seq.values()])
+        sm = score_matrix(sm_name)
+        read_items = list(reads.items())
+        if max_reads > 0:
+            read_items = read_items[:max_reads]
+
+        with Stage(stages, 'translation', 'bases') as st:
+            peptides = []
+            for read_id, seq in read_items:
+                frames = sft.six_frames(seq)
+                for f in [-3, -2, -1, 1, 2, 3]:
+                    peptides.append((read_id, f, sft.translation(
+                        sft.transcription(frames[f]))))
+                st.items += len(seq)
+
+        with Stage(stages, 'seed_and_extend', 'frames') as st:
+            candidates = []
+            for read_id, f, query in peptides:
+                for ref_id, (s, e) in naive_seed_and_extend(query, prot_db, k):
+                    candidates.append((read_id, f, query, ref_id, s, e))
+                st.items += 1
+        stages['seed_and_extend']['candidates'] = len(candidates)
+
+        # the same seeding with the integer-encoded index, all frames of a
+        # read in one lookup
+        index = KmerArrayIndex(build_arrays(prot_db, k))
+        queries = {}
+        for read_id, f, query in peptides:
+            queries.setdefault(read_id, {})[f] = query
+        with Stage(stages, 'seed_arrays', 'frames') as st:
+            regions = [seed_frames(q, index, k) for q in queries.values()]
+            st.items = len(peptides)
+        stages['seed_arrays']['matches_dict'] = regions == \
+            [seed_frames(q, prot_db, k) for q in queries.values()]
+
+        with Stage(stages, 'fill_matrix', 'cells') as st:
+            filled = []
+            for read_id, f, query, ref_id, s, e in candidates:
+                la = LocalAlignment(query, prot_seq[ref_id][s:e], sm)
+                S = la.fill_matrix()
+                filled.append((read_id, f, query, ref_id, s, la, S))
+                st.items += len(query) * (e - s)
+
+        with Stage(stages, 'traceback', 'alignments') as st:
+            output = []
+            for read_id, f, query, ref_id, s, la, S in filled:
+                alignment = Alignment(la)
+                output.append(HitRecord(f, read_id, query, ref_id,
+                                        len(prot_seq[ref_id]), s, alignment, S,
+                                        e_value_cal(len(query), n, S, sm_name)))
+                st.items += len(alignment.max_loc_list)
+            del filled
+
+        with Stage(stages, 'align_out', 'bytes') as st:
+            out_file, sum_file = io.StringIO(), io.StringIO()
+            fio.align_out(output, out_file, sum_file)
+            st.items = len(out_file.getvalue()) + len(sum_file.getvalue())
+
+    return stages
+#%%
+def compare_dirs(expected_dir, observed_dir):
+    """Compare two result directories file by file.
+
+    Args:
+        expected_dir (str):     directory of shipped results
+        observed_dir (str):     directory of new results
+
+    Returns:
+        diff (dict):    lists of 'missing', 'extra' and 'different' files,
+                        leaving out the run journal
+
+    """
+    expected = set(os.listdir(expected_dir)) - set([JOURNAL])
+    observed = set(os.listdir(observed_dir)) - set([JOURNAL])
+    different = []
+    for name in sorted(expected & observed):
+        with open(os.path.join(expected_dir, name), 'rb') as fe, \
+            open(os.path.join(observed_dir, name), 'rb') as fo:
+            if fe.read() != fo.read():
+                different.append(name)
+    return {
+        'missing': sorted(expected - observed),
+        'extra': sorted(observed - expected),
+        'different': different,
+    }
+#%%
+def macro_benchmark(name, num_proc):
+    """Run 6tbsps-query.py on a shipped read set and compare the results with
+        the shipped output.
+
+    Args:
+        name (str):         key of CHECKS
+        num_proc (int):     number of query processes
+
+    Returns:
+        result (dict):      wall time, throughput, child peak RSS and the
+                            comparison against the shipped output
+
+    """
+    reads_fn, expected = CHECKS[name]
+    reads_fn = os.path.join(ROOT, 'test', reads_fn)
+    bases = sum([len(s) for _, s in fio.read_fasta(reads_fn, True)])
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = os.path.join(tmp, 'out')
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, '6tbsps-query.py'),
+                        '--db', DB, '-o', out_dir, '-p', str(num_proc),
+                        reads_fn], check=True, cwd=ROOT,
+                       stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        diff = compare_dirs(os.path.join(ROOT, 'test', expected), out_dir)
+
+    return {
+        'seconds': seconds,
+        'bases': bases,
+        'throughput': bases / seconds,
+        'unit': 'bases',
+        'peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'matches_shipped': not any(diff.values()),
+        'diff': diff,
+    }
+#%%
+def alignment_pairs(name, max_pairs):
+    """Query and candidate subject pairs of a shipped read set, in the order
+        of 6tbsps-query.py.
+
+    Args:
+        name (str):         key of CHECKS
+        max_pairs (int):    number of pairs (0 for all)
+
+    Returns:
+        pairs (list):       list of tuples of (query, subject)
+
+    """
+    prot_db = fio.read_dict(DB + '.kmer')
+    prot_seq = fio.read_dict(DB + '.prot')
+    k = len(next(iter(prot_db)))
+    pairs = []
+    for _, seq in fio.read_fasta(os.path.join(ROOT, 'test', CHECKS[name][0])):
+        frames = sft.six_frames(seq)
+        for f in [-3, -2, -1, 1, 2, 3]:
+            query = sft.translation(sft.transcription(frames[f]))
+            for ref_id, (s, e) in naive_seed_and_extend(query, prot_db, k):
+                pairs.append((query, prot_seq[ref_id][s:e]))
+                if len(pairs) == max_pairs:
+                    return pairs
+    return pairs
+#%%
+def aligner_benchmark(names, max_pairs, sm_name='BLOSUM62', gap_model='affine'):
+    """Check aligner backends against the reference implementation on the
+        candidate pairs of the genomic read set, and time them.
+        A backend passes when its X, Y and M matrices (for backends that
+        keep them, M alone with linear gaps), maxima and tracebacks are
+        identical to those of the reference.
+
+    Args:
+        names (list):       backend names, keys of ALIGNERS
+        max_pairs (int):    number of query and subject pairs (0 for all)
+        sm_name (str):      score matrix name
+        gap_model (str):    gap penalties, a key of GAP_MODELS
+
+    Returns:
+        backends (dict):    a dictionary that maps each backend name to its
+                            seconds, cells, cells per second and whether it
+                            matches the reference
+
+    """
+    sm = score_matrix(sm_name)
+    gaps = GAP_MODELS[gap_model]
+    pairs = alignment_pairs('genomic', max_pairs)
+    cells = sum([len(x) * len(y) for x, y in pairs])
+    expected = []
+    for x, y in pairs:
+        la = LocalAlignment(x, y, sm, *gaps)
+        la.fill_matrix()
+        expected.append((la, la.traceback()))
+
+    backends = {}
+    for name in names:
+        aligner = ALIGNERS[name]
+        # first call outside of the timing, e.g. for JIT compilation
+        aligner(*pairs[0], sm, *gaps).fill_matrix()
+        alignments = []
+        start = time.perf_counter()
+        # the candidates of one frame are aligned together, as in the query
+        for query, group in itertools.groupby(pairs, key=lambda p: p[0]):
+            alignments.extend(align_all(aligner, query, [y for _, y in group], sm,
+                                        *gaps))
+        seconds = time.perf_counter() - start
+        matches = all([
+            all([np.array_equal(getattr(la, a), getattr(ref, a), equal_nan=True)
+                 for a in 'XYM' if getattr(la, a, None) is not None]) and
+            la.max_loc_list == ref.max_loc_list and la.traceback() == tb
+            for la, (ref, tb) in zip(alignments, expected)])
+        backends[name] = {
+            'class': aligner.__name__,
+            'seconds': seconds,
+            'cells': cells,
+            'throughput': cells / seconds if seconds > 0 else None,
+            'unit': 'cells',
+            'matches_reference': matches,
+        }
+
+    return backends
+#%%
+def frameshift_check(max_cds=5, sm_name='BLOSUM62'):
+    """Insert 1 to 3 codons into a window of each SARS2 CDS and check that
+        the frameshift alignment of the window against its protein scores
+        as the local alignment of its translation, with an alignment inside
+        the strand.
+
+    Args:
+        max_cds (int):      number of CDS
+        sm_name (str):      score matrix name
+
+    Returns:
+        check (dict):       number of reads checked and whether all passed
+
+    """
+    sm = score_matrix(sm_name)
+    reads = 0
+    ok = True
+    for _, cds in itertools.islice(fio.read_fasta(os.path.join(DATA, 'cds.fna')),
+                                   max_cds):
+        subject = sft.translation(sft.transcription(cds[:300]))
+        for n in [1, 2, 3]:
+            strand = cds[30:90] + 'GGC' * n + cds[90:180]
+            query = sft.translation(sft.transcription(strand))
+            ref = LocalAlignment(query, subject, sm)
+            ref.fill_matrix()
+            la = FrameshiftAlignment(strand, subject, sm)
+            la.fill_matrix()
+            la.traceback()
+            x0, x1 = la.max_loc_x_list[0]
+            ok = ok and la.score == ref.score and 0 <= x0 < x1 < len(strand) and \
+                len(la.align_seq_x_list[0]) == len(la.align_seq_y_list[0])
+            reads += 1
+
+    return {'reads': reads, 'matches_translation': ok}
+#%%
+def startup_benchmark(repeats=5):
+    """Time the start of each script of STARTUP_BUDGET, i.e. its imports and
+        argument parsing, as the best of repeats runs of script --help minus
+        the best start of a bare interpreter.
+
+    Args:
+        repeats (int):      runs per script
+
+    Returns:
+        scripts (dict):     a dictionary that maps each script to its startup
+                            seconds, budget and whether it is within budget
+
+    """
+    def best(cmd):
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(cmd, check=True, cwd=ROOT, stdout=subprocess.DEVNULL)
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    bare = best([sys.executable, '-c', 'pass'])
+    scripts = {}
+    for name, budget in STARTUP_BUDGET.items():
+        seconds = best([sys.executable, os.path.join(ROOT, name), '--help']) - bare
+        scripts[name] = {
+            'seconds': seconds,
+            'budget': budget,
+            'within_budget': seconds <= budget,
+        }
+
+    return scripts
+#%%
+def main():
+    """Main driver function of the benchmark.
+        Print the JSON report to stdout (or to -o) and exit non-zero when a
+        macro benchmark does not reproduce the shipped results, an aligner
+        backend differs from the reference, a frameshift alignment misses
+        an inserted codon or a script starts slower than its budget.
+
+    """
+    parser = argparse.ArgumentParser(prog='python benchmark.py',
+        description='Stage-level micro and macro benchmarks for 6TBSPs.')
+    parser.add_argument('-l', default=150, type=int,
+        help='simulated read length (default: 150)')
+    parser.add_argument('-c', default=0.1, type=float,
+        help='simulated coverage (default: 0.1)')
+    parser.add_argument('-n', default=5, type=int,
+        help='reads pushed through alignment, 0 for all (default: 5)')
+    parser.add_argument('-p', default=1, type=int,
+        help='number of processes for macro benchmarks (default: 1)')
+    parser.add_argument('-o', help='JSON output file (default: stdout)')
+    parser.add_argument('--check', nargs='*', default=['genomic'],
+        choices=sorted(CHECKS),
+        help='shipped read sets to run end to end (default: genomic)')
+    parser.add_argument('--aligners', nargs='*', default=sorted(ALIGNERS),
+        choices=sorted(ALIGNERS),
+        help='aligner backends to check and time (default: all)')
+    parser.add_argument('--pairs', default=200, type=int,
+        help='candidate pairs aligned per backend, 0 for all (default: 200)')
+    parser.add_argument('--gap-model', default='affine', choices=sorted(GAP_MODELS),
+        help='gap penalties of the aligner check (default: affine)')
+    args = parser.parse_args()
+
+    report = {
+        'config': {'read_length': args.l, 'coverage': args.c,
+                   'max_reads': args.n, 'processes': args.p,
+                   'python': sys.version.split()[0]},
+        'stages': micro_benchmark(args.l, args.c, args.n),
+        'macro': {name: macro_benchmark(name, args.p) for name in args.check},
+        'aligners': aligner_benchmark(args.aligners, args.pairs,
+                                      gap_model=args.gap_model),
+        'frameshift': frameshift_check(),
+        'startup': startup_benchmark(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.o:
+        with open(args.o, 'w') as fh:
+            print(text, file=fh)
+    else:
+        print(text)
+
+    ok = report['stages']['seed_arrays']['matches_dict'] and \
+        all([m['matches_shipped'] for m in report['macro'].values()]) and \
+        all([a['matches_reference'] for a in report['aligners'].values()]) and \
+        report['frameshift']['matches_translation'] and \
+        all([st['within_budget'] for st in report['startup'].values()])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
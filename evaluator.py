@@ -1,144 +1,227 @@
 """ Evaluator for 6TBSPs and BlastX output
 ​
-Author: 
+Author:
     Zitong He
 ​
-Email: 
+Email:
     hezt@jhu.edu
-    
+
 Usage:
-    usage: python evaluator.py [-h] -b file_path -6 directory_path
+    usage: python evaluator.py [-h] -b file_path -s path [-k K [K ...]]
+                               [--per-read file_path]
 ​
 Attributes:
-    None
+    Results are streamed line by line into typed pandas columns and the
+    BLASTX and 6TBSPs hits are joined on (query, subject) with hashed merges,
+    so the evaluation stays linear in the number of hits. 6TBSPs results can
+    be a directory of per-read .summary files or a single summary file, or
+    the columnar tables of 6tbsps-query.py --columnar, whose typed columns
+    are loaded as they are, without parsing; a directory with tables is read
+    from its tables. pandas is imported when the results are read, not at
+    startup.
 ​
 """
 
 import argparse
 import os
-import pandas as pd
+
+
+def ranks(six_df):
+    '''
+    rank of every (qid, sid) pair in the 6tbsps results
+
+    the rank of a subject is the position of the first hit of the query that
+    has the same evalue as the first hit of that subject, so ties between
+    several same evalue good hits share the best rank
+    '''
+    six_df = six_df.copy()
+    six_df['pos'] = six_df.groupby('qid', sort=False).cumcount()
+    first = six_df.drop_duplicates(['qid', 'sid'])[['qid', 'sid', 'evalue']]
+    tie_pos = six_df.groupby(['qid', 'evalue'], sort=False)['pos'].min() \
+        .rename('rank').reset_index()
+    return first.merge(tie_pos, on=['qid', 'evalue'], how='left')[
+        ['qid', 'sid', 'rank']]
+
+
+def per_read(six_df, blastx_df):
+    '''
+    per read breakdown against the blastx top results
+
+    returns one row per blastx query with the number of 6tbsps hits, the best
+    rank of a blastx top subject (n_hits when missed) and whether it was hit
+    '''
+    # get golden top result from blastx, keeping ties
+    min_eval = blastx_df.groupby('qid', sort=False)['evalue'].transform('min')
+    top = blastx_df.loc[blastx_df['evalue'] == min_eval, ['qid', 'sid']] \
+        .drop_duplicates()
+    n_hits = six_df.groupby('qid', sort=False).size().rename('n_hits')
+    top = top.merge(ranks(six_df), on=['qid', 'sid'], how='left')
+    reads = top.groupby('qid', sort=False)['rank'].min().to_frame('min_rank')
+    reads = reads.join(n_hits, how='left')
+    reads['n_hits'] = reads['n_hits'].fillna(0).astype('int64')
+    missed = reads['min_rank'].isna()
+    reads['min_rank'] = reads['min_rank'].where(~missed, reads['n_hits']) \
+        .astype('int64')
+    reads['hit'] = reads['min_rank'] < reads['n_hits']
+    return reads
 
 
 def ranking_loss(six_content, blastx_content):
     '''
     calculate ranking loss
     '''
-    # get golden top result from blastx
-    blastx_dic = {} 
-    for i in blastx_content:
-        if i[0] not in blastx_dic.keys():
-            blastx_dic[i[0]] = [[i[1], i[2]]]
-        else:
-            blastx_dic[i[0]].append([i[1], i[2]])
-    for k in blastx_dic.keys():
-        min_eval = min(blastx_dic[k], key=lambda x: x[1])[1]
-        blastx_dic[k] = [i[0] for i in blastx_dic[k] if i[1] == min_eval]
-    # put 6tbsps result to dict
-    six_sid_dic = {} 
-    six_evalue_dic = {}
-    for i in six_content:
-        if i[0] not in six_sid_dic.keys():
-            six_sid_dic[i[0]] = [i[1]]
-            six_evalue_dic[i[0]] = [i[2]]
-        else:
-            six_sid_dic[i[0]].append(i[1]) 
-            six_evalue_dic[i[0]].append(i[2])
-    # find blastx top results: blastx_dic[k][...] in 6tbsps results 
-    ranking_loss_value = 0
-    miss_counter = 0
-    hit_counter = 0
-    for qid, top_sid_list in blastx_dic.items():
-        rank_candidates = []
-        for top_sid in top_sid_list:
-            if top_sid in six_sid_dic[qid]:
-                # hit
-                # there may exist tie: there are several same evalue good hits
-                # break this tie by get the first hit's rank
-                # among all same evalue good hits
-                hit_loc = six_sid_dic[qid].index(top_sid)
-                evalue = six_evalue_dic[qid][hit_loc]
-                # .index() will return the first matched elem's index
-                rank_candidates.append(six_evalue_dic[qid].index(evalue)) 
-            else:
-                # miss
-                rank_candidates.append(len(six_sid_dic[qid]))
-        min_rank = min(rank_candidates)
-        if min_rank == len(six_sid_dic[qid]):
-            # miss
-            miss_counter += 1
-        else:
-            hit_counter += 1 
-        ranking_loss_value += min_rank
-
-    print('Miss: ', miss_counter)
-    print('Hit: ', hit_counter)
-    return float(float(ranking_loss_value) / len(blastx_dic.keys()))
+    reads = per_read(to_frame(six_content), to_frame(blastx_content))
+    print('Miss: ', int((~reads['hit']).sum()))
+    print('Hit: ', int(reads['hit'].sum()))
+    return float(reads['min_rank'].mean())
+
+
+def top_k(six_df, blastx_df, reads, k):
+    '''
+    sensitivity and precision at top-k
+
+    sensitivity@k: fraction of blastx queries whose top subject is ranked
+        within the first k 6tbsps hits
+    precision@k: fraction of the first k 6tbsps hits of the evaluated queries
+        whose subject is reported by blastx for the same query
+    '''
+    sensitivity = float((reads['hit'] & (reads['min_rank'] < k)).mean())
+    six_df = six_df[six_df['qid'].isin(reads.index)]
+    six_top = six_df[six_df.groupby('qid', sort=False).cumcount() < k]
+    pairs = blastx_df[['qid', 'sid']].drop_duplicates()
+    pairs['found'] = True
+    six_top = six_top.merge(pairs, on=['qid', 'sid'], how='left')
+    precision = float(six_top['found'].notna().mean()) if len(six_top) else 0.
+    return sensitivity, precision
+
+
+def to_frame(content):
+    '''
+    typed columns from a list of [qid, sid, evalue]
+    '''
+    import pandas as pd
+    if isinstance(content, pd.DataFrame):
+        return content
+    qid, sid, evalue = zip(*content) if content else ((), (), ())
+    return hits_frame(qid, sid, evalue)
+
+
+def hits_frame(qids, sids, evalues):
+    '''
+    typed qid, sid and evalue columns
+    '''
+    import numpy as np
+    import pandas as pd
+    return pd.DataFrame({'qid': pd.Series(qids, dtype=object),
+                         'sid': pd.Series(sids, dtype=object),
+                         'evalue': np.asarray(evalues, dtype=np.float64)})
+
+
+def summary_files(src):
+    '''
+    .summary files of a 6tbsps output directory, or the single file itself
+    '''
+    if os.path.isdir(src):
+        for entry in os.scandir(src):
+            if os.path.splitext(entry.name)[-1] == '.summary':
+                yield entry.path
+    else:
+        yield src
+
+
+def table_frame(columns):
+    '''
+    typed qid, sid and evalue columns of 6tbsps columnar results, cutting
+    each distinct read and reference id at its first space
+    '''
+    import numpy as np
+    reads, inverse = np.unique(columns['read_id'], return_inverse=True)
+    qids = np.array([r.split(' ', 1)[0] for r in reads.tolist()], dtype=object)
+    sids = np.array([r.split(' ', 1)[0] for r in columns['refs'].tolist()],
+                    dtype=object)
+    return hits_frame(qids[inverse.ravel()], sids[columns['ref']],
+                      columns['evalue'])
+
 
 def read_6tbsps_results(src_dir):
     '''
-    read query results from 6tbsps output directory
-    only read file with ext name: .summary
+    read query results from 6tbsps output directory or a single summary file
+    only read file with ext name: .summary in a directory, or the columnar
+    tables of the directory (or a single table file) when it has any
     clean the data
     '''
-    six_content = []
-    for file_name in os.listdir(src_dir):
-        if os.path.splitext(file_name)[-1] == '.summary':
-            with open(os.path.join(src_dir, file_name), 'r') as f:
-                for line in f.readlines():
-                    line_list = line.rstrip().split('\t')
-                    qid = line_list[0].split(' ')[0]
-                    sid = line_list[1].split(' ')[0]
-                    evalue = float(line_list[-1])
-                    line_list = [qid, sid, evalue]
-                    six_content.append(line_list)
-    return six_content
+    from src.columnar import FORMATS, read_table, read_tables, table_files
+    if os.path.isdir(src_dir) and table_files(src_dir):
+        return table_frame(read_tables(src_dir))
+    if os.path.splitext(src_dir)[-1] in FORMATS.values():
+        return table_frame(read_table(src_dir))
+    qids, sids, evalues = [], [], []
+    for file_name in summary_files(src_dir):
+        with open(file_name, 'r') as f:
+            for line in f:
+                line_list = line.rstrip('\n').split('\t')
+                qids.append(line_list[0].split(' ', 1)[0])
+                sids.append(line_list[1].split(' ', 1)[0])
+                evalues.append(line_list[-1])
+    return hits_frame(qids, sids, evalues)
 
 def read_blastx_results(src_file):
     '''
-    read query results from 6tbsps output directory
+    read query results from blastx output file (tabular, outfmt 6 like)
     clean the data
     '''
-    content = []
+    qids, sids, evalues = [], [], []
     with open(src_file, 'r') as f:
-        for line in f.readlines():
-            line_list = line.rstrip().split('\t')
-            qid = line_list[0].split(' ')[0]
-            sid = line_list[1].split(' ')[0]
+        for line in f:
+            line_list = line.rstrip('\n').split('\t')
+            qids.append(line_list[0].split(' ', 1)[0])
+            sid = line_list[1].split(' ', 1)[0]
             sid = sid.replace('@', ':')
             sid = sid.split('|')
             if len(sid) == 1:
                 sid = sid[0]
             else:
                 sid = sid[1]
-            evalue = float(line_list[-2])
-            line_list = [qid, sid, evalue]
-            content.append(line_list)
-    return content
+            sids.append(sid)
+            evalues.append(line_list[-2])
+    return hits_frame(qids, sids, evalues)
 
 def main():
     '''
     Main function of the evaluator
-    Print ranking loss in console
+    Print ranking loss, hits and top-k sensitivity/precision in console
     '''
     parser = argparse.ArgumentParser(prog = 'python evaluator.py',
         description = '')
     parser.add_argument('-b', metavar='blastx_file_path',
         required = True,
         help='BLASTX query result file')
-    parser.add_argument('-s', metavar='6tbsps_directory_path',
+    parser.add_argument('-s', metavar='6tbsps_path',
         required= True,
-        help = '6TBSPs query result files directory')
-    # parser.add_argument('-o', metavar='directory_path', \
-        # required = True, help = 'output directory')
+        help = '6TBSPs query result files directory, a single summary file '
+        'or a single columnar table')
+    parser.add_argument('-k', type=int, nargs='+', default=[1, 5, 10],
+        help = 'k for sensitivity/precision at top-k (default: 1 5 10)')
+    parser.add_argument('--per-read', metavar='file_path',
+        help = 'write the per-read breakdown as TSV')
     args = parser.parse_args()
     blastx_file_path = args.b
     six_dir_path = args.s
-    six_content = read_6tbsps_results(six_dir_path)
-    blast_content = read_blastx_results(blastx_file_path)
-    ranking_loss_value = ranking_loss(six_content, blast_content)
+    six_df = read_6tbsps_results(six_dir_path)
+    blast_df = read_blastx_results(blastx_file_path)
+    reads = per_read(six_df, blast_df)
+    print('Miss: ', int((~reads['hit']).sum()))
+    print('Hit: ', int(reads['hit'].sum()))
+    ranking_loss_value = float(reads['min_rank'].mean())
     print('Ranking Loss: ', ranking_loss_value)
+    for k in args.k:
+        sensitivity, precision = top_k(six_df, blast_df, reads, k)
+        print('Top-{}: sensitivity {:.4f} precision {:.4f}'.format(
+            k, sensitivity, precision))
+    if args.per_read:
+        reads.to_csv(args.per_read, sep='\t', index_label='qid')
     return ranking_loss_value
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,135 +1,307 @@
 # -*- coding: utf-8 -*-
 """Genomic read simulator.
 
-This module simulates error-free genomic reads of arbitary length and coverage.
+This module simulates genomic reads of arbitary length and coverage. Reads are
+    generated reference by reference in segments and written as they are
+    produced, so the memory use does not grow with the size of the output.
+    Reads can be tiled (default, error-free) or placed at random with a
+    fixed seed, and carry substitution/insertion/deletion errors.
 
-Author: 
+Author:
     Yuchen (Peter) Ge
 
-Email: 
+Email:
     yge15@jhmi.edu
-    
+
 Usage:
     $ python read_simulator.py -l $readLength -c $coverage ref.fa ...
+    $ python read_simulator.py -l 150 -c 30 --random --seed 1 --sub 0.01 \
+        --ins 0.001 --del 0.001 --fastq -p 8 -o reads.fq ref.fa ...
 
 Attributes:
-    parse_fasta(str):  parse one or more input FASTA reference(s)
-    
-    write_fasta(list): print a FASTA-like input to stdout
-    
-    read_simulation(str, int, int): simulate error-free reads by scanning 
-        through the geome
+    write_fasta(iterable): write FASTA reads as they are generated
+
+    write_fastq(iterable, str): write FASTQ reads as they are generated
+
+    read_simulation(dict, int, float): simulate reads from references,
+        yielding (readID, readSeq) one at a time
+
+    simulate_segment(tuple): simulate the reads of one segment of one
+        reference, the unit of work of the multi-process mode
 
 
 """
 import sys
+import math
+import random
 import argparse
+import multiprocessing
+
+import src.file_io as fio
+#%%
+# reads are generated in segments of this many reference positions
+SEGMENT = 1000000
+BASES = 'ACGT'
 #%%
-def parse_fasta(fn, seqs):
-    """Parse referece sequences from a FASTA file name. 
-        For each entry, return a dictionary that maps its sequence identifier 
-        to the nuleotide sequeneces.
-    
+def mutate(seq, start, readLen, model, rng):
+    """Copy a read from the reference starting at start, applying the error
+        model. Deletions consume extra reference bases so the read keeps its
+        length unless the reference ends first.
+
     Args:
-        fn (str):       file name of the FASTA file
-        seqs (dict):    dictionary of sequences identifiers to nucleitode 
-                        sequences
+        seq (str):          reference sequence
+        start (int):        start position of the read in seq
+        readLen (int):      read length
+        model (tuple):      (substitution, insertion, deletion) rates
+        rng (Random):       random number generator
 
     Returns:
-        None
-    
-    """ 
-    with open(fn) as fh:
-        while True:
-            line = fh.readline()
-            if len(line) == 0:
-                break  # end of file
-            if line.startswith('>'):
-                name = line[1:].rstrip()
-                seq = ''
-            else:
-                seq += line.rstrip()
-            
-            seqs[name] = seq
-            
-    return
+        read (str):         read sequence
+
+    """
+    sub, ins, dele = model
+    read = []
+    i = start
+    while len(read) < readLen and i < len(seq):
+        r = rng.random()
+        if r < dele:
+            i += 1
+        elif r < dele + ins:
+            read.append(rng.choice(BASES))
+        elif r < dele + ins + sub:
+            base = seq[i]
+            read.append(rng.choice([b for b in BASES if b != base]))
+            i += 1
+        else:
+            read.append(seq[i])
+            i += 1
+
+    return ''.join(read)
 #%%
-def read_simulation(seqs, readLen, cov):
-    """Simulate error-free reads from referece sequences, given a specific read
-        length and coverage. 
-        Return a list of tuples of read identifier with range in the original 
-        reference and read sequence, in the alphabetically order of the 
-        original sequence identifiers.
-    
+def segment_positions(num_pos, seg_start, seg_end, readLen, cov, placement, rng):
+    """Start positions of the reads of one segment.
+        Tiled reads start every readLen/cov positions. Random reads are
+        stratified: each segment receives its share of the reads of the
+        reference, placed uniformly at random and sorted.
+
     Args:
-        seqs (dict):        dictionary of sequences identifiers to nucleitode 
-                            sequences
+        num_pos (int):      number of valid start positions in the reference
+        seg_start (int):    first position of the segment
+        seg_end (int):      one past the last position of the segment
         readLen (int):      read length
         cov (float):        coverage, i.e. read depth
+        placement (str):    'tile' or 'random'
+        rng (Random):       random number generator of the segment
 
     Returns:
-        reads (list):       list of tuples of (readID, readSeq) for each
-                            error-free simulated read
-    
-    """ 
+        positions (iterable):   start positions in increasing order
+
+    """
+    if placement == 'tile':
+        step = int(readLen/cov)
+        first = -(-seg_start // step) * step
+        return range(first, seg_end, step)
+    num_reads = num_pos * cov / readLen
+    count = int(round(num_reads * seg_end / num_pos)) - \
+        int(round(num_reads * seg_start / num_pos))
+    return sorted([rng.randrange(seg_start, seg_end) for _ in range(count)])
+#%%
+def simulate_segment(task):
+    """Simulate the reads of one segment of a reference.
+        Each segment has its own random number generator, seeded from the
+        global seed, the reference name and the segment number, so the
+        output does not depend on the number of processes.
+
+    Args:
+        task (tuple):       (name, seq, offset, num_pos, seg_start, seg_end,
+                            readLen, cov, placement, model, seed), where seq
+                            is the slice of the reference starting at offset
+
+    Returns:
+        reads (list):       list of tuples of (readID, readSeq)
+
+    """
+    name, seq, offset, num_pos, seg_start, seg_end, readLen, cov, \
+        placement, model, seed = task
+    rng = random.Random('%s:%s:%d' % (seed, name, seg_start))
+    prefix = name.split()[0]
+    error_free = not any(model)
     reads = []
-    for name in sorted(seqs):
-        seq = seqs[name]
-        for i in range(0, len(seq) - readLen + 1, int(readLen/cov)):
-            readID = name.split()[0] + '_%d_%d' % (i, i + readLen)
-            readSeq = seq[i: i + readLen]
-            reads.append((readID, readSeq))
-    
-    return reads     
+    for i in segment_positions(num_pos, seg_start, seg_end, readLen, cov,
+                               placement, rng):
+        readID = prefix + '_%d_%d' % (i, i + readLen)
+        if error_free:
+            readSeq = seq[i - offset: i - offset + readLen]
+        else:
+            readSeq = mutate(seq, i - offset, readLen, model, rng)
+        reads.append((readID, readSeq))
+
+    return reads
 #%%
-def write_fasta(reads):
-    """Write to standard output the simulated reads.
-    
+def segment_tasks(refs, readLen, cov, placement='tile', model=(0., 0., 0.),
+                  seed=0):
+    """Split references into segment tasks for simulate_segment().
+
     Args:
-        reads (list):   list of tuples of (readID, readSeq) for each
-                        error-free simulated read
-    
+        refs (iterable):    (name, seq) of each reference
+        readLen (int):      read length
+        cov (float):        coverage, i.e. read depth
+        placement (str):    'tile' or 'random'
+        model (tuple):      (substitution, insertion, deletion) rates
+        seed (int):         random seed
+
+    Yields:
+        task (tuple):       the argument of simulate_segment()
+
+    """
+    # deletions may read past the end of a segment
+    slack = readLen * 2 if any(model) else readLen
+    for name, seq in refs:
+        num_pos = len(seq) - readLen + 1
+        for seg_start in range(0, max(num_pos, 0), SEGMENT):
+            seg_end = min(seg_start + SEGMENT, num_pos)
+            yield (name, seq[seg_start: seg_end - 1 + slack], seg_start,
+                   num_pos, seg_start, seg_end, readLen, cov, placement,
+                   model, seed)
+#%%
+def read_simulation(seqs, readLen, cov, placement='tile', model=(0., 0., 0.),
+                    seed=0, num_proc=1):
+    """Simulate reads from referece sequences, given a specific read length
+        and coverage.
+        Yield tuples of read identifier with range in the original reference
+        and read sequence, in the alphabetically order of the original
+        sequence identifiers when seqs is a dictionary, or in the order of
+        the references otherwise.
+
+    Args:
+        seqs (dict/iterable):   dictionary of sequences identifiers to
+                                nucleitode sequences, or an iterable of
+                                (name, seq) such as fio.read_fasta()
+        readLen (int):          read length
+        cov (float):            coverage, i.e. read depth
+        placement (str):        'tile' (default) or 'random'
+        model (tuple):          (substitution, insertion, deletion) rates
+        seed (int):             random seed
+        num_proc (int):         number of processes
+
+    Yields:
+        (readID, readSeq):      one simulated read
+
+    """
+    if isinstance(seqs, dict):
+        refs = ((name, seqs[name]) for name in sorted(seqs))
+    else:
+        refs = seqs
+    tasks = segment_tasks(refs, readLen, cov, placement, model, seed)
+    if num_proc > 1:
+        with multiprocessing.Pool(processes=num_proc) as pool:
+            for reads in pool.imap(simulate_segment, tasks):
+                yield from reads
+    else:
+        for task in tasks:
+            yield from simulate_segment(task)
+#%%
+def write_fasta(reads, out=None):
+    """Write the simulated reads in FASTA format as they are generated.
+
+    Args:
+        reads (iterable):   (readID, readSeq) of each simulated read
+        out (handle):       output file handle (default: stdout)
+
+    Returns:
+        None
+
+    """
+    if out is None:
+        out = sys.stdout
+    for readID, readSeq in reads:
+        out.write('>' + readID + '\n' + readSeq + '\n')
+
+    return
+
+#%%
+def write_fastq(reads, qual='I', out=None):
+    """Write the simulated reads in FASTQ format as they are generated.
+
+    Args:
+        reads (iterable):   (readID, readSeq) of each simulated read
+        qual (str):         Phred+33 quality character of every base
+        out (handle):       output file handle (default: stdout)
+
     Returns:
         None
-    
-    """ 
+
+    """
+    if out is None:
+        out = sys.stdout
     for readID, readSeq in reads:
-        readID  =  '>' + readID
-        sys.stdout.write(readID + '\n')
-        sys.stdout.write(readSeq + '\n')
-        
+        out.write('@' + readID + '\n' + readSeq + '\n+\n' +
+                  qual * len(readSeq) + '\n')
+
     return
-        
 #%%
-def write_fastq(reads):
-    pass
+def phred_char(model):
+    """Phred+33 quality character matching the total error rate (max 40)"""
+    rate = sum(model)
+    q = 40 if rate <= 0 else min(40, int(round(-10 * math.log10(rate))))
+    return chr(33 + q)
 #%%
 def main():
     """Main driver function of the program.
-    
+
     """
     parser = argparse.ArgumentParser(prog='read_simulator', \
                                      description= 'This module simulates '
-                                     'error-free genomic reads of arbitary '
+                                     'genomic reads of arbitary '
                                      'length and coverage.')
     parser.add_argument('-l', nargs=1, help='read length')
     parser.add_argument('-c', nargs=1, help='coverage')
-    parser.add_argument('refs', metavar='ref.fa', nargs='+', 
+    parser.add_argument('-o', help='output file (default: stdout)')
+    parser.add_argument('-p', default=1, type=int,
+                        help='number of processes (default: 1)')
+    parser.add_argument('--fastq', action='store_true',
+                        help='write FASTQ instead of FASTA')
+    parser.add_argument('--random', action='store_true',
+                        help='random instead of tiled read placement')
+    parser.add_argument('--seed', default=0, type=int,
+                        help='random seed (default: 0)')
+    parser.add_argument('--sub', default=0., type=float,
+                        help='substitution rate per base (default: 0)')
+    parser.add_argument('--ins', default=0., type=float,
+                        help='insertion rate per base (default: 0)')
+    parser.add_argument('--del', dest='dele', default=0., type=float,
+                        help='deletion rate per base (default: 0)')
+    parser.add_argument('refs', metavar='ref.fa', nargs='+',
                         help='FASTA references')
-    
+
     args = parser.parse_args()
     readLen = int(args.l[0])
     cov = float(args.c[0])
     refSeqs_fn = args.refs
-    
-    refSeqs = {}
-    for name in refSeqs_fn:
-        parse_fasta(name, refSeqs)
-
-    reads = read_simulation(refSeqs, readLen, cov)
-    write_fasta(reads)
-    
-    return    
+    placement = 'random' if args.random else 'tile'
+    model = (args.sub, args.ins, args.dele)
+
+    # tiled reads keep the historical alphabetical order of references
+    if placement == 'tile':
+        refSeqs = {}
+        for name in refSeqs_fn:
+            refSeqs.update(fio.read_fasta(name))
+    else:
+        refSeqs = (ref for name in refSeqs_fn for ref in fio.read_fasta(name))
+
+    reads = read_simulation(refSeqs, readLen, cov, placement, model,
+                            args.seed, args.p)
+    out = open(args.o, 'w') if args.o else sys.stdout
+    try:
+        if args.fastq:
+            write_fastq(reads, phred_char(model), out)
+        else:
+            write_fasta(reads, out)
+    finally:
+        if args.o:
+            out.close()
+
+    return
 #%%
-if __name__ == "__main__": 
+if __name__ == "__main__":
     main()
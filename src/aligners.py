@@ -0,0 +1,808 @@
+# -*- coding: utf-8 -*-
+"""Registry of local alignment backends.
+
+This module collects the implementations of the affine local alignment that
+    6tbsps-query.py can use, and its gap models. Every backend is a class
+    with the interface of LocalAlignment, and fills exactly the same X, Y
+    and M matrices as the reference implementation, or for IntAlignment the
+    steps its traceback takes through them, so tracebacks and outputs do
+    not depend on the backend. A linear gap model is the affine one without
+    an opening penalty, where X and Y are M one cell up or left plus the
+    extension, so every backend fills and traces back M alone for it.
+    Backends take the cell scores from the QueryProfile of the query, built
+    once for all of its candidates. benchmark.py --aligners checks every
+    backend against the reference and reports its DP cells per second.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py --aligner.
+
+Attributes:
+    ALIGNERS (dict): a dictionary that maps each backend name to its class
+
+    register(str): class decorator adding a backend to ALIGNERS
+
+    get_aligner(str): the class of a backend
+
+    GAP_MODELS (dict): a dictionary that maps each gap model name to its
+        (gap_open, gap_ext) penalties, gap_open 0 for linear gaps
+
+    NumpyAlignment: columns of the DP filled with vectorized NumPy steps
+
+    JitAlignment: the DP loops compiled with numba, or NumpyAlignment when
+        numba is not installed
+
+    BatchAlignment: one query against many subjects, padded into one array
+        and filled one column step at a time for all subjects
+
+    IntAlignment: integer columns and a uint8 direction matrix instead of
+        the X, Y and M matrices, traced back by following the directions
+
+    HirschbergAlignment: IntAlignment keeping no directions, whose
+        traceback splits the path where it crosses the middle of the DP and
+        traces both parts again, in O(m + n) memory
+
+    align_all(type, str, list, dict): align a query against all of its
+        candidate subjects with a backend, in batches when it supports them
+
+"""
+#%%
+import numpy as np
+
+from src.local_alignment_affine import LocalAlignment
+from src.query_profile import QueryProfile, encode
+#%%
+ALIGNERS = {}
+
+def register(name):
+    """Class decorator adding an aligner backend to the registry"""
+    def wrap(cls):
+        ALIGNERS[name] = cls
+        return cls
+    return wrap
+
+def get_aligner(name):
+    """Return the aligner class registered under name.
+
+    Args:
+        name (str):         backend name, one of ALIGNERS
+
+    Returns:
+        cls (type):         a class with the interface of LocalAlignment
+
+    """
+    if name not in ALIGNERS:
+        raise ValueError('unknown aligner {}, choose from {}'.format(
+            name, ', '.join(sorted(ALIGNERS))))
+    return ALIGNERS[name]
+
+register('reference')(LocalAlignment)
+
+# a gap of length L costs gap_open + L * gap_ext; the linear penalty is that
+# of an affine gap of 3 residues per residue
+GAP_MODELS = {'affine': (-12., -4.), 'linear': (0., -8.)}
+#%%
+@register('numpy')
+class NumpyAlignment(LocalAlignment):
+    def fill_matrix(self):
+        """Fill the matrices column by column with NumPy.
+            Y of a column only depends on the previous column. Within a
+            column, X[i] is the best M[i'] + go + ge * (i - i') over i' < i,
+            where opening from an M that is itself an X never wins, so X is
+            a running maximum over the match and Y scores of the column.
+            With linear gaps, M is that running maximum itself.
+
+        return:
+            self.score
+
+        """
+        scores = self.query_profile().subject_scores(self.y)
+        dim_i = len(self.x) + 1
+        dim_j = len(self.y) + 1
+        X, Y, M = self.X, self.Y, self.M
+        go, ge = self.go, self.ge
+        rows = np.arange(dim_i)
+        D = np.zeros(dim_i)
+        for j in range(1, dim_j):
+            if X is None:
+                D[1:] = np.maximum(np.maximum(M[:-1, j-1] + scores[:, j-1],
+                                              M[1:, j-1] + ge), 0)
+                M[1:, j] = ge * rows[1:] + np.maximum.accumulate(D - ge * rows)[1:]
+                continue
+            Y[1:, j] = np.maximum(M[1:, j-1] + go + ge, Y[1:, j-1] + ge)
+            D[1:] = np.maximum(np.maximum(M[:-1, j-1] + scores[:, j-1],
+                                          Y[1:, j]), 0)
+            best = np.maximum.accumulate(D - ge * rows)
+            X[1:, j] = go + ge * rows[1:] + best[:-1]
+            M[1:, j] = np.maximum(D[1:], X[1:, j])
+        argmax = np.where(M == M.max())
+        self.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
+        self.score = int(M[self.max_loc_list[0]])
+        return self.score
+#%%
+def _affine_kernel(scores, yi, go, ge, X, Y, M):
+    """The loops of LocalAlignment.fill_matrix over profile scores"""
+    for j in range(1, len(yi) + 1):
+        for i in range(1, scores.shape[0] + 1):
+            X[i, j] = max(M[i-1, j] + go + ge, X[i-1, j] + ge)
+            Y[i, j] = max(M[i, j-1] + go + ge, Y[i, j-1] + ge)
+            M[i, j] = max(M[i-1, j-1] + scores[i-1, yi[j-1]],
+                          X[i, j], Y[i, j], 0.)
+
+def _linear_kernel(scores, yi, ge, M):
+    """The loops of LocalAlignment.fill_linear over profile scores"""
+    for j in range(1, len(yi) + 1):
+        for i in range(1, scores.shape[0] + 1):
+            M[i, j] = max(M[i-1, j-1] + scores[i-1, yi[j-1]],
+                          M[i-1, j] + ge, M[i, j-1] + ge, 0.)
+
+# the compiled kernels, or False without numba; numba is imported on first
+# use since importing it takes longer than most short runs
+_jit_kernels = {}
+
+def jit_kernel(kernel=_affine_kernel):
+    """The numba-compiled kernel, or None when numba is not installed"""
+    if kernel not in _jit_kernels:
+        try:
+            import numba
+            _jit_kernels[kernel] = numba.njit(cache=True)(kernel)
+        except ImportError:
+            _jit_kernels[kernel] = False
+    return _jit_kernels[kernel] or None
+
+@register('numba')
+class JitAlignment(NumpyAlignment):
+    def fill_matrix(self):
+        """Fill the matrices with the numba-compiled loops of the reference
+            implementation; without numba, fall back to NumpyAlignment.
+
+        return:
+            self.score
+
+        """
+        kernel = jit_kernel(_affine_kernel if self.X is not None else _linear_kernel)
+        if kernel is None:
+            return NumpyAlignment.fill_matrix(self)
+        profile = self.query_profile()
+        codes = encode(self.y, profile.alphabet)
+        if self.X is None:
+            kernel(profile.scores, codes, float(self.ge), self.M)
+        else:
+            kernel(profile.scores, codes, float(self.go), float(self.ge), self.X,
+                   self.Y, self.M)
+        argmax = np.where(self.M == self.M.max())
+        self.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
+        self.score = int(self.M[self.max_loc_list[0]])
+        return self.score
+#%%
+# DP cells of one batch of BatchAlignment, which bounds its memory
+BATCH_CELLS = 1 << 22
+
+@register('batch')
+class BatchAlignment(LocalAlignment):
+    @classmethod
+    def align_all(cls, seq_x, seqs_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                  profile=None):
+        """Align seq_x against every sequence of seqs_y.
+            Subjects are sorted by length and cut into batches of at most
+            BATCH_CELLS cells whose subjects are at least half as long as
+            the longest one, so that little of a batch is padding.
+
+        Args:
+            seq_x (str):            query sequence
+            seqs_y (list):          subject sequences
+            score_matrix (dict):    score matrix
+            gap_open (float):       gap opening
+            gap_ext (float):        gap extension
+            profile (QueryProfile): profile of seq_x, built when None
+
+        Returns:
+            alignments (list):      a filled BatchAlignment per subject, in
+                                    the order of seqs_y
+
+        """
+        if profile is None:
+            profile = QueryProfile(seq_x, score_matrix)
+        alignments = [None] * len(seqs_y)
+        order = sorted(range(len(seqs_y)), key=lambda b: -len(seqs_y[b]))
+        dim_i = len(seq_x) + 1
+        start = 0
+        while start < len(order):
+            longest = len(seqs_y[order[start]])
+            end = start + max(1, BATCH_CELLS // (dim_i * (longest + 1)))
+            chunk = [b for b in order[start:end]
+                     if 2 * len(seqs_y[b]) >= longest]
+            batch = cls.fill_batch(seq_x, [seqs_y[b] for b in chunk],
+                                   score_matrix, gap_open, gap_ext, profile)
+            for b, la in zip(chunk, batch):
+                alignments[b] = la
+            start += len(chunk)
+        return alignments
+
+    @classmethod
+    def fill_batch(cls, seq_x, seqs_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                   profile=None):
+        """Fill the matrices of seq_x against a batch of subjects at once.
+            The matrices are stored as [column, subject, row], subjects are
+            padded with 'X' to the longest one, and each column step runs
+            the recurrences of NumpyAlignment for all subjects, of M alone
+            with linear gaps. Padding only follows the last column of a
+            subject, so it never changes its cells.
+
+        Args:
+            seq_x (str):            query sequence
+            seqs_y (list):          subject sequences
+            score_matrix (dict):    score matrix
+            gap_open (float):       gap opening
+            gap_ext (float):        gap extension
+            profile (QueryProfile): profile of seq_x, built when None
+
+        Returns:
+            alignments (list):      a BatchAlignment per subject, whose X, Y
+                                    and M are views of the batch matrices
+                                    (X and Y None with linear gaps), with
+                                    its score and max_loc_list set
+
+        """
+        if profile is None:
+            profile = QueryProfile(seq_x, score_matrix)
+        alphabet = profile.alphabet
+        lens = [len(y) for y in seqs_y]
+        dim_i = len(seq_x) + 1
+        dim_j = max(lens) + 1
+        num = len(seqs_y)
+        yi = np.full((num, dim_j - 1), alphabet['X'], dtype=np.intp)
+        for b, y in enumerate(seqs_y):
+            yi[b, :len(y)] = encode(y, alphabet)
+
+        # scores of every cell, gathered once as [column, subject, row]
+        scores = np.ascontiguousarray(profile.scores.T[yi.T])
+        go, ge = gap_open, gap_ext
+        rows = np.arange(dim_i)
+        D = np.zeros((num, dim_i))
+        M = np.zeros((dim_j, num, dim_i))
+        if go == 0:
+            X = Y = None
+            for j in range(1, dim_j):
+                D[:, 1:] = np.maximum(np.maximum(M[j-1, :, :-1] + scores[j-1],
+                                                 M[j-1, :, 1:] + ge), 0)
+                best = np.maximum.accumulate(D - ge * rows, axis=1)
+                M[j, :, 1:] = ge * rows[1:] + best[:, 1:]
+            return cls.batch_alignments(seq_x, seqs_y, score_matrix, gap_open,
+                                        gap_ext, profile, X, Y, M)
+
+        # first row/col as in LocalAlignment.__init__
+        X = np.zeros((dim_j, num, dim_i))
+        Y = np.zeros((dim_j, num, dim_i))
+        X[0] = np.nan
+        X[1:, :, 0] = -np.inf
+        Y[0, :, 0] = np.nan
+        Y[0, :, 1:] = -np.inf
+        Y[1:, :, 0] = np.nan
+        for j in range(1, dim_j):
+            Y[j, :, 1:] = np.maximum(M[j-1, :, 1:] + go + ge, Y[j-1, :, 1:] + ge)
+            D[:, 1:] = np.maximum(np.maximum(M[j-1, :, :-1] + scores[j-1],
+                                             Y[j, :, 1:]), 0)
+            best = np.maximum.accumulate(D - ge * rows, axis=1)
+            X[j, :, 1:] = go + ge * rows[1:] + best[:, :-1]
+            M[j, :, 1:] = np.maximum(D[:, 1:], X[j, :, 1:])
+        return cls.batch_alignments(seq_x, seqs_y, score_matrix, gap_open, gap_ext,
+                                    profile, X, Y, M)
+
+    @classmethod
+    def batch_alignments(cls, seq_x, seqs_y, score_matrix, gap_open, gap_ext,
+                         profile, X, Y, M):
+        """A BatchAlignment per subject over the filled batch matrices"""
+        lens = [len(y) for y in seqs_y]
+        alignments = []
+        for b, y in enumerate(seqs_y):
+            la = cls.__new__(cls)
+            la.score_matrix = score_matrix
+            la.go = gap_open
+            la.ge = gap_ext
+            la.x = seq_x
+            la.y = y
+            la.profile = profile
+            la.X = X[:lens[b]+1, b].T if X is not None else None
+            la.Y = Y[:lens[b]+1, b].T if Y is not None else None
+            la.M = M[:lens[b]+1, b].T
+            argmax = np.where(la.M == la.M.max())
+            la.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
+            la.score = int(la.M[la.max_loc_list[0]])
+            alignments.append(la)
+        return alignments
+
+    def fill_matrix(self):
+        """Fill the matrices as a batch of one subject
+
+        return:
+            self.score
+
+        """
+        la = self.fill_batch(self.x, [self.y], self.score_matrix, self.go, self.ge,
+                             self.query_profile())[0]
+        self.X, self.Y, self.M = la.X, la.Y, la.M
+        self.max_loc_list = la.max_loc_list
+        self.score = la.score
+        return self.score
+#%%
+# directions of IntAlignment, in the order LocalAlignment.traceback tries them
+STOP, LEFT, UP, DIAG = 0, 1, 2, 3
+# below any reachable gap score, with room to add gap penalties in int32
+NEG = np.iinfo(np.int32).min // 2
+# DP columns of IntAlignment whose directions are found in one step
+TRACE_BLOCK = 64
+# cells of the regions whose directions HirschbergAlignment keeps to trace them
+TRACE_CELLS = 1 << 16
+
+@register('int')
+class IntAlignment(NumpyAlignment):
+    def __init__(self, seq_x, seq_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                 profile=None):
+        """Init the alignment without the X, Y and M matrices; fractional gap
+            penalties fall back to the float matrices of NumpyAlignment.
+
+        self:
+            trace (numpy.array):    uint8 direction of every cell, indexed
+                                    [column, row] and set by fill_matrix, or
+                                    None with float matrices
+
+        """
+        if gap_open != int(gap_open) or gap_ext != int(gap_ext):
+            NumpyAlignment.__init__(self, seq_x, seq_y, score_matrix, gap_open,
+                                    gap_ext, profile)
+            self.trace = None
+            return
+        self.score_matrix = score_matrix
+        self.go = gap_open
+        self.ge = gap_ext
+        self.x = seq_x
+        self.y = seq_y
+        self.profile = profile
+        self.trace = np.zeros((len(seq_y) + 1, len(seq_x) + 1), dtype=np.uint8)
+
+    def columns(self, j_start, j_end, M0, Y0):
+        """Fill the columns j_start to j_end - 1 of NumpyAlignment in int32,
+            from the M and Y of column j_start - 1, in blocks of
+            TRACE_BLOCK columns. With linear gaps only M is filled, and X
+            and Y of a block are M one row up or one column left plus ge.
+
+        Args:
+            j_start, j_end (int):   first and past the last column
+            M0, Y0 (numpy.array):   M and Y of column j_start - 1, Y0 None
+                                    with linear gaps
+
+        Yields:
+            (j0, n, M, X, Y):       the block of columns j0 to j0 + n - 2
+                                    in rows 1 to n - 1 of M, X and Y, whose
+                                    row 0 holds the column before, valid
+                                    until the next block
+        """
+        # the scores of a column are a row of the transposed profile
+        table = np.ascontiguousarray(self.query_profile().scores.T, dtype=np.int32)
+        codes = encode(self.y, self.query_profile().alphabet)
+        dim_i = len(self.x) + 1
+        go, ge = int(self.go), int(self.ge)
+        rows = np.arange(dim_i, dtype=np.int32)
+        num = min(TRACE_BLOCK, j_end - j_start) + 1
+        M = np.zeros((num, dim_i), dtype=np.int32)
+        X = np.full((num, dim_i), NEG, dtype=np.int32)
+        Y = np.full((num, dim_i), NEG, dtype=np.int32)
+        D = np.zeros(dim_i, dtype=np.int32)
+        M[0] = M0
+        if go == 0:
+            for j0 in range(j_start, j_end, TRACE_BLOCK):
+                j1 = min(j0 + TRACE_BLOCK, j_end)
+                for b, j in enumerate(range(j0, j1), 1):
+                    D[1:] = np.maximum(np.maximum(M[b-1, :-1] + table[codes[j-1]],
+                                                  M[b-1, 1:] + ge), 0)
+                    M[b] = ge * rows + np.maximum.accumulate(D - ge * rows)
+                n = j1 - j0 + 1
+                X[1:n, 1:] = M[1:n, :-1] + ge
+                Y[1:n, 1:] = M[:n-1, 1:] + ge
+                yield j0, n, M, X, Y
+                M[0] = M[n-1]
+            return
+        Y[0] = Y0
+        for j0 in range(j_start, j_end, TRACE_BLOCK):
+            j1 = min(j0 + TRACE_BLOCK, j_end)
+            for b, j in enumerate(range(j0, j1), 1):
+                Y[b, 1:] = np.maximum(M[b-1, 1:] + (go + ge), Y[b-1, 1:] + ge)
+                D[1:] = np.maximum(np.maximum(M[b-1, :-1] + table[codes[j-1]],
+                                              Y[b, 1:]), 0)
+                X[b, 1:] = go + ge * rows[1:] + np.maximum.accumulate(D - ge * rows)[:-1]
+                np.maximum(D, X[b], out=M[b])
+                M[b, 0] = 0
+            n = j1 - j0 + 1
+            yield j0, n, M, X, Y
+            M[0], X[0], Y[0] = M[n-1], X[n-1], Y[n-1]
+
+    @staticmethod
+    def directions(step, M, X, Y):
+        """Step of LocalAlignment.traceback from each cell of a block: DIAG,
+            overwritten by UP where M equals X, then by LEFT where M equals
+            Y, then by STOP where M is 0"""
+        step.fill(DIAG)
+        step[M == X] = UP
+        step[M == Y] = LEFT
+        step[M == 0] = STOP
+
+    def fill_matrix(self):
+        """Fill the columns of NumpyAlignment in int32 and keep, for every
+            cell, only the step LocalAlignment.traceback takes from it:
+            LEFT when M equals Y, else UP when M equals X, else DIAG, and
+            STOP where M is 0. The maxima are collected column by column.
+            One byte per cell replaces the three float64 matrices.
+
+        return:
+            self.score
+
+        """
+        if self.trace is None:
+            return NumpyAlignment.fill_matrix(self)
+        # rows of trace are the columns of the DP
+        dim_i = len(self.x) + 1
+        dim_j = len(self.y) + 1
+        best = 0
+        maxima = []
+        for j0, n, M, X, Y in self.columns(1, dim_j, np.zeros(dim_i, dtype=np.int32),
+                                           np.full(dim_i, NEG, dtype=np.int32)):
+            Mb = M[1:n]
+            self.directions(self.trace[j0:j0 + n - 1], Mb, X[1:n], Y[1:n])
+            best, maxima = self.collect(Mb, j0, best, maxima)
+        self.finish(best, maxima, dim_i, dim_j)
+        return self.score
+
+    @staticmethod
+    def collect(M, j0, best, maxima):
+        """Best score and its cells so far, after the block of columns from j0"""
+        top = M.max()
+        if top > best:
+            best = top
+            maxima = []
+        if top == best and best > 0:
+            cols, hits = np.nonzero(M == top)
+            maxima.extend([(int(i), int(c) + j0) for c, i in zip(cols, hits)])
+        return best, maxima
+
+    def finish(self, best, maxima, dim_i, dim_j):
+        if best == 0:
+            # as np.where over an all-zero M
+            maxima = [(i, j) for i in range(dim_i) for j in range(dim_j)]
+        self.max_loc_list = sorted(maxima)
+        self.score = int(best)
+
+    def path(self, i, j):
+        """Steps of LocalAlignment.traceback from the cell (i, j), and the
+            cell where it stops"""
+        steps = []
+        step = self.trace[j, i]
+        while step != STOP:
+            steps.append(step)
+            if step != UP:
+                j -= 1
+            if step != LEFT:
+                i -= 1
+            step = self.trace[j, i]
+        return steps, i, j
+
+    def traceback(self):
+        """Follow the directions from each maximum, the steps of
+            LocalAlignment.traceback without recomputing any score.
+
+        return:
+            self.score
+            self.align_seq_x_list
+            self.align_seq_y_list
+            self.xscript_list
+            self.max_loc_x_list
+            self.max_loc_y_list
+
+        """
+        if self.trace is None:
+            return LocalAlignment.traceback(self)
+        self.align_seq_x_list = []
+        self.align_seq_y_list = []
+        self.xscript_list = []
+        self.max_loc_x_list = []
+        self.max_loc_y_list = []
+        for i, j in self.max_loc_list:
+            align_seq_x = []
+            align_seq_y = []
+            xscript = []
+            max_loc_x = [0, i - 1]
+            max_loc_y = [0, j - 1]
+            steps, max_loc_x[0], max_loc_y[0] = self.path(i, j)
+            for step in steps:
+                if step == LEFT:
+                    align_seq_x.append('_')
+                    align_seq_y.append(self.y[j-1])
+                    xscript.append(' ')
+                    j -= 1
+                elif step == UP:
+                    align_seq_x.append(self.x[i-1])
+                    align_seq_y.append('_')
+                    xscript.append(' ')
+                    i -= 1
+                else:
+                    align_seq_x.append(self.x[i-1])
+                    align_seq_y.append(self.y[j-1])
+                    xscript.append('|' if self.x[i-1] == self.y[j-1] else '*')
+                    i -= 1
+                    j -= 1
+
+            self.align_seq_x_list.append(''.join(align_seq_x[::-1]))
+            self.align_seq_y_list.append(''.join(align_seq_y[::-1]))
+            self.xscript_list.append(''.join(xscript[::-1]))
+            self.max_loc_x_list.append(max_loc_x)
+            self.max_loc_y_list.append(max_loc_y)
+
+        return self.score, \
+               self.align_seq_x_list, self.align_seq_y_list, self.xscript_list, \
+               self.max_loc_x_list, self.max_loc_y_list
+#%%
+@register('hirschberg')
+class HirschbergAlignment(IntAlignment):
+    def __init__(self, seq_x, seq_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                 profile=None):
+        """Init the alignment of IntAlignment without its direction matrix.
+
+        self:
+            trace (numpy.array):    empty, or None with float matrices
+
+        """
+        if gap_open != int(gap_open) or gap_ext != int(gap_ext):
+            IntAlignment.__init__(self, seq_x, seq_y, score_matrix, gap_open,
+                                  gap_ext, profile)
+            return
+        self.score_matrix = score_matrix
+        self.go = gap_open
+        self.ge = gap_ext
+        self.x = seq_x
+        self.y = seq_y
+        self.profile = profile
+        self.trace = np.zeros((0, len(seq_x) + 1), dtype=np.uint8)
+
+    def fill_matrix(self):
+        """Fill the columns of IntAlignment and keep only the maxima, in
+            O(m) memory; the traceback fills again the regions its path
+            goes through.
+
+        return:
+            self.score
+
+        """
+        if self.trace is None:
+            return NumpyAlignment.fill_matrix(self)
+        dim_i = len(self.x) + 1
+        dim_j = len(self.y) + 1
+        best = 0
+        maxima = []
+        for j0, n, M, X, Y in self.columns(1, dim_j, np.zeros(dim_i, dtype=np.int32),
+                                           np.full(dim_i, NEG, dtype=np.int32)):
+            best, maxima = self.collect(M[1:n], j0, best, maxima)
+        self.finish(best, maxima, dim_i, dim_j)
+        return self.score
+
+    def sweep(self, region, left, upper, split=None, cols=(), rows=(), trace=None):
+        """Fill the cells of a region column by column as columns does, from
+            the column before it and the row above it, and the directions
+            of its cells.
+
+        Args:
+            region (tuple):         top, bottom, lo, hi: its rows top to
+                                    bottom and columns lo to hi
+            left (tuple):           M and Y of column lo - 1 in rows top - 1
+                                    to bottom
+            upper (tuple):          M and X of row top - 1 in columns lo - 1
+                                    to hi
+            split (tuple):          (1, k) or (0, k): find the row of column
+                                    k, or the column of row k, where the path
+                                    from the bottom right cell first reaches
+                                    it
+            cols (tuple):           columns to keep, as left
+            rows (tuple):           rows to keep, as upper
+            trace (numpy.array):    filled with the directions of the region,
+                                    indexed [column - lo, row - top + 1]
+
+        Returns:
+            cross (int):            that row or column, -1 if the path stops
+                                    before it, None without split
+            kept (dict):            kept columns by (1, column) and rows by
+                                    (0, row)
+
+        """
+        top, bottom, lo, hi = region
+        go, ge = int(self.go), int(self.ge)
+        h = bottom - top + 1
+        # row 0 of every column of the region is row top - 1
+        rows_ = np.arange(h + 1, dtype=np.int32)
+        M, Y = left
+        up_M, up_X = upper
+        kept = {}
+        for r in rows:
+            kept[0, r] = (np.empty(hi - lo + 2, dtype=np.int32),
+                          np.full(hi - lo + 2, NEG, dtype=np.int32))
+            kept[0, r][0][0] = M[r - top + 1]
+        step = np.empty(h + 1, dtype=np.uint8)
+        step[0] = STOP
+        cross = np.full(h + 1, -1, dtype=np.int64)
+        base = np.empty(h + 1, dtype=np.int64)
+        D = np.empty(h + 1, dtype=np.int32)
+        for j in range(lo, hi + 1):
+            k = j - lo + 1
+            Yj = np.full(h + 1, NEG, dtype=np.int32)
+            Yj[1:] = np.maximum(M[1:] + (go + ge), Y[1:] + ge)
+            D[1:] = np.maximum(np.maximum(M[:-1] + self.table[self.codes[j-1], top-1:bottom],
+                                          Yj[1:]), 0)
+            # a gap coming down from row top - 1
+            D[0] = max(up_M[k], up_X[k] - go)
+            Xj = np.empty(h + 1, dtype=np.int32)
+            Xj[0] = up_X[k]
+            Xj[1:] = go + ge * rows_[1:] + np.maximum.accumulate(D - ge * rows_)[:-1]
+            Mj = np.maximum(D, Xj)
+            Mj[0] = up_M[k]
+            if trace is not None or split is not None:
+                self.directions(step[1:], Mj[1:], Xj[1:], Yj[1:])
+            if trace is not None:
+                trace[k-1] = step
+            if split is not None and (split[0] == 0 or j >= split[1]):
+                if split[0] == 1 and j == split[1]:
+                    cross = np.arange(top - 1, bottom + 1)
+                    cross[0] = -1
+                else:
+                    # each cell takes the crossing of the cell its step goes
+                    # to; up steps take it from the last other step above
+                    base.fill(-1)
+                    mask = step == LEFT
+                    base[mask] = cross[mask]
+                    mask = step[1:] == DIAG
+                    base[1:][mask] = cross[:-1][mask]
+                    keep = step != UP
+                    keep[0] = True
+                    if split[0] == 0:
+                        r = split[1] - top + 1
+                        base[:r] = -1
+                        base[r] = j
+                        keep[:r+1] = True
+                    cross = base[np.maximum.accumulate(np.where(keep, rows_, 0))]
+            if j in cols:
+                kept[1, j] = (Mj, Yj)
+            for r in rows:
+                kept[0, r][0][k] = Mj[r - top + 1]
+                kept[0, r][1][k] = Xj[r - top + 1]
+            M, Y = Mj, Yj
+        return (int(cross[h]) if split is not None else None), kept
+
+    def trace_path(self, region, left, upper, corner, steps):
+        """Steps of the path from the bottom right cell of a region to its
+            top left corner, or to where it stops. The larger side of the
+            region is halved at the row or column where a sweep finds the
+            path first reaches it, then both parts are traced, the lower
+            right one first; regions of at most TRACE_CELLS cells follow
+            their directions.
+
+        Args:
+            region (tuple):         top, bottom, lo, hi, as sweep
+            left, upper (tuple):    the column and row before it, as sweep
+            corner (tuple):         (top, lo), where the path ends, or None
+                                    if it stops in the region
+            steps (list):           the steps are appended to it
+
+        Returns:
+            (i, j):                 the cell where the path ends
+
+        """
+        top, bottom, lo, hi = region
+        h = bottom - top + 1
+        w = hi - lo + 1
+        if h * w <= TRACE_CELLS:
+            trace = np.empty((w, h + 1), dtype=np.uint8)
+            self.sweep(region, left, upper, trace=trace)
+            i, j = bottom, hi
+            while i >= top and j >= lo and (i, j) != corner:
+                step = trace[j - lo, i - top + 1]
+                if step == STOP:
+                    break
+                steps.append(step)
+                if step != UP:
+                    j -= 1
+                if step != LEFT:
+                    i -= 1
+            return i, j
+        if w >= h:
+            mid = lo + w // 2
+            r, kept = self.sweep(region, left, upper, split=(1, mid), cols=(mid - 1, mid))
+            if r < 0:
+                return self.trace_path((top, bottom, mid + 1, hi), kept[1, mid],
+                                       (upper[0][mid-lo+1:], upper[1][mid-lo+1:]),
+                                       None, steps)
+            M, Y = kept[1, mid - 1]
+            if r == top:
+                row = (upper[0][mid-lo:], upper[1][mid-lo:])
+            else:
+                row = self.sweep((top, r - 1, mid, hi), (M[:r-top+1], Y[:r-top+1]),
+                                 (upper[0][mid-lo:], upper[1][mid-lo:]),
+                                 rows=(r - 1,))[1][0, r - 1]
+            self.trace_path((r, bottom, mid, hi), (M[r-top:], Y[r-top:]), row,
+                            (r, mid), steps)
+            return self.trace_path((top, r, lo, mid),
+                                   (left[0][:r-top+2], left[1][:r-top+2]),
+                                   (upper[0][:mid-lo+2], upper[1][:mid-lo+2]),
+                                   corner, steps)
+        mid = top + h // 2
+        c, kept = self.sweep(region, left, upper, split=(0, mid), rows=(mid - 1, mid))
+        if c < 0:
+            return self.trace_path((mid + 1, bottom, lo, hi),
+                                   (left[0][mid-top+1:], left[1][mid-top+1:]),
+                                   kept[0, mid], None, steps)
+        M, X = kept[0, mid - 1]
+        if c == lo:
+            col = (left[0][mid-top:], left[1][mid-top:])
+        else:
+            col = self.sweep((mid, bottom, lo, c - 1),
+                             (left[0][mid-top:], left[1][mid-top:]),
+                             (M[:c-lo+1], X[:c-lo+1]), cols=(c - 1,))[1][1, c - 1]
+        self.trace_path((mid, bottom, c, hi), col, (M[c-lo:], X[c-lo:]),
+                        (mid, c), steps)
+        return self.trace_path((top, mid, lo, c),
+                               (left[0][:mid-top+2], left[1][:mid-top+2]),
+                               (upper[0][:c-lo+2], upper[1][:c-lo+2]),
+                               corner, steps)
+
+    def path(self, i, j):
+        """Steps of IntAlignment.path, from a linear space traceback: the
+            path is split where it first crosses the middle column or row
+            of the region left of and above (i, j), found by carrying that
+            crossing along the directions in one fill of the region, and
+            the two parts are traced the same way from the column and the
+            row before them. Hirschberg splits where the best forward and
+            backward scores meet instead, but among paths of equal score
+            that need not be the path of the left, up, diagonal priority of
+            LocalAlignment.traceback(); here the directions are those of
+            IntAlignment, so the alignments are the same. The larger side
+            is halved each time, so the columns and rows kept for the parts
+            still to trace add up to O(m + n), for about two more fills of
+            the part of the DP left of and above the maximum.
+
+        """
+        if self.score == 0:
+            return [], i, j
+        self.table = np.ascontiguousarray(self.query_profile().scores.T, dtype=np.int32)
+        self.codes = encode(self.y, self.query_profile().alphabet)
+        steps = []
+        end = self.trace_path((1, i, 1, j),
+                              (np.zeros(i + 1, dtype=np.int32), np.full(i + 1, NEG, dtype=np.int32)),
+                              (np.zeros(j + 1, dtype=np.int32), np.full(j + 1, NEG, dtype=np.int32)),
+                              None, steps)
+        return steps, end[0], end[1]
+#%%
+def align_all(aligner, seq_x, seqs_y, score_matrix, gap_open=-12., gap_ext=-4.,
+              profile=None):
+    """Align a query against all of its candidate subjects with a backend.
+
+    Args:
+        aligner (type):         a backend class, see ALIGNERS
+        seq_x (str):            query sequence
+        seqs_y (list):          subject sequences
+        score_matrix (dict):    score matrix
+        gap_open (float):       gap opening, see GAP_MODELS
+        gap_ext (float):        gap extension
+        profile (QueryProfile): profile of seq_x, built when None
+
+    Returns:
+        alignments (list):      a filled alignment per subject, in the order
+                                of seqs_y
+
+    """
+    if profile is None:
+        profile = QueryProfile(seq_x, score_matrix)
+    if hasattr(aligner, 'align_all'):
+        return aligner.align_all(seq_x, seqs_y, score_matrix, gap_open, gap_ext,
+                                 profile=profile)
+    alignments = []
+    for seq_y in seqs_y:
+        la = aligner(seq_x, seq_y, score_matrix, gap_open, gap_ext, profile=profile)
+        la.fill_matrix()
+        alignments.append(la)
+    return alignments
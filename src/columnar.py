@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Columnar results of a query output directory.
+
+This module writes the hits of a run as typed columns next to the .out and
+    .summary files, for analyses that would otherwise parse the summaries
+    back: every batch of reads becomes one table of a row per .summary line,
+    in the same order, with the read id, the reference as an index into the
+    reference names of the table, the frame, the query and reference
+    coordinates of the .out alignment, the raw score, the bit score and the
+    e-value as a float64. Tables are NumPy .npz archives, or Parquet files
+    when pyarrow is installed, written as .part files and renamed once
+    complete like the results of src.journal.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py --columnar and evaluator.py.
+
+Attributes:
+    FORMATS (dict): file extension of each table format
+
+    COLUMNS (list): (name, dtype) of the columns of a table, besides the
+        reference names
+
+    check_format(str): raise when a table format cannot be written
+
+    TableWriter: the rows of a batch of reads, written as one table
+
+    read_table(str): the columns of a table file
+
+    read_tables(str): the columns of all tables of an output directory
+
+    prune_tables(str, set): keep the rows of some reads only, before a run
+        searches the others again
+
+"""
+#%%
+import os
+import tempfile
+
+import numpy as np
+
+from src.journal import PART
+from src.score_matrix import bit_score
+#%%
+FORMATS = {'npz': '.npz', 'parquet': '.parquet'}
+PREFIX = 'hits-'
+# ref is a row of refs, the reference names of the table; coordinates are
+# those of src.search.Hit
+COLUMNS = [
+    ('read_id', str),
+    ('ref', np.int32),
+    ('frame', np.int8),
+    ('query_start', np.int32),
+    ('query_end', np.int32),
+    ('ref_start', np.int32),
+    ('ref_end', np.int32),
+    ('score', np.int32),
+    ('bit_score', np.float64),
+    ('evalue', np.float64),
+]
+#%%
+def check_format(fmt):
+    """Raise a ValueError when fmt is unknown or needs a missing library"""
+    if fmt not in FORMATS:
+        raise ValueError('unknown columnar format {}, choose from {}'.format(
+            fmt, ', '.join(sorted(FORMATS))))
+    if fmt == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError('parquet output needs pyarrow, use npz instead')
+#%%
+class TableWriter:
+    def __init__(self, out_dir, fmt, sm_name='BLOSUM62'):
+        """Collect rows to write as one table in out_dir.
+
+        Args:
+            out_dir (str):      output directory
+            fmt (str):          table format, one of FORMATS
+            sm_name (str):      score matrix name, for the bit scores
+        """
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.sm_name = sm_name
+        self.rows = []
+        self.refs = {}
+
+    def add(self, read_id, frame, ref_id, query_start, query_end, ref_start,
+            ref_end, score, evalue):
+        """Add the row of one .summary line"""
+        ref = self.refs.setdefault(ref_id, len(self.refs))
+        self.rows.append((read_id, ref, frame, query_start, query_end, ref_start,
+                          ref_end, score, bit_score(score, self.sm_name), evalue))
+
+    def close(self):
+        """Write the rows added so far, if any, and start a new table"""
+        if not self.rows:
+            return
+        columns = {name: np.array(values, dtype=dtype) for (name, dtype), values in
+                   zip(COLUMNS, zip(*self.rows))}
+        refs = np.array(list(self.refs), dtype=str)
+        fd, path = tempfile.mkstemp(prefix=PREFIX, suffix=FORMATS[self.fmt] + PART,
+                                    dir=self.out_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            if self.fmt == 'npz':
+                np.savez(fh, refs=refs, **columns)
+            else:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                ref_id = pa.DictionaryArray.from_arrays(pa.array(columns.pop('ref')),
+                                                        pa.array(refs.tolist()))
+                columns['read_id'] = pa.array(columns['read_id'].tolist(), pa.string())
+                table = pa.table(dict(columns, ref_id=ref_id))
+                pq.write_table(table, fh)
+        os.replace(path, path[:-len(PART)])
+        self.rows = []
+        self.refs = {}
+#%%
+def read_table(path):
+    """The columns of a table file.
+
+    Args:
+        path (str):         .npz or .parquet table
+
+    Returns:
+        columns (dict):     numpy array of each of COLUMNS, and refs
+    """
+    if table_format(path) == 'npz':
+        with np.load(path) as npz:
+            return {name: npz[name] for name in npz.files}
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    ref_id = table.column('ref_id').combine_chunks()
+    columns = {name: table.column(name).to_numpy() for name in table.column_names
+               if name != 'ref_id'}
+    columns['read_id'] = columns['read_id'].astype(str)
+    columns['ref'] = ref_id.indices.to_numpy().astype(np.int32)
+    columns['refs'] = ref_id.dictionary.to_numpy(zero_copy_only=False).astype(str)
+    return columns
+
+def table_format(path):
+    """The format of a table file, one of FORMATS"""
+    return 'npz' if path.endswith(FORMATS['npz']) else 'parquet'
+
+def table_files(out_dir):
+    """The table files of an output directory, in name order"""
+    return [os.path.join(out_dir, name) for name in sorted(os.listdir(out_dir))
+            if name.startswith(PREFIX) and os.path.splitext(name)[-1] in
+            FORMATS.values()]
+
+def read_tables(out_dir):
+    """The columns of all tables of an output directory, concatenated.
+
+    Args:
+        out_dir (str):      output directory
+
+    Returns:
+        columns (dict):     numpy array of each of COLUMNS, with ref indexing
+                            refs, the reference names of all tables
+    """
+    tables = [read_table(path) for path in table_files(out_dir)]
+    if not tables:
+        columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+        columns['refs'] = np.zeros(0, dtype=str)
+        return columns
+    # the references of every table, as rows of the references of all
+    index = {}
+    for t in tables:
+        remap = np.array([index.setdefault(r, len(index)) for r in t['refs'].tolist()],
+                         dtype=np.int32)
+        t['ref'] = remap[t['ref']]
+    columns = {name: np.concatenate([t[name] for t in tables]) for name, _ in COLUMNS}
+    columns['refs'] = np.array(list(index), dtype=str)
+    return columns
+
+def prune_tables(out_dir, done):
+    """Keep the rows of the reads of done in the tables of an output
+        directory, removing tables left without rows. Tables of a format
+        that cannot be read here (parquet without pyarrow) are kept as they
+        are when some reads are done.
+
+    Args:
+        out_dir (str):      output directory
+        done (set):         read ids whose rows to keep
+    """
+    for path in table_files(out_dir):
+        fmt = table_format(path)
+        if not done:
+            os.remove(path)
+            continue
+        try:
+            check_format(fmt)
+        except ValueError:
+            continue
+        columns = read_table(path)
+        keep = np.isin(columns['read_id'], list(done))
+        if keep.all():
+            continue
+        # the kept rows are written before the table is removed
+        writer = TableWriter(out_dir, fmt)
+        writer.refs = {r: i for i, r in enumerate(columns['refs'].tolist())}
+        writer.rows = list(zip(*[columns[name][keep].tolist() for name, _ in COLUMNS]))
+        writer.close()
+        os.remove(path)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Persistent search daemon.
+
+This module keeps a protein database and a warm worker pool in one long
+    running process that serves query runs over a Unix socket, so that
+    repeated runs do not reload the database or restart the workers. A
+    request is one JSON line with the arguments of 6tbsps-query.py; the
+    daemon answers with one JSON line per finished read, then a last line
+    with the log a local run would print.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-server.py and 6tbsps-query.py --server.
+
+Attributes:
+    SearchServer: the daemon, serving requests one at a time
+
+    send_request(str, dict, func): send a run to a daemon and wait for it
+
+"""
+#%%
+import io
+import os
+import json
+import time
+import socket
+import socketserver
+
+import src.file_io as fio
+from src.scheduler import print_utilization
+#%%
+class SearchHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        """Run one request and stream its progress back to the client"""
+        s_time = time.time()
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            server.check(request)
+            reads = {}
+            for name in request['reads']:
+                reads.update(fio.read_fasta(name))
+            workers = server.searcher.write(
+                reads, request['options'], request['batches'],
+                on_read=lambda read_id: self.send({'read': read_id}))
+        except (ValueError, KeyError, OSError) as e:
+            self.send({'error': str(e)})
+            return
+        log = io.StringIO()
+        log.write('running time: {}\n'.format(time.time() - s_time))
+        print_utilization(workers, log)
+        self.send({'done': True, 'log': log.getvalue()})
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode())
+        self.wfile.flush()
+
+class SearchServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, searcher):
+        """Listen on a Unix socket for query runs against one database.
+
+        Args:
+            socket_path (str):  socket file, removed when the server closes
+            searcher (Searcher): the opened database and its worker pool
+        """
+        self.socket_path = socket_path
+        self.searcher = searcher
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, SearchHandler)
+
+    def check(self, request):
+        """Reject a request for another database, shard or score matrix"""
+        database = self.searcher.database
+        for key in ['db', 'shard', 'sm_name']:
+            if request[key] != database[key]:
+                raise ValueError('the server has {} {}, not {}'.format(
+                    key, database[key], request[key]))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+#%%
+def send_request(socket_path, request, on_read=None):
+    """Send a run to a daemon and wait until it is done.
+
+    Args:
+        socket_path (str):  socket file of the daemon
+        request (dict):     db, shard, sm_name, reads (absolute FASTA file
+                            names), batches (per worker process) and
+                            options, see search.run()
+        on_read (func):     called with each read_id once its results are
+                            written
+
+    Returns:
+        log (str):          running time and worker utilization
+
+    Raises:
+        ValueError:         when the daemon rejects the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + '\n').encode())
+        with sock.makefile('r') as fh:
+            for line in fh:
+                message = json.loads(line)
+                if 'error' in message:
+                    raise ValueError(message['error'])
+                if 'done' in message:
+                    return message['log']
+                if on_read is not None:
+                    on_read(message['read'])
+    raise ValueError('the server closed the connection')
@@ -16,7 +16,173 @@ Attributes:
 '''
 #%%
 import os
+import gzip
+import zlib
+import struct
 import pickle
+import collections
+from concurrent.futures import ThreadPoolExecutor
+#%%
+# FASTA files are read in blocks of this many bytes
+BLOCK_SIZE = 1 << 22
+# threads decompressing bgzip blocks
+BGZF_THREADS = min(4, os.cpu_count() or 1)
+GZIP_MAGIC = b'\x1f\x8b'
+#%%
+def _is_bgzf(header):
+	'''
+	Whether a file header is a BGZF block: a gzip member whose only extra
+	subfield is 'BC' holding the block size
+	'''
+	return len(header) >= 18 and header[:4] == b'\x1f\x8b\x08\x04' and \
+		header[10:12] == b'\x06\x00' and header[12:14] == b'BC'
+#%%
+def _inflate_block(body, offset):
+	'''
+	Decompress the deflate data of a BGZF block and check it against the
+	CRC32 and ISIZE trailer of the block
+
+	Args:
+		body (bytes):		the block after its header: deflate data, CRC32
+							and ISIZE
+		offset (int):		file offset of the block, for errors
+
+	Returns:
+		bytes:				decompressed block
+
+	Raises:
+		gzip.BadGzipFile:	when the data does not match the trailer
+	'''
+	data = zlib.decompress(body[:-8], -15)
+	crc, isize = struct.unpack('<II', body[-8:])
+	if zlib.crc32(data) != crc:
+		raise gzip.BadGzipFile('CRC check failed in the BGZF block at byte {}'.format(offset))
+	if len(data) & 0xffffffff != isize:
+		raise gzip.BadGzipFile('incorrect length of the BGZF block at byte {}'.format(offset))
+	return data
+#%%
+def _bgzf_blocks(fh, threads):
+	'''
+	Decompress the blocks of a bgzip file in parallel threads (zlib releases
+	the GIL), yielding the decompressed blocks in file order, each checked
+	against its CRC32 and length as gzip does
+
+	Args:
+		fh (handle):		binary file handle at the start of a BGZF block
+		threads (int):		number of decompression threads
+
+	Yields:
+		bytes:				decompressed block
+
+	Raises:
+		gzip.BadGzipFile:	on a truncated or corrupted block
+	'''
+	pending = collections.deque()
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		while True:
+			offset = fh.tell()
+			header = fh.read(18)
+			if len(header) < 18:
+				if header:
+					raise gzip.BadGzipFile('truncated BGZF block at byte {}'.format(offset))
+				break
+			bsize = struct.unpack('<H', header[16:18])[0]
+			body = fh.read(bsize - 17)
+			if len(body) < bsize - 17 or bsize < 25:
+				raise gzip.BadGzipFile('truncated BGZF block at byte {}'.format(offset))
+			pending.append(pool.submit(_inflate_block, body, offset))
+			if len(pending) >= threads * 8:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+#%%
+def read_blocks(filename, block_size=BLOCK_SIZE, threads=BGZF_THREADS):
+	'''
+	Read a plain, gzip or bgzip file in blocks of decompressed bytes.
+	The compression is detected from the magic bytes, not the file name.
+
+	Args:
+		filename (str):		file name
+		block_size (int):	number of bytes read at a time
+		threads (int):		number of bgzip decompression threads
+
+	Yields:
+		bytes:				the next block of (decompressed) data
+
+	Raises:
+		gzip.BadGzipFile:	when a gzip or bgzip block fails its CRC32 or
+							length check
+	'''
+	with open(filename, 'rb') as fh:
+		header = fh.read(18)
+		fh.seek(0)
+		if _is_bgzf(header) and threads > 1:
+			blocks = _bgzf_blocks(fh, threads)
+		elif header[:2] == GZIP_MAGIC:
+			gz = gzip.GzipFile(fileobj=fh)
+			blocks = iter(lambda: gz.read(block_size), b'')
+		else:
+			blocks = iter(lambda: fh.read(block_size), b'')
+		for block in blocks:
+			yield block
+#%%
+def _fasta_record(record, as_bytes):
+	'''
+	Split one FASTA record (starting with '>') into its ID and sequence
+
+	Args:
+		record (bytes):		raw record text including the header line
+		as_bytes (bool):	return the sequence as bytes
+
+	Returns:
+		(str, str/bytes):	ID and sequence without line breaks
+	'''
+	nl = record.find(b'\n')
+	if nl < 0:
+		nl = len(record)
+	ID = record[1:nl].rstrip().decode('utf-8', 'replace')
+	seq = record[nl+1:].translate(None, b' \t\r\n')
+	if as_bytes:
+		return ID, seq
+	return ID, seq.decode('latin-1')
+#%%
+def read_fasta(filename, as_bytes=False, block_size=BLOCK_SIZE):
+	'''
+	Read (ID, sequence) records from a FASTA file in large buffered blocks.
+	Records are yielded one at a time, so only the current record is held
+	in memory, and each sequence is assembled with a single join.
+	gzip and bgzip files are decompressed on the fly.
+
+	Args:
+		filename (str):		file name of the FASTA file
+		as_bytes (bool):	yield sequences as bytes instead of str
+		block_size (int):	number of bytes read at a time
+
+	Yields:
+		(str, str/bytes):	reference/read ID and sequence
+	'''
+	parts = [] # pieces of the current record
+	for block in read_blocks(filename, block_size):
+		if len(block) == 0:
+			continue
+		start = 0
+		# a record boundary split between two blocks
+		if block[:1] == b'>' and (not parts or parts[-1][-1:] == b'\n'):
+			if parts and parts[0][:1] == b'>':
+				yield _fasta_record(b''.join(parts), as_bytes)
+			parts = []
+		while True:
+			i = block.find(b'\n>', start)
+			if i < 0:
+				break
+			parts.append(block[start:i+1])
+			if parts[0][:1] == b'>':
+				yield _fasta_record(b''.join(parts), as_bytes)
+			parts = []
+			start = i + 1
+		parts.append(block[start:])
+	if parts and parts[0][:1] == b'>':
+		yield _fasta_record(b''.join(parts), as_bytes)
 #%%
 def parse_fasta(filename, ID_seq):
 	'''
@@ -30,23 +196,13 @@ def parse_fasta(filename, ID_seq):
 	Returns:
 		None
 	'''
-	with open(filename, 'r') as fh:
-		while True:
-			line = fh.readline()	
-			if len(line) == 0:
-				break
-			if line[0] == '>':
-				refID = line[1:].rstrip()
-				protein_seq = ''
-			else:
-				protein_seq += line.rstrip()
-			ID_seq[refID] = protein_seq
+	ID_seq.update(read_fasta(filename))
 			
 	return
 #%%
 def read_dict(db_name):
 	'''
-	Read in a dictionary from a compressed pickle
+	Read in a dictionary from a pickle, gzip compressed or not
 
 	Args:
 		db_name (str):			pre-index kmer database name
@@ -55,9 +211,14 @@ def read_dict(db_name):
 		A decompressed dictionary
 	'''
 	with open(db_name+'.pickle', 'rb') as handle:
+		if handle.read(2) == GZIP_MAGIC:
+			handle.seek(0)
+			with gzip.GzipFile(fileobj=handle) as gz:
+				return pickle.load(gz)
+		handle.seek(0)
 		return pickle.load(handle)
 #%%
-def write_dict(dictionary, dir_name, base_name):
+def write_dict(dictionary, dir_name, base_name, compress=0):
 	'''
 	Write a dictionary to file, compressed using pickle
 
@@ -65,46 +226,57 @@ def write_dict(dictionary, dir_name, base_name):
 		dictionary (dict): 		a python dictionary
 		dir_name (str): 		output directory name
 		base_name (str):		output base name
+		compress (int):			gzip compression level of the pickle,
+								0 (default) for an uncompressed pickle
 
 	Returns:
 		None
 	'''
 	with open(os.path.join(dir_name, base_name)+'.pickle', 'wb') as handle:
-		pickle.dump(dictionary, handle, protocol = pickle.HIGHEST_PROTOCOL)	
+		if compress:
+			with gzip.GzipFile(fileobj=handle, mode='wb', compresslevel=compress, \
+				mtime=0) as gz:
+				pickle.dump(dictionary, gz, protocol = pickle.HIGHEST_PROTOCOL)
+		else:
+			pickle.dump(dictionary, handle, protocol = pickle.HIGHEST_PROTOCOL)	
 	
 	return
 
 #%%
-def align_out(output, out_file, sum_file):
+def align_out(output, out_file, sum_file, stats=None):
 	'''
 	Write the alignment restuls to files
 
 	Args:
-		output (list): 			a python list of tuples containing restults
+		output (list): 			HitRecord of every hit, see src.hits
 		out_file (handle): 		output file handle
 		sum_file (handle):		summary file handle
+		stats (QueryStats):		optional counters of hits and traceback length
 
 	Returns:
 		None
 	'''			
-	for f, read_id, query, ref_id, prot_seq, s, la, S, evalue in output:
+	for h in output:
 		# print to output
-		print('Frame:', str(f), file=out_file)
-		print('Query:', query, file=out_file)
-		print('Length:', len(query), file=out_file)
-		print('Subject:', ref_id, file=out_file)
-		print('Length:', len(prot_seq[ref_id]), file=out_file)
+		print('Frame:', str(h.frame), file=out_file)
+		print('Query:', h.query, file=out_file)
+		print('Length:', len(h.query), file=out_file)
+		print('Subject:', h.ref_id, file=out_file)
+		print('Length:', h.ref_len, file=out_file)
 		print(file=out_file)
 
-		print('Score:', str(S), file=out_file)
-		print('E-value:', str(evalue), file=out_file)
+		print('Score:', str(h.score), file=out_file)
+		print('E-value:', str(h.evalue), file=out_file)
 		print(file=out_file)
 
-		la.traceback()
-		la.display_file(out_file, s)
+		if stats is not None:
+			stats.add(h.frame, 'hits', 1)
+			stats.add(h.frame, 'traceback_len', \
+				sum([len(a) for a in h.alignment.align_seq_x_list]))
+		h.alignment.display_file(out_file, h.start)
 		print(file=out_file)
 
 		# print to summary --- similar to output format 6
-		print('\t'.join([read_id, ref_id, str(S), str(evalue)]), file=sum_file)
+		print('\t'.join([h.read_id, h.ref_id, str(h.score), str(h.evalue)]), file=sum_file)
 	
 	return
\ No newline at end of file
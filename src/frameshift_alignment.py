@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Frameshift-aware local alignment of a DNA strand against a protein.
+
+This module aligns the three forward frames of a DNA strand against a
+    subject protein in a single dynamic programming pass. Rows of the
+    matrices are the codons starting at every base of the strand, so a
+    codon either follows the codon 3 bases before it (same frame) or, at a
+    frameshift penalty, the codon 2 or 4 bases before it (one base reused
+    or skipped). A read with an indel then gives one gapped alignment per
+    strand instead of several broken alignments in different frames.
+
+Usage:
+    This is a class for internal pipline, no external usage.
+    See 6tbsps-query.py --frameshift.
+
+Attributes:
+    codons(str): amino acid of the codon starting at every base of a strand
+
+    FrameshiftAlignment: affine local alignment over the three frames of a
+        strand, with the interface of LocalAlignment
+
+"""
+#%%
+import numpy as np
+
+from src.six_frame_translation import AMINO_ACID_TABLE
+from src.local_alignment_affine import LocalAlignment
+from src.query_profile import QueryProfile
+#%%
+# rows of zeros above the first codon, so that row i - 4 always exists
+PAD = 4
+#%%
+def codons(dna):
+    """Translate the codon starting at every base of a DNA strand.
+        Stop codons are '*' and codons with other bases than ACGT are 'X'.
+
+    Args:
+        dna (str):          DNA sequence of the strand
+
+    Returns:
+        residues (str):     amino acid of the codon at each start position,
+                            of length len(dna) - 2
+
+    """
+    rna = dna.replace('T', 'U')
+    return ''.join([AMINO_ACID_TABLE.get(rna[p:p+3], 'X').replace('.', '*')
+                    for p in range(len(rna) - 2)])
+#%%
+class FrameshiftAlignment(LocalAlignment):
+    def __init__(self, dna, seq_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                 frameshift=-15.):
+        """Init the scores of every codon of the strand against seq_y.
+
+        Args:
+            dna (str):              DNA sequence of the strand
+            seq_y (str):            subject protein sequence
+            score_matrix (dict):    score matrix
+            gap_open (float):       gap opening
+            gap_ext (float):        gap extension
+            frameshift (float):     frameshift penalty
+
+        self:
+            x (str):                codon translations, see codons()
+            sc (numpy.array):       score of codon row i against residue j
+            H (numpy.array):        best local alignment ending in a cell
+            X (numpy.array):        gap in seq_y, codons of one frame
+            Y (numpy.array):        gap in the strand, residues of seq_y
+        """
+        self.score_matrix = score_matrix
+        self.go = gap_open
+        self.ge = gap_ext
+        self.fs = frameshift
+        self.dna = dna
+        self.x = codons(dna)
+        self.y = seq_y
+
+        # the codons of the strand are the query of the profile
+        self.profile = QueryProfile(self.x, score_matrix)
+        dim_i = len(self.x) + PAD
+        dim_j = len(seq_y) + 1
+        self.sc = np.zeros((dim_i, dim_j), dtype=float)
+        self.sc[PAD:, 1:] = self.profile.subject_scores(seq_y)
+        self.H = np.zeros((dim_i, dim_j), dtype=float)
+        self.X = np.full((dim_i, dim_j), -np.inf)
+        self.Y = np.full((dim_i, dim_j), -np.inf)
+
+    def fill_matrix(self):
+        """Fill the matrices column by column, each column in a few vectorized
+            steps. Within a column, a gap in seq_y only extends along the
+            rows of one frame, so X is a running maximum over every third
+            row, each of which is one more codon of the gap.
+
+        self:
+            max_loc_list (list[tuple]): the list of (row, column) of maxima
+            score (int): the best local alignment value
+
+        return:
+            self.score
+
+        """
+        rows = len(self.x)
+        H, X, Y, sc = self.H, self.X, self.Y, self.sc
+        go, ge, fs = self.go, self.ge, self.fs
+        cur = slice(PAD, PAD + rows)
+        # codons from the start of each frame
+        chain = np.arange((rows + 2) // 3)
+        for j in range(1, len(self.y) + 1):
+            prev = H[:, j-1]
+            diag = np.maximum(prev[PAD-3:PAD-3+rows],
+                              np.maximum(prev[PAD-2:PAD-2+rows],
+                                         prev[PAD-4:PAD-4+rows]) + fs)
+            Y[cur, j] = np.maximum(prev[cur] + go + ge, Y[cur, j-1] + ge)
+            D = np.maximum(np.maximum(diag + sc[cur, j], Y[cur, j]), 0)
+            for r in range(3):
+                d = D[r::3]
+                c = chain[:len(d)]
+                best = np.maximum.accumulate(d - ge * c)
+                X[PAD+r+3:PAD+rows:3, j] = go + ge * c[1:] + best[:-1]
+            H[cur, j] = np.maximum(D, X[cur, j])
+
+        self.score = int(H.max())
+        if self.score == 0:
+            self.max_loc_list = [(0, 0)]
+        else:
+            argmax = np.where(H == self.score)
+            self.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
+        return self.score
+
+    def traceback(self):
+        """Trace back from each maximum through the H, X and Y states.
+            A frameshift is shown as '/' (one base skipped) or '\\' (one base
+            reused) in the aligned strand. Strand locations are in bases: the
+            first base of the first codon and the last base of the last codon.
+
+        return:
+            self.score
+            self.align_seq_x_list
+            self.align_seq_y_list
+            self.xscript_list
+            self.max_loc_x_list
+            self.max_loc_y_list
+
+        """
+        self.align_seq_x_list = []
+        self.align_seq_y_list = []
+        self.xscript_list = []
+        self.max_loc_x_list = []
+        self.max_loc_y_list = []
+        H, X, Y, sc = self.H, self.X, self.Y, self.sc
+        go, ge, fs = self.go, self.ge, self.fs
+
+        for i, j in self.max_loc_list:
+            align_seq_x = []
+            align_seq_y = []
+            xscript = []
+            max_loc_x = [i - PAD, i - PAD + 2]
+            max_loc_y = [j, j - 1]
+            state = 'H'
+            # a cell of the matrix edge starts no alignment
+            while i >= PAD and j > 0 and (state != 'H' or H[i, j] != 0):
+                if state == 'H' and H[i, j] == Y[i, j]:
+                    state = 'Y'
+                elif state == 'H' and H[i, j] == X[i, j]:
+                    state = 'X'
+                if state == 'Y':
+                    align_seq_x.append('_')
+                    align_seq_y.append(self.y[j-1])
+                    xscript.append(' ')
+                    if Y[i, j] == H[i, j-1] + go + ge:
+                        state = 'H'
+                    j -= 1
+                elif state == 'X':
+                    align_seq_x.append(self.x[i-PAD])
+                    align_seq_y.append('_')
+                    xscript.append(' ')
+                    max_loc_x[0] = i - PAD
+                    if X[i, j] == H[i-3, j] + go + ge:
+                        state = 'H'
+                    i -= 3
+                else:
+                    align_seq_x.append(self.x[i-PAD])
+                    align_seq_y.append(self.y[j-1])
+                    xscript.append('|' if self.x[i-PAD] == self.y[j-1] else '*')
+                    max_loc_x[0] = i - PAD
+                    max_loc_y[0] = j - 1
+                    v = H[i, j] - sc[i, j]
+                    j -= 1
+                    if v == 0:
+                        # the local alignment starts at this codon
+                        break
+                    if v == H[i-3, j]:
+                        i -= 3
+                    elif v == H[i-2, j] + fs:
+                        # the previous codon overlaps this one by one base
+                        align_seq_x.append('\\')
+                        align_seq_y.append(' ')
+                        xscript.append(' ')
+                        i -= 2
+                    else:
+                        # one base between the codons is skipped
+                        align_seq_x.append('/')
+                        align_seq_y.append(' ')
+                        xscript.append(' ')
+                        i -= 4
+
+            self.align_seq_x_list.append(''.join(align_seq_x[::-1]))
+            self.align_seq_y_list.append(''.join(align_seq_y[::-1]))
+            self.xscript_list.append(''.join(xscript[::-1]))
+            self.max_loc_x_list.append(max_loc_x)
+            self.max_loc_y_list.append(max_loc_y)
+
+        return self.score, \
+               self.align_seq_x_list, self.align_seq_y_list, self.xscript_list, \
+               self.max_loc_x_list, self.max_loc_y_list
+
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Compact hit records.
+
+This module keeps, for every hit of a read, what the output needs and no
+    more: the traceback of the alignment instead of the alignment object
+    with its DP matrices, and the reference id and length instead of the
+    protein database. Alignments are traced back as soon as they are filled
+    and their matrices freed, so the hits of a read take tens of bytes each
+    plus their alignment strings, and are cheap to send between processes.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See src.search.search_frames() and src.file_io.align_out().
+
+Attributes:
+    Alignment: the score and traceback of a filled alignment
+
+    HitRecord: one hit of a read against a candidate region
+
+    ref_order(dict): the index of every reference in the order of the
+        protein database, which orders the hits of equal e-value and score
+
+"""
+#%%
+from src.local_alignment_affine import LocalAlignment
+#%%
+class Alignment:
+    __slots__ = ('score', 'max_loc_list', 'max_loc_x_list', 'max_loc_y_list',
+                 'align_seq_x_list', 'xscript_list', 'align_seq_y_list')
+
+    def __init__(self, la):
+        """Trace back a filled alignment and keep its traceback only.
+
+        Args:
+            la (LocalAlignment):    a filled alignment of any backend, or a
+                                    FrameshiftAlignment
+
+        self:
+            score (int):            best local alignment score
+            max_loc_list (list):    (row, column) of each maximum
+            max_loc_x_list (list):  [start, end] in the query of each
+                                    alignment
+            max_loc_y_list (list):  [start, end] in the subject of each
+                                    alignment
+            align_seq_x_list, xscript_list, align_seq_y_list (list):
+                                    aligned query, transcript and aligned
+                                    subject of each alignment
+        """
+        la.traceback()
+        self.score = la.score
+        self.max_loc_list = [(int(i), int(j)) for i, j in la.max_loc_list]
+        self.max_loc_x_list = [[int(a), int(b)] for a, b in la.max_loc_x_list]
+        self.max_loc_y_list = [[int(a), int(b)] for a, b in la.max_loc_y_list]
+        self.align_seq_x_list = la.align_seq_x_list
+        self.xscript_list = la.xscript_list
+        self.align_seq_y_list = la.align_seq_y_list
+
+    # write the alignments in the .out format of LocalAlignment
+    display_file = LocalAlignment.display_file
+#%%
+class HitRecord:
+    __slots__ = ('frame', 'read_id', 'query', 'ref_id', 'ref_len', 'start',
+                 'alignment', 'score', 'evalue')
+
+    def __init__(self, frame, read_id, query, ref_id, ref_len, start, alignment,
+                 score, evalue):
+        """One hit of a read against a candidate region of a reference.
+
+        Args:
+            frame (int):            frame of the query
+            read_id (str):          read identifier
+            query (str):            translated frame, or the strand with a
+                                    frameshift penalty, shared by the hits of
+                                    the frame
+            ref_id (str):           reference identifier
+            ref_len (int):          reference length
+            start (int):            start of the candidate region in the
+                                    reference, the base of subject locations
+            alignment (Alignment):  traceback against the region, shared by
+                                    identical regions
+            score (int):            raw score
+            evalue (float):         e-value
+        """
+        self.frame = frame
+        self.read_id = read_id
+        self.query = query
+        self.ref_id = ref_id
+        self.ref_len = ref_len
+        self.start = start
+        self.alignment = alignment
+        self.score = score
+        self.evalue = evalue
+
+    def __repr__(self):
+        return 'HitRecord({}, {}, {}, score={}, evalue={})'.format(
+            self.read_id, self.frame, self.ref_id, self.score, self.evalue)
+#%%
+# reference orders, keyed by id() and holding the protein dictionary itself
+# so that the id cannot be reused while the entry exists
+_ref_orders = {}
+
+def ref_order(prot_seq):
+    """Index of every reference in the order of a protein dictionary.
+        Shards hold contiguous ranges of the references of the database in
+        their order, so hits of equal e-value and score sorted by frame and
+        then by this index come out in the same order sharded or not.
+
+    Args:
+        prot_seq (dict):    protein sequences of the database
+
+    Returns:
+        order (dict):       a dictionary that maps each reference id to its
+                            index
+    """
+    key = id(prot_seq)
+    if key not in _ref_orders:
+        _ref_orders[key] = (prot_seq, {ref_id: i for i, ref_id in enumerate(prot_seq)})
+    return _ref_orders[key][1]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Run journal of a query output directory.
+
+This module makes query runs resumable. The results of a read are written
+    to .part files that are renamed once complete, so an interrupted run
+    never leaves a truncated .out or .summary behind, and the reads whose
+    results are complete are appended to a journal in the output directory,
+    synced to disk after every batch. A resumed run skips the journaled
+    reads and searches the others again.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py --resume.
+
+Attributes:
+    JOURNAL (str): file name of the journal in the output directory
+
+    open_results(str, str): the .out and .summary files of a read, written
+        under temporary names and renamed when closed
+
+    Journal: the journal of a run, the reads done so far
+
+"""
+#%%
+import os
+import json
+from contextlib import contextmanager
+#%%
+JOURNAL = '6tbsps.journal'
+PART = '.part'
+#%%
+@contextmanager
+def open_results(out_dir, read_id):
+    """Open the .out and .summary files of a read for writing.
+        Both are written as .part files and renamed when the block exits
+        without an error.
+
+    Args:
+        out_dir (str):      output directory
+        read_id (str):      read identifier
+
+    Yields:
+        (out_file, sum_file): the open file handles
+    """
+    base = os.path.join(out_dir, read_id.replace('/', '|'))
+    with open(base + '.out' + PART, 'w') as out_file, \
+        open(base + '.summary' + PART, 'w') as sum_file:
+        yield out_file, sum_file
+    os.replace(base + '.out' + PART, base + '.out')
+    os.replace(base + '.summary' + PART, base + '.summary')
+#%%
+class Journal:
+    def __init__(self, out_dir, settings, resume=False):
+        """Start the journal of a run, or continue the one of an earlier run.
+
+        Args:
+            out_dir (str):      output directory
+            settings (dict):    the options that change the results, which a
+                                resumed run must share with the earlier one
+            resume (bool):      continue the journal found in out_dir, if any
+
+        self:
+            done (set):         reads whose results are complete
+
+        Raises:
+            ValueError:         when resuming with other settings
+        """
+        self.path = os.path.join(out_dir, JOURNAL)
+        self.done = set()
+        lines = []
+        if resume and os.path.exists(self.path):
+            with open(self.path, 'rb') as fh:
+                lines = fh.read().split(b'\n')
+        # a journal without a complete header has no reads either
+        if len(lines) < 2:
+            self.fh = open(self.path, 'w')
+            self.fh.write('#' + json.dumps(settings) + '\n')
+            self.sync()
+            return
+
+        header = json.loads(lines[0].decode()[1:])
+        if header != settings:
+            raise ValueError('cannot resume the run in {} with other options: {} '
+                             'instead of {}'.format(out_dir, settings, header))
+        self.done = set([line.decode() for line in lines[1:-1]])
+        # drop a last line torn by an interruption, and partial results
+        with open(self.path, 'rb+') as fh:
+            fh.truncate(sum([len(line) + 1 for line in lines[:-1]]))
+        for name in os.listdir(out_dir):
+            if name.endswith(PART):
+                os.remove(os.path.join(out_dir, name))
+        self.fh = open(self.path, 'a')
+
+    def record(self, read_ids):
+        """Add reads whose results are complete"""
+        for read_id in read_ids:
+            self.fh.write(read_id + '\n')
+        self.done.update(read_ids)
+        self.sync()
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def close(self):
+        self.fh.close()
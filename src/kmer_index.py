@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Integer-encoded k-mer index.
+
+This module stores the k-mer index of a database as flat arrays: the
+    sorted integer codes of its k-mers (see src.prefilter.encode_kmers),
+    the offset of the postings of each k-mer, and the reference and
+    position of every posting. The seeds of all frames of a read are
+    encoded and looked up in one searchsorted, and the candidate regions
+    of a frame are the minimum and maximum of its posting arrays per
+    reference, in the order of the dictionary index. K-mers with residues
+    outside A-Z, which no translated frame contains, are left out.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-build.py and src.seed_and_extend.seed_frames().
+
+Attributes:
+    build_arrays(dict, int): the arrays of a dictionary k-mer index, or
+        None when its k-mers do not fit the integer codes
+
+    KmerArrayIndex: the arrays, looked up like the dictionary index or all
+        seeds of a read at once
+
+"""
+#%%
+import numpy as np
+
+from src.prefilter import RESIDUE_BITS, encode_kmers
+from src.seed_and_extend import seed
+#%%
+LETTERS = set('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+#%%
+def build_arrays(table, k):
+    """Flatten a dictionary k-mer index into sorted arrays.
+
+    Args:
+        table (dict):       a dictionary that maps each k-mer to the list of
+                            (ref_id, position), see 6tbsps-build.py
+        k (int):            k-mer length
+
+    Returns:
+        arrays (dict):      k, codes (sorted uint64), offsets (postings of
+                            codes[i] are offsets[i]:offsets[i+1]), refs
+                            (int32 indices into names), locs (int32) and
+                            names (reference ids), or None when k-mers are
+                            too long for 64-bit codes
+    """
+    if RESIDUE_BITS * k > 64:
+        return None
+    kmers = [kmer for kmer in table if LETTERS.issuperset(kmer)]
+    codes = encode_kmers(kmers, k)
+    order = np.argsort(codes, kind='stable')
+    names, index = [], {}
+    refs, locs = [], []
+    offsets = np.zeros(len(kmers) + 1, dtype=np.int64)
+    for i, j in enumerate(order):
+        for ref_id, loc in table[kmers[j]]:
+            if ref_id not in index:
+                index[ref_id] = len(names)
+                names.append(ref_id)
+            refs.append(index[ref_id])
+            locs.append(loc)
+        offsets[i + 1] = len(refs)
+    return {'k': k, 'codes': codes[order], 'offsets': offsets,
+            'refs': np.array(refs, dtype=np.int32),
+            'locs': np.array(locs, dtype=np.int32), 'names': names}
+#%%
+class KmerArrayIndex:
+    def __init__(self, arrays):
+        """The arrays of build_arrays() as a k-mer index.
+
+        Args:
+            arrays (dict):      k, codes, offsets, refs, locs and names
+        """
+        self.k = arrays['k']
+        self.codes = arrays['codes']
+        self.offsets = arrays['offsets']
+        self.refs = arrays['refs']
+        self.locs = arrays['locs']
+        self.names = arrays['names']
+
+    def find(self, kmers):
+        """Row of each k-mer in codes, -1 for k-mers not indexed"""
+        if not kmers:
+            return np.zeros(0, dtype=np.intp)
+        codes = encode_kmers(kmers, self.k)
+        rows = np.searchsorted(self.codes, codes)
+        rows[rows == len(self.codes)] = 0
+        # residues outside A-Z share a code that no indexed k-mer has
+        found = (self.codes[rows] == codes) if len(self.codes) else \
+            np.zeros(len(codes), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def __getitem__(self, kmer):
+        '''Postings of a k-mer, as in the dictionary index'''
+        row = self.find([kmer])[0]
+        if row < 0:
+            raise KeyError(kmer)
+        s, e = self.offsets[row], self.offsets[row + 1]
+        return [(self.names[r], int(loc)) for r, loc in
+                zip(self.refs[s:e], self.locs[s:e])]
+
+    def __contains__(self, kmer):
+        return self.find([kmer])[0] >= 0
+
+    def get(self, kmer, default=None):
+        return self[kmer] if kmer in self else default
+
+    def keys(self):
+        '''The indexed k-mers, decoded from their codes'''
+        mask = np.uint64((1 << RESIDUE_BITS) - 1)
+        for code in self.codes:
+            yield ''.join([chr(ord('A') + int((code >> np.uint64(RESIDUE_BITS * i)) & mask))
+                           for i in range(self.k - 1, -1, -1)])
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def seed_regions(self, queries):
+        """Seed and extend the frames of a read in one lookup, with the
+            regions of naive_seed_and_extend().
+
+        Args:
+            queries (dict):     translated sequence of each frame
+
+        Returns:
+            regions (dict):     list of tuples of (ref_id, (start, end)) of
+                                each frame
+        """
+        frames = list(queries)
+        regions = {f: [] for f in frames}
+        kmers, owners = [], []
+        for i, f in enumerate(frames):
+            seeds = seed(queries[f], self.k)
+            kmers.extend(seeds)
+            owners.extend([i] * len(seeds))
+        rows = self.find(kmers)
+        found = rows >= 0
+        rows, owners = rows[found], np.array(owners, dtype=np.int64)[found]
+        if not len(rows):
+            return regions
+        # postings of all found seeds, in seed then posting order
+        firsts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - firsts
+        postings = np.arange(counts.sum()) + np.repeat(firsts - np.cumsum(counts) + counts,
+                                                       counts)
+        # one key per frame and reference, in order of its first posting as
+        # in extend(), with the minimum start and maximum end of its postings
+        keys = np.repeat(owners, counts) * len(self.names) + self.refs[postings]
+        uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        starts = np.full(len(uniq), np.iinfo(np.int64).max, dtype=np.int64)
+        ends = np.zeros(len(uniq), dtype=np.int64)
+        np.minimum.at(starts, inverse, self.locs[postings])
+        np.maximum.at(ends, inverse, self.locs[postings] + self.k)
+        order = np.argsort(first, kind='stable')
+        for key, s, e in zip(uniq[order].tolist(), starts[order].tolist(),
+                             ends[order].tolist()):
+            regions[frames[key // len(self.names)]].append(
+                (self.names[key % len(self.names)], (s, e)))
+        return regions
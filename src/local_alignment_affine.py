@@ -21,7 +21,8 @@ import numpy as np
 import math
 
 class LocalAlignment:
-    def __init__(self, seq_x, seq_y, score_matrix, gap_open=-12., gap_ext=-4.):
+    def __init__(self, seq_x, seq_y, score_matrix, gap_open=-12., gap_ext=-4.,
+                 profile=None):
         '''
         Init class parameters and score_matrix
         Parameters include the seq_x and seq_y, which need to be aligned.
@@ -32,12 +33,16 @@ class LocalAlignment:
             score_matrix (pandas.df): score matrix
             gap_open (float): gap opening
             gap_ext (float): gap extension
+            profile (QueryProfile): scores of seq_x, shared by all subjects
+                of a query; built on first use when None
         Returns:
             None
 
         self:
             X (numpy.array): upper matrix, _ will appear in seq_y
             Y (numpy.array): lower matrix, _ will appear in seq_x
+                X and Y are None without a gap opening penalty (linear gaps),
+                where they are M one cell up or left plus ge
             M (numpy.array): match matrix
             go (float): gap open panalty, for a score matrix, all go are same
             ge (float): gap extend panalty, for a score matrix, all ge are same
@@ -48,13 +53,17 @@ class LocalAlignment:
         self.ge = gap_ext
         self.x = seq_x
         self.y = seq_y
+        self.profile = profile
 
         # initialize three matrix for affine sw
         dim_i = len(seq_x) + 1
         dim_j = len(seq_y) + 1
+        self.M = np.zeros((dim_i, dim_j), dtype=float)
+        if gap_open == 0:
+            self.X = self.Y = None
+            return
         self.X = np.zeros((dim_i, dim_j), dtype=float)
         self.Y = np.zeros((dim_i, dim_j), dtype=float)
-        self.M = np.zeros((dim_i, dim_j), dtype=float)
         # initialize the first row/col of X, Y.
         # M's first row/col are zero, init already
         self.X[0,0], self.Y[0,0] = np.NaN, np.NaN
@@ -65,12 +74,23 @@ class LocalAlignment:
             self.X[0,j] = -np.inf
             self.Y[0,j] = np.NaN
 
+    def query_profile(self):
+        '''
+        return (QueryProfile): the profile of seq_x, built on first use
+        '''
+        if self.profile is None:
+            from src.query_profile import QueryProfile
+            self.profile = QueryProfile(self.x, self.score_matrix)
+        return self.profile
+
     def _match(self, i, j):
         '''
         i (int): index of current char in seq x
         j (int): index of current char in seq y
         return (float): score
         '''
+        if self.profile is not None:
+            return self.profile.rows[i-1][self.y[j-1]]
         return float(self.score_matrix[self.x[i-1]][self.y[j-1]])
         # return float(score_matrix(self.x[i-1], self.y[j-1], self.matrix_name))
         # if self.x[i-1] == self.y[j-1]:
@@ -96,6 +116,8 @@ class LocalAlignment:
             self.score
 
         '''
+        if self.X is None:
+            return self.fill_linear()
         dim_i = len(self.x) + 1
         dim_j = len(self.y) + 1
         for j in range(1, dim_j):
@@ -112,6 +134,29 @@ class LocalAlignment:
         self.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
         self.score = int(self.M[self.max_loc_list[0]])
         return self.score
+
+    def fill_linear(self):
+        '''
+        Fill M alone for linear gaps (go == 0): a gap can then always be
+        extended from M, so M is the best of the diagonal and of the cells
+        up and left plus ge, as the affine fill with go == 0.
+
+        return:
+            self.score
+        '''
+        dim_i = len(self.x) + 1
+        dim_j = len(self.y) + 1
+        M, ge = self.M, self.ge
+        for j in range(1, dim_j):
+            for i in range(1, dim_i):
+                M[i][j] = max(M[i-1][j-1] + self._match(i, j),
+                              M[i-1][j] + ge,
+                              M[i][j-1] + ge,
+                              0)
+        argmax = np.where(M == M.max())
+        self.max_loc_list = [(i, j) for i, j in zip(argmax[0], argmax[1])]
+        self.score = int(M[self.max_loc_list[0]])
+        return self.score
     
     def traceback(self):
         """
@@ -139,6 +184,8 @@ class LocalAlignment:
             self.xscript
 
         """
+        if self.X is None:
+            return self.traceback_linear()
         self.align_seq_x_list = []
         self.align_seq_y_list = []
         self.xscript_list = []
@@ -205,6 +252,58 @@ class LocalAlignment:
                self.align_seq_x_list, self.align_seq_y_list, self.xscript_list, \
                self.max_loc_x_list, self.max_loc_y_list
 
+    def traceback_linear(self):
+        '''
+        Trace back M alone for linear gaps, with the steps of traceback():
+        left when M equals the cell left plus ge, else up when it equals the
+        cell up plus ge, else diagonal, until M is 0
+
+        return:
+            the values of traceback()
+        '''
+        self.align_seq_x_list = []
+        self.align_seq_y_list = []
+        self.xscript_list = []
+        self.max_loc_x_list = []
+        self.max_loc_y_list = []
+        M, ge = self.M, self.ge
+
+        for i, j in self.max_loc_list:
+            align_seq_x = ''
+            align_seq_y = ''
+            xscript = ''
+            max_loc_x = [0, i - 1]
+            max_loc_y = [0, j - 1]
+            while M[i][j] != 0:
+                if j > 0 and M[i][j] == M[i][j-1] + ge:
+                    align_seq_x += '_'
+                    align_seq_y += self.y[j-1]
+                    xscript += ' '
+                    j -= 1
+                elif i > 0 and M[i][j] == M[i-1][j] + ge:
+                    align_seq_x += self.x[i-1]
+                    align_seq_y += '_'
+                    xscript += ' '
+                    i -= 1
+                else:
+                    align_seq_x += self.x[i-1]
+                    align_seq_y += self.y[j-1]
+                    xscript += '|' if self.x[i-1] == self.y[j-1] else '*'
+                    i -= 1
+                    j -= 1
+            max_loc_x[0] = i
+            max_loc_y[0] = j
+
+            self.align_seq_x_list.append(align_seq_x[::-1])
+            self.align_seq_y_list.append(align_seq_y[::-1])
+            self.xscript_list.append(xscript[::-1])
+            self.max_loc_x_list.append(max_loc_x)
+            self.max_loc_y_list.append(max_loc_y)
+
+        return self.score, \
+               self.align_seq_x_list, self.align_seq_y_list, self.xscript_list, \
+               self.max_loc_x_list, self.max_loc_y_list
+
     def display(self, base=0):
         '''
         Display some parameters of this function.
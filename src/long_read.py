@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Windowed long-read search.
+
+This module splits long reads into overlapping windows that are searched
+    independently, and merges the window hits that are collinear on the same
+    reference back into per-read results. The DP matrices of an alignment
+    are then bounded by the window length instead of the read length.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py --long-read.
+
+Attributes:
+    windows(str, int, int): split a read into overlapping windows whose
+        starts are multiples of 3
+
+    read_frame(int, int, int, int): map a window frame to the read frame and
+        the codon offset of the window in that frame
+
+    window_hits(list, int, int, int): convert the alignments of a window to
+        hit records in read coordinates
+
+    merge_hits(list, int, int): merge collinear hits of the same frame and
+        reference
+
+    sort_hits(list, dict): merged hits in the order of the .summary file
+
+    write_hits(str, list, dict, handle, handle): write the merged hits of a
+        read to the .out and .summary files
+
+"""
+#%%
+import math
+
+from src.hits import ref_order
+#%%
+def windows(seq, size, overlap):
+    """Split a read into overlapping windows.
+        Window starts are multiples of 3, so forward frames of a window are
+        the frames of the read. The last window is extended to the end of
+        the read.
+
+    Args:
+        seq (str):          DNA sequence of the read
+        size (int):         window length in bases
+        overlap (int):      overlap of consecutive windows in bases
+
+    Returns:
+        windows (list):     list of tuples of (start, window sequence)
+
+    """
+    if len(seq) <= size:
+        return [(0, seq)]
+    step = max(3, (size - overlap) // 3 * 3)
+    last = (len(seq) - size) // 3 * 3
+    starts = list(range(0, last, step)) + [last]
+    return [(s, seq[s:s+size] if s != last else seq[s:]) for s in starts]
+#%%
+def read_frame(f, w_start, w_end, read_len):
+    """Map a frame of a window to the frame of the read.
+
+    Args:
+        f (int):            frame of the window (-3..-1, 1..3)
+        w_start (int):      start of the window in the read
+        w_end (int):        end of the window in the read
+        read_len (int):     length of the read
+
+    Returns:
+        (frame, offset):    frame of the read and the codon index, in that
+                            frame, of the first codon of the window frame
+
+    """
+    if f > 0:
+        return f, w_start // 3
+    # start of the window frame on the reverse complement of the read
+    off = read_len - w_end - f - 1
+    return -(off % 3 + 1), off // 3
+#%%
+def window_hits(output, w_start, w_end, read_len):
+    """Convert the alignments of a window to hit records in read coordinates.
+        Query coordinates are codon indices in the frame of the read, subject
+        coordinates are residue positions in the reference protein.
+
+    Args:
+        output (list):      query output of the window, HitRecord of every
+                            hit, see src.hits
+        w_start (int):      start of the window in the read
+        w_end (int):        end of the window in the read
+        read_len (int):     length of the read
+
+    Returns:
+        hits (list):        list of hit dictionaries
+
+    """
+    hits = []
+    for h in output:
+        frame, off = read_frame(h.frame, w_start, w_end, read_len)
+        la, s = h.alignment, h.start
+        for i in range(len(la.max_loc_list)):
+            q0, q1 = la.max_loc_x_list[i]
+            s0, s1 = la.max_loc_y_list[i]
+            hits.append({
+                'frame': frame, 'ref_id': h.ref_id,
+                'q0': q0 + off, 'q1': q1 + off,
+                's0': s0 + s, 's1': s1 + s,
+                'score': h.score, 'evalue': h.evalue, 'query': h.query,
+                # coordinates of the alignment itself, kept when merging
+                'aln': (q0 + off, q1 + off, s0 + s, s1 + s),
+                'align_x': la.align_seq_x_list[i],
+                'xscript': la.xscript_list[i],
+                'align_y': la.align_seq_y_list[i],
+                'windows': 1,
+                # codons of the read frame translated by the window
+                'w0': off, 'w1': off + len(h.query),
+                'diag': s0 + s - q0 - off,
+            })
+    return hits
+#%%
+def merge_hits(hits, max_shift=8, max_gap=100):
+    """Merge hits that are collinear on the same reference.
+        Two hits of the same read frame and reference are collinear when
+        their diagonals (subject minus query start) differ by at most
+        max_shift and the second starts at most max_gap codons after the
+        end of the first. A merged hit spans the union of the query and
+        subject ranges and keeps the query, score, e-value and alignment of
+        its best window hit, and the codons of that window.
+
+    Args:
+        hits (list):        hit dictionaries from window_hits()
+        max_shift (int):    maximal diagonal difference
+        max_gap (int):      maximal gap in codons between chained hits
+
+    Returns:
+        merged (list):      merged hit dictionaries
+
+    """
+    groups = {}
+    for hit in hits:
+        groups.setdefault((hit['frame'], hit['ref_id']), []).append(hit)
+    merged = []
+    for group in groups.values():
+        chains = []
+        for hit in sorted(group, key=lambda h: (h['q0'], h['s0'])):
+            for chain in chains:
+                if abs(hit['diag'] - chain['diag']) <= max_shift and \
+                    hit['q0'] <= chain['q1'] + max_gap:
+                    best = chain if (chain['score'], -chain['evalue']) >= \
+                        (hit['score'], -hit['evalue']) else hit
+                    best = dict(best)
+                    best['q0'] = min(chain['q0'], hit['q0'])
+                    best['q1'] = max(chain['q1'], hit['q1'])
+                    best['s0'] = min(chain['s0'], hit['s0'])
+                    best['s1'] = max(chain['s1'], hit['s1'])
+                    best['windows'] = chain['windows'] + hit['windows']
+                    # the diagonal of the last chained hit
+                    best['diag'] = hit['diag']
+                    chain.clear()
+                    chain.update(best)
+                    break
+            else:
+                chains.append(dict(hit))
+        merged.extend(chains)
+    return merged
+#%%
+def sort_hits(hits, prot_seq):
+    """Sort merged hits by e-value then raw score, and hits of equal
+        e-value and score by frame and database order of the reference.
+
+    Args:
+        hits (list):        merged hit dictionaries
+        prot_seq (dict):    protein sequences of the database
+
+    Returns:
+        hits (list):        sorted hit dictionaries
+
+    """
+    order = ref_order(prot_seq)
+    return sorted(hits, key=lambda h: (h['evalue'], h['score'], h['frame'],
+                                       order[h['ref_id']]))
+
+def write_hits(read_id, hits, prot_seq, out_file, sum_file):
+    """Write the merged hits of a read, sorted by sort_hits(), in the format
+        of fio.align_out with an extra line of read-level ranges, and one
+        with the codons of the best window, whose query, length, score,
+        e-value and alignment the entry shows.
+
+    Args:
+        read_id (str):      read identifier
+        hits (list):        merged hit dictionaries
+        prot_seq (dict):    protein sequences of the database
+        out_file (handle):  output file handle
+        sum_file (handle):  summary file handle
+
+    Returns:
+        None
+
+    """
+    for h in sort_hits(hits, prot_seq):
+        print('Frame:', str(h['frame']), file=out_file)
+        print('Query:', h['query'], file=out_file)
+        print('Length:', len(h['query']), file=out_file)
+        print('Subject:', h['ref_id'], file=out_file)
+        print('Length:', len(prot_seq[h['ref_id']]), file=out_file)
+        print(file=out_file)
+
+        print('Score:', str(h['score']), file=out_file)
+        print('E-value:', str(h['evalue']), file=out_file)
+        print('Range: query {}-{} subject {}-{} windows {}'.format(
+            h['q0'], h['q1'], h['s0'], h['s1'], h['windows']), file=out_file)
+        print('Best window: query {}-{}'.format(h['w0'], h['w1'] - 1), file=out_file)
+        print(file=out_file)
+
+        # alignment of the best window hit
+        x0, x1, y0, y1 = h['aln']
+        left_digits = 1 if y0 <= 0 else int(math.log10(y0)) + 1
+        right_digits = 1 if y1 <= 0 else int(math.log10(y1)) + 1
+        print('{0:<{1}d}  {2}  {3:<{4}d}'.format(
+            x0, left_digits, h['align_x'], x1, right_digits), file=out_file)
+        print('{0}  {1}  {2}'.format(
+            ' ' * left_digits, h['xscript'], ' ' * right_digits), file=out_file)
+        print('{0:<{1}d}  {2}  {3:<{4}d}'.format(
+            y0, left_digits, h['align_y'], y1, right_digits), file=out_file)
+        print('', file=out_file)
+        print(file=out_file)
+
+        print('\t'.join([read_id, h['ref_id'], str(h['score']), str(h['evalue'])]),
+              file=sum_file)
+
+    return
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""K-mer prefilter of protein databases.
+
+This module keeps a bit per possible k-mer of a database, built next to its
+    k-mer index, so that a query can tell which frames cannot have a seed
+    hit without touching the index. K-mers are packed into integers of 5
+    bits per residue; short k-mers address a bitset of the whole k-mer
+    space, longer ones set the bits of a Bloom filter. Either way a k-mer
+    of the index is never rejected, so filtered frames are exactly those
+    without candidate regions and the results do not change.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-build.py and src.search.search_frames().
+
+Attributes:
+    encode_kmers(list, int): k-mers packed into integers
+
+    build_filter(iterable, int): the filter of the k-mers of an index
+
+    KmerFilter: a filter loaded with a database, testing the seeds of all
+        frames of a read at once
+
+    load_filter(str): the filter of a database base name, or None for
+        databases built without one
+
+"""
+#%%
+import os
+
+import numpy as np
+
+import src.file_io as fio
+from src.seed_and_extend import seed
+#%%
+# bits per residue: A-Z keep their own code, other characters share one
+RESIDUE_BITS = 5
+CODES = np.full(256, 31, dtype=np.uint64)
+CODES[ord('A'):ord('Z') + 1] = np.arange(26, dtype=np.uint64)
+# k-mer spaces of at most 2^EXACT_BITS bits (k <= 5, 4 MB) are a bitset,
+# larger ones a Bloom filter of about BLOOM_BITS bits and BLOOM_HASHES
+# hashes per k-mer (false positive rate around 2%)
+EXACT_BITS = 25
+BLOOM_BITS = 10
+BLOOM_HASHES = 3
+# odd multipliers of the multiply-shift hashes
+MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9]
+#%%
+def encode_kmers(kmers, k):
+    """Pack k-mers into integers of RESIDUE_BITS bits per residue, keeping
+        the last 64 // RESIDUE_BITS residues of longer k-mers.
+
+    Args:
+        kmers (list):       k-mers of length k
+        k (int):            k-mer length
+
+    Returns:
+        codes (np.ndarray): uint64 code of each k-mer
+    """
+    buf = np.frombuffer(''.join(kmers).encode('ascii', 'replace'), dtype=np.uint8)
+    residues = CODES[buf].reshape(-1, k)
+    codes = np.zeros(len(residues), dtype=np.uint64)
+    for i in range(k):
+        codes = (codes << np.uint64(RESIDUE_BITS)) | residues[:, i]
+    return codes
+
+def bit_positions(codes, log_bits, hashes):
+    """Bits of each code, one row per hash; the code itself for a bitset"""
+    if hashes == 0:
+        return codes[None, :]
+    shift = np.uint64(64 - log_bits)
+    return np.array([(codes * np.uint64(a)) >> shift for a in MULTIPLIERS[:hashes]])
+#%%
+def build_filter(kmers, k):
+    """Build the filter of the k-mers of an index.
+
+    Args:
+        kmers (iterable):   k-mers of the index
+        k (int):            k-mer length
+
+    Returns:
+        table (dict):       k, log_bits (log2 of the number of bits), hashes
+                            (0 for a bitset) and bits, the packed bits as a
+                            uint8 array
+    """
+    kmers = list(kmers)
+    if RESIDUE_BITS * k <= EXACT_BITS:
+        log_bits, hashes = RESIDUE_BITS * k, 0
+    else:
+        log_bits = max(10, (BLOOM_BITS * len(kmers)).bit_length())
+        hashes = BLOOM_HASHES
+    bits = np.zeros(max(1, (1 << log_bits) // 8), dtype=np.uint8)
+    if kmers:
+        positions = bit_positions(encode_kmers(kmers, k), log_bits, hashes).ravel()
+        np.bitwise_or.at(bits, positions >> np.uint64(3),
+                         (1 << (positions & np.uint64(7))).astype(np.uint8))
+    return {'k': k, 'log_bits': log_bits, 'hashes': hashes, 'bits': bits}
+#%%
+class KmerFilter:
+    def __init__(self, table):
+        """A filter built by build_filter().
+
+        Args:
+            table (dict):       k, log_bits, hashes and bits
+        """
+        self.k = table['k']
+        self.log_bits = table['log_bits']
+        self.hashes = table['hashes']
+        self.bits = table['bits']
+
+    def contains(self, kmers):
+        """Whether each k-mer may be in the index, False only when it is not"""
+        if not kmers:
+            return np.zeros(0, dtype=bool)
+        positions = bit_positions(encode_kmers(kmers, self.k), self.log_bits,
+                                  self.hashes)
+        found = (self.bits[positions >> np.uint64(3)] >>
+                 (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return found.all(axis=0)
+
+    def passing(self, queries):
+        """Frames of a read that may have a seed hit, in one pass over the
+            seeds of all of its frames.
+
+        Args:
+            queries (dict):     translated sequence of each frame
+
+        Returns:
+            frames (set):       frames with at least one seed that may be
+                                indexed
+        """
+        frames, kmers = [], []
+        for f, query in queries.items():
+            seeds = seed(query, self.k)
+            frames.extend([f] * len(seeds))
+            kmers.extend(seeds)
+        return set([f for f, hit in zip(frames, self.contains(kmers)) if hit])
+#%%
+def load_filter(db):
+    """The KmerFilter of a database base name, None when it has none"""
+    if not os.path.exists(db + '.filter.pickle'):
+        return None
+    return KmerFilter(fio.read_dict(db + '.filter'))
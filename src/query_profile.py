@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Query profiles for local alignment.
+
+This module precomputes, once per translated frame, the score of every query
+    residue against every residue of the alphabet. Aligners then look up a
+    cell score by the residue code of the subject instead of two dictionary
+    lookups per cell, and a whole DP column is a gather of one column of the
+    profile. The profile also bounds the best local alignment score of the
+    query against a subject, so that candidates which cannot reach a
+    reporting cutoff are not aligned.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See src.aligners.align_all().
+
+Attributes:
+    score_table(dict): the score matrix as an integer-indexed numpy table
+
+    encode(str, dict): residue codes of a sequence
+
+    max_segment(numpy.array): best sum of a contiguous run of values
+
+    QueryProfile: the m x alphabet score table of a query
+
+"""
+#%%
+from functools import cached_property
+
+import numpy as np
+#%%
+# encoded score matrices, keyed by id() and holding the matrix itself so
+# that the id cannot be reused while the entry exists
+_tables = {}
+
+def score_table(score_matrix):
+    """Encode a score matrix as a numpy table indexed by residue codes.
+
+    Args:
+        score_matrix (dict):    score matrix, see src.score_matrix
+
+    Returns:
+        (alphabet, table):      a dictionary that maps each residue to its
+                                code, and the float table of scores
+    """
+    key = id(score_matrix)
+    if key not in _tables:
+        alphabet = {a: i for i, a in enumerate(score_matrix)}
+        table = np.array([[score_matrix[a][b] for b in score_matrix]
+                          for a in score_matrix], dtype=float)
+        _tables[key] = (score_matrix, alphabet, table)
+    return _tables[key][1:]
+
+def encode(seq, alphabet):
+    """Residue codes of a sequence, unknown residues as 'X'"""
+    return np.array([alphabet.get(a, alphabet['X']) for a in seq], dtype=np.intp)
+#%%
+def max_segment(values):
+    """Best sum of a contiguous run of values, 0 for an empty run: the
+        largest rise of their running sum"""
+    sums = np.concatenate([[0.], np.cumsum(values)])
+    return float((sums - np.minimum.accumulate(sums)).max())
+#%%
+class QueryProfile:
+    def __init__(self, query, score_matrix):
+        """Build the profile of a query for a score matrix.
+
+        Args:
+            query (str):            query sequence
+            score_matrix (dict):    score matrix
+
+        self:
+            query (str):            query sequence
+            alphabet (dict):        a dictionary that maps each residue to
+                                    its code
+            codes (numpy.array):    residue codes of the query
+            scores (numpy.array):   m x alphabet table, the score of query
+                                    residue i against residue code a
+        """
+        self.query = query
+        self.score_matrix = score_matrix
+        self.alphabet, table = score_table(score_matrix)
+        self.codes = encode(query, self.alphabet)
+        self.scores = table[self.codes]
+
+    @cached_property
+    def rows(self):
+        """The scores as one dictionary per query residue, for the pure
+            Python aligner, built on first use"""
+        return [dict(zip(self.alphabet, r)) for r in self.scores.tolist()]
+
+    @cached_property
+    def col_max(self):
+        """Best score of any query residue against each residue code"""
+        if len(self.query) == 0:
+            return np.zeros(len(self.alphabet))
+        return self.scores.max(axis=0)
+
+    @cached_property
+    def bound(self):
+        """Best run of the best score of each query residue"""
+        if len(self.query) == 0:
+            return 0.
+        return max_segment(self.scores.max(axis=1))
+
+    def subject_scores(self, seq_y):
+        """Score of every query residue against every residue of seq_y.
+
+        Args:
+            seq_y (str):            subject sequence
+
+        Returns:
+            scores (numpy.array):   m x len(seq_y) cell scores
+        """
+        return self.scores[:, encode(seq_y, self.alphabet)]
+
+    def upper_bound(self, seq_y=None):
+        """Upper bound of the local alignment score of the query.
+            Every aligned query residue scores at most its best score against
+            the alphabet and every aligned subject residue at most its best
+            score against the query, and gaps only lower a score, so the
+            best run of either bounds any local alignment.
+
+        Args:
+            seq_y (str):            subject sequence, or None for any subject
+
+        Returns:
+            bound (float):          score upper bound
+        """
+        if seq_y is None:
+            return self.bound
+        return min(self.bound,
+                   max_segment(self.col_max[encode(seq_y, self.alphabet)]))
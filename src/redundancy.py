@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Redundancy collapsing of protein databases.
+
+This module stores every residue run shared by several references once.
+    References are split into pieces of unique segments: a piece is either
+    a long exact match to a segment of an earlier reference, or a new
+    segment of its own. Only segments are indexed, and a k-mer posting of a
+    segment expands at query time to every reference piece it falls in, in
+    the order of the uncollapsed index. Seeding, candidate regions and hence
+    the output are the same as with the uncollapsed database, while shared
+    regions are indexed (and, with identical subjects, aligned) once.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-build.py --collapse.
+
+Attributes:
+    collapse(dict, int): split references into pieces of unique segments
+        and index the segments
+
+    CollapsedIndex: k-mer index of the segments, looked up like the
+        uncollapsed index
+
+    ProteinSet: reference sequences rebuilt from their pieces on demand
+
+    load_database(str): the k-mer index and protein sequences of a database
+        base name, collapsed or not
+
+    total_residues(dict): total length of the reference proteins
+
+"""
+#%%
+import os
+from collections import OrderedDict
+
+import src.file_io as fio
+#%%
+# length of the exact anchors used to find shared runs, which are found
+# when at least ANCHOR + ANCHOR // 2 - 1 residues long
+ANCHOR = 32
+# rebuilt reference sequences a ProteinSet keeps, the least recently used
+# are rebuilt again
+CACHE_SIZE = 1024
+#%%
+def shared_runs(seq, anchors, segments, width):
+    """Find long exact matches of a sequence in the segments so far.
+        Anchors are sampled every width // 2 positions of the segments; a
+        hit is extended in both directions, and the scan resumes after the
+        end of the match.
+
+    Args:
+        seq (str):          protein sequence
+        anchors (dict):     a dictionary that maps each sampled anchor to
+                            its (segment, position)
+        segments (list):    segment sequences
+        width (int):        anchor length
+
+    Returns:
+        runs (list):        list of tuples of (start, end, segment, segment
+                            start) of matched residues, in order of start
+    """
+    runs = []
+    p = 0
+    last = 0
+    while p <= len(seq) - width:
+        hit = anchors.get(seq[p:p+width])
+        if hit is None:
+            p += 1
+            continue
+        seg, loc = hit
+        segment = segments[seg]
+        back = 0
+        while p - back > last and loc - back > 0 and \
+            seq[p-back-1] == segment[loc-back-1]:
+            back += 1
+        fwd = width
+        while p + fwd < len(seq) and loc + fwd < len(segment) and \
+            seq[p+fwd] == segment[loc+fwd]:
+            fwd += 1
+        runs.append((p - back, p + fwd, seg, loc - back))
+        p = last = p + fwd
+    return runs
+#%%
+def collapse(seqs, k, width=ANCHOR):
+    """Split references into pieces of unique segments and index the
+        segments. Longer references are split first, so that shorter ones
+        find their residues in them.
+        A piece (start, segment, segment start, length) copies length
+        residues of a segment to the reference, and owns the k-mers that
+        start in its first length - k + 1 residues. Pieces of new segments
+        overlap their neighbours by up to k - 1 residues, so that every
+        k-mer of a reference is owned by exactly one piece.
+
+    Args:
+        seqs (dict):        protein dictionary
+        k (int):            k-mer length
+        width (int):        anchor length, at least k
+
+    Returns:
+        segments (list):    segment sequences
+        refs (list):        list of tuples of (ref_id, length, pieces), in
+                            the order of seqs
+        table (dict):       a dictionary that maps each k-mer to the list of
+                            segments and positions
+    """
+    width = max(width, k)
+    segments = []
+    anchors = {}
+    table = {}
+    pieces = {}
+    for ref_id in sorted(seqs, key=lambda r: -len(seqs[r])):
+        seq = seqs[ref_id]
+        runs = [r for r in shared_runs(seq, anchors, segments, width)
+                if r[1] - r[0] >= k]
+        ref_pieces = [(a, seg, loc, b - a) for a, b, seg, loc in runs]
+        # k-mer starts not owned by a shared run go to new segments
+        own = []
+        start = 0
+        for a, b, _, _ in runs + [(len(seq) - k + 1, None, None, None)]:
+            if a > start:
+                own.append((start, a))
+            if b is not None:
+                start = b - k + 1
+        if len(seq) < k:
+            own = [(0, 0)]
+        for u0, u1 in own:
+            segment = seq[u0: u1 + k - 1]
+            seg = len(segments)
+            segments.append(segment)
+            ref_pieces.append((u0, seg, 0, len(segment)))
+            for loc in range(len(segment) - k + 1):
+                table.setdefault(segment[loc:loc+k], []).append((seg, loc))
+            for loc in range(0, len(segment) - width + 1, width // 2):
+                anchors.setdefault(segment[loc:loc+width], (seg, loc))
+        pieces[ref_id] = sorted(ref_pieces)
+
+    refs = [(ref_id, len(seqs[ref_id]), pieces[ref_id]) for ref_id in seqs]
+    return segments, refs, table
+#%%
+class CollapsedIndex:
+    def __init__(self, table, refs, k):
+        '''
+        Init the expansion of segment postings to references
+
+        Args:
+            table (dict): k-mer index of the segments
+            refs (list): list of tuples of (ref_id, length, pieces)
+            k (int): k-mer length
+
+        self:
+            members (dict): a dictionary that maps each segment to the list
+                of (rank, ref_id, start, segment start, segment end) of the
+                pieces copying it, where segment end is one past the last
+                k-mer start owned by the piece
+        '''
+        self.table = table
+        self.k = k
+        self.members = {}
+        for rank, (ref_id, _, pieces) in enumerate(refs):
+            for start, seg, loc, length in pieces:
+                self.members.setdefault(seg, []).append(
+                    (rank, ref_id, start, loc, loc + length - k + 1))
+
+    def __getitem__(self, kmer):
+        '''Postings of a k-mer in reference coordinates, ordered as in the
+        uncollapsed index'''
+        hits = []
+        for seg, loc in self.table[kmer]:
+            for rank, ref_id, start, seg_start, seg_end in self.members[seg]:
+                if seg_start <= loc < seg_end:
+                    hits.append((rank, start + loc - seg_start, ref_id))
+        hits.sort()
+        return [(ref_id, loc) for _, loc, ref_id in hits]
+
+    def __contains__(self, kmer):
+        return kmer in self.table
+
+    def get(self, kmer, default=None):
+        return self[kmer] if kmer in self.table else default
+
+    def keys(self):
+        return self.table.keys()
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+#%%
+class ProteinSet:
+    def __init__(self, segments, refs):
+        '''
+        Init the reference sequences of a collapsed database
+
+        Args:
+            segments (list): segment sequences
+            refs (list): list of tuples of (ref_id, length, pieces)
+
+        self:
+            lengths (dict): a dictionary that maps each reference to its length
+            pieces (dict): a dictionary that maps each reference to its pieces
+            cache (OrderedDict): the last CACHE_SIZE sequences rebuilt or
+                looked up, least recently used first
+        '''
+        self.segments = segments
+        self.lengths = {ref_id: length for ref_id, length, _ in refs}
+        self.pieces = {ref_id: pieces for ref_id, _, pieces in refs}
+        self.cache = OrderedDict()
+
+    def __getitem__(self, ref_id):
+        '''Rebuild a reference sequence from its pieces'''
+        if ref_id in self.cache:
+            self.cache.move_to_end(ref_id)
+        else:
+            seq = []
+            end = 0
+            for start, seg, loc, length in self.pieces[ref_id]:
+                # skip the residues shared with the previous piece
+                skip = max(end - start, 0)
+                seq.append(self.segments[seg][loc + skip: loc + length])
+                end = max(end, start + length)
+            self.cache[ref_id] = ''.join(seq)
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return self.cache[ref_id]
+
+    def __contains__(self, ref_id):
+        return ref_id in self.lengths
+
+    def __iter__(self):
+        return iter(self.lengths)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def keys(self):
+        return self.lengths.keys()
+
+    def items(self):
+        return ((ref_id, self[ref_id]) for ref_id in self.lengths)
+#%%
+def load_database(db):
+    """Load the k-mer index and protein sequences of a database.
+
+    Args:
+        db (str):           database base name
+
+    Returns:
+        prot_db (dict):     k-mer index, a CollapsedIndex for collapsed
+                            databases and a KmerArrayIndex for databases
+                            built with its arrays
+        prot_seq (dict):    protein sequences, a ProteinSet for collapsed
+                            databases
+    """
+    if not os.path.exists(db + '.nr.pickle'):
+        if os.path.exists(db + '.kidx.pickle'):
+            # numpy is imported by queries only, not by 6tbsps-build.py
+            from src.kmer_index import KmerArrayIndex
+            return KmerArrayIndex(fio.read_dict(db + '.kidx')), \
+                fio.read_dict(db + '.prot')
+        return fio.read_dict(db + '.kmer'), fio.read_dict(db + '.prot')
+    nr = fio.read_dict(db + '.nr')
+    table = fio.read_dict(db + '.kmer')
+    return CollapsedIndex(table, nr['refs'], nr['k']), \
+        ProteinSet(nr['segments'], nr['refs'])
+
+def total_residues(prot_seq):
+    """Total length of the reference proteins, the n of the e-value"""
+    if isinstance(prot_seq, ProteinSet):
+        return sum(prot_seq.lengths.values())
+    return sum([len(prot_seq[name]) for name in prot_seq])
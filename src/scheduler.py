@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Length-aware task scheduler for the query pool.
+
+This module groups reads into size-balanced batches before they are handed to
+    the multiprocessing pool, so that short reads do not pay the per-task
+    overhead one by one and long reads are dispatched first instead of
+    leaving cores idle at the end of a run.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py for the driver.
+
+Attributes:
+    first_stops(str): codons before the first stop codon of each frame
+
+    frame_seeds(str, int): the seeds of the six frames of a read
+
+    estimate_cost(str, dict, int): estimate the alignment work of a read as
+        translated residues times the candidate residues found by seeding
+
+    make_batches(list, int): pack (read_id, seq, cost) tuples into balanced
+        batches, longest work first
+
+    utilization(list, float): summarize per-worker busy time from the
+        batch reports returned by the pool
+
+    print_utilization(dict, file): print the per-worker utilization table
+
+"""
+#%%
+import re
+import sys
+import heapq
+
+import src.six_frame_translation as sft
+from src.seed_and_extend import seed_frames
+#%%
+# overlapping matches, so that stop codons of all frames are found
+STOP = re.compile('(?=TAA|TAG|TGA)')
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+def first_stops(dna):
+    """Number of codons before the first stop codon of each frame of a DNA
+        strand, or of its whole length without a stop codon"""
+    codons = [(len(dna) - offset) // 3 for offset in range(3)]
+    found = set()
+    for match in STOP.finditer(dna):
+        offset = match.start() % 3
+        if offset not in found:
+            found.add(offset)
+            codons[offset] = match.start() // 3
+            if len(found) == 3:
+                break
+
+    return codons
+
+def frame_seeds(seq, k):
+    """The seeds of the six frames of a read, translating the codons of the
+        seeds only. A frame is translated up to its first stop codon, found
+        by a regular expression, and becomes its head seed followed by its
+        tail seed, a sequence that src.seed_and_extend.seed() splits into
+        the seeds of the whole translated frame.
+
+    Args:
+        seq (str):          DNA sequence of the read
+        k (int):            length of seeds
+
+    Returns:
+        frames (dict):      (translated length, seed sequence) of each frame
+
+    """
+    # the complement of sft.reverse_complement(), which drops other bases
+    if set(seq) <= set('ACGT'):
+        reverse = seq.translate(COMPLEMENT)[::-1]
+    else:
+        reverse = sft.reverse_complement(seq)
+    frames = {}
+    for sign, strand in [(1, seq), (-1, reverse)]:
+        for offset, codons in enumerate(first_stops(strand)):
+            seeds = ''
+            if codons >= k:
+                for s in [offset, offset + 3 * (codons - k)]:
+                    seeds += sft.translation(sft.transcription(strand[s:s + 3 * k]))
+            frames[sign * (offset + 1)] = (codons, seeds)
+
+    return frames
+
+def estimate_cost(seq, prot_db, k):
+    """Estimate the alignment work of a read.
+        The cost of a frame is its translated length times the total length
+        of the candidate regions its seeds hit, i.e. the number of DP cells
+        that will be filled. The cost of a read is the sum over six frames.
+        Only the codons of the seeds are translated, so the estimate costs
+        little next to the search of the read in a worker.
+
+    Args:
+        seq (str):          DNA sequence of the read
+        prot_db (dict):     pre-index kmer dictionary (protein database)
+        k (int):            length of seeds
+
+    Returns:
+        cost (int):         estimated number of DP cells, at least the number
+                            of translated residues so that reads without
+                            candidates still carry their fixed overhead
+
+
+    """
+    cost = 0
+    frames = frame_seeds(seq, k)
+    queries = {f: seeds for f, (_, seeds) in frames.items()}
+    for f, regions in seed_frames(queries, prot_db, k).items():
+        m = frames[f][0]
+        cost += m + m * sum([e - s for _, (s, e) in regions])
+
+    return cost
+#%%
+def make_batches(tasks, num_batches):
+    """Pack reads into size-balanced batches (longest processing time first).
+        Reads are sorted by decreasing cost and each one goes to the batch
+        with the least work so far. The batches are returned in decreasing
+        order of total cost so the pool starts with the longest work.
+
+    Args:
+        tasks (list):       list of tuples of (read_id, seq, cost)
+        num_batches (int):  number of batches to create
+
+    Returns:
+        batches (list):     list of lists of (read_id, seq), heaviest first
+
+    """
+    num_batches = max(1, min(num_batches, len(tasks)))
+    heap = [(0, b) for b in range(num_batches)]
+    batches = [[] for _ in range(num_batches)]
+    totals = [0] * num_batches
+    for read_id, seq, cost in sorted(tasks, key=lambda x: -x[2]):
+        total, b = heapq.heappop(heap)
+        batches[b].append((read_id, seq))
+        totals[b] = total + cost
+        heapq.heappush(heap, (totals[b], b))
+
+    order = sorted(range(num_batches), key=lambda b: -totals[b])
+    return [batches[b] for b in order if batches[b]]
+#%%
+def utilization(reports, wall_time):
+    """Summarize per-worker utilization from batch reports.
+
+    Args:
+        reports (list):     list of tuples of (pid, busy_time, num_reads)
+                            returned by each batch
+        wall_time (float):  wall time of the pool in seconds
+
+    Returns:
+        workers (dict):     a dictionary that maps each worker pid to
+                            [batches, reads, busy_time, utilization]
+
+    """
+    workers = {}
+    for pid, busy, num_reads in reports:
+        if pid not in workers:
+            workers[pid] = [0, 0, 0.0, 0.0]
+        workers[pid][0] += 1
+        workers[pid][1] += num_reads
+        workers[pid][2] += busy
+    for pid in workers:
+        if wall_time > 0:
+            workers[pid][3] = workers[pid][2] / wall_time
+
+    return workers
+#%%
+def print_utilization(workers, out_file=None):
+    """Print the per-worker utilization table.
+
+    Args:
+        workers (dict):     output of utilization()
+        out_file (handle):  output file handle, sys.stdout when None
+
+    Returns:
+        None
+
+    """
+    if out_file is None:
+        out_file = sys.stdout
+    print('\t'.join(['worker', 'batches', 'reads', 'busy(s)', 'utilization']),
+          file=out_file)
+    for pid in sorted(workers):
+        batches, num_reads, busy, util = workers[pid]
+        print('\t'.join([str(pid), str(batches), str(num_reads),
+                         '{:.3f}'.format(busy), '{:.1%}'.format(util)]),
+              file=out_file)
+    if workers:
+        busy = [w[2] for w in workers.values()]
+        imbalance = max(busy) / (sum(busy) / len(busy)) if sum(busy) else 1.0
+        print('load imbalance (max/mean busy): {:.3f}'.format(imbalance),
+              file=out_file)
+
+    return
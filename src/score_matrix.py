@@ -12,13 +12,19 @@ Email:
 Attributes:
     Score matrix: BLOSUM45, BLOSUM62, BLOSUM80
     e_Value_cal(m,n,S)
+    bit_score(S)
+
+    The matrices are read from score_matrices/ next to the package, whatever
+    the working directory, and cached there as pickles on first use.
 
 
 
 """
 
+import os
+import csv
 import math
-import pandas
+import pickle
 
 '''Cited from the original paper of BLOSUM, We used the same gap penalties for all matrices, 
 -12 for the first residue in a gap, and -4 for subsequent residues in a gap. 
@@ -26,6 +32,25 @@ And in the matrix, '*' represents gap and the penalty is -5, -4 and -6 according
 
 '''
 
+MATRIX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'score_matrices')
+
+
+def read_matrix_csv(path):
+    """
+    Read a score matrix from a CSV file whose first row and column are the residues.
+    Args:
+        path (str): CSV file name
+    Returns:
+        matrix (dict): matrix[a][b] is the score of residues a and b
+    """
+    with open(path, newline='') as fh:
+        rows = list(csv.reader(fh))
+    residues = rows[0]
+    matrix = {row[0]: dict(zip(residues, map(int, row[1:]))) for row in rows[1:]}
+    assert all(matrix[a][b] == matrix[b][a] for a in matrix for b in matrix)
+    return matrix
+
 
 def score_matrix(matrix_name='BLOSUM62'):
     """
@@ -36,15 +61,33 @@ def score_matrix(matrix_name='BLOSUM62'):
     Returns:
         score (int): score based on xc and yc
     """
-    path = './score_matrices/' + matrix_name + '.csv'
-    matrix = pandas.read_csv(path)
-    assert (matrix == matrix.T).all().all()
-    matrix = matrix.to_dict('index')
+    path = os.path.join(MATRIX_DIR, matrix_name + '.csv')
+    cache = os.path.join(MATRIX_DIR, matrix_name + '.pickle')
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        with open(cache, 'rb') as fh:
+            return pickle.load(fh)
+    matrix = read_matrix_csv(path)
     # matrix.rename(index={'*': '-'}, columns={'*': '-'}, inplace=True)
+    try:
+        tmp = '{}.{}.tmp'.format(cache, os.getpid())
+        with open(tmp, 'wb') as fh:
+            pickle.dump(matrix, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    except OSError:
+        # read-only install, parse the CSV on every run
+        pass
     return matrix
     # return Matrix.loc[xc, yc]
 
 
+# Karlin-Altschul K and lambda of each matrix
+KARLIN = {
+    'BLOSUM62': (0.139042, 0.320733),
+    'BLOSUM45': (0.095168, 0.231019),
+    'BLOSUM80': (0.185160, 0.350826),
+}
+
+
 def e_value_cal(m, n, S, name='BLOSUM62'):
     '''
     Actually, the parameters in the evalue calculating equation is quite hard to determine. We use data from this site
@@ -56,16 +99,19 @@ def e_value_cal(m, n, S, name='BLOSUM62'):
 
     '''
     e = math.e
-    if name == 'BLOSUM62':
-        E = 0.139042 * m * n * e ** (-0.320733 * S)
-    if name == 'BLOSUM45':
-        E = 0.095168 * m * n * e ** (-0.231019 * S)
-    if name == 'BLOSUM80':
-        E = 0.185160 * m * n * e ** (-0.350826 * S)
+    K, lam = KARLIN[name]
+    E = K * m * n * e ** (-lam * S)
     return E
 
 
-result = pandas.DataFrame(columns=('#', 'query', 'reference', 'score', 'range', 'e-value', 'alignment'))
-'''Just a suggestion on the final dataframe.'''
+def bit_score(S, name='BLOSUM62'):
+    '''
+    param S: local alignment score
+    return: bit score = (lambda*S - ln k) / ln 2, the score that e_value_cal
+        turns into e-value = mn2^-bits
+    '''
+    K, lam = KARLIN[name]
+    return (lam * S - math.log(K)) / math.log(2)
+
 
 # print(score_matrix('A','-','BLOSUM45'))
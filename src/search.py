@@ -0,0 +1,670 @@
+# -*- coding: utf-8 -*-
+'''
+Search DNA reads against an opened protein database with a pool of worker
+processes. Workers receive the database once, when the pool starts, and the
+run options with every batch, so one pool can serve many runs.
+
+Usage:
+	>>> import src.file_io as fio
+	>>> from src.search import Searcher
+	>>> with Searcher('test/sars2', processes=4) as searcher:
+	...     for hit in searcher.search(fio.read_fasta('reads.fa')):
+	...         print(hit.read_id, hit.ref_id, hit.evalue)
+
+	See also 6tbsps-query.py and 6tbsps-server.py.
+
+Attributes:
+	Searcher: a database and a worker pool opened once, searching reads into
+		hit records or result files
+
+	Hit: the hit record of one .summary line
+
+	open_database(str, int, str): load a database, or one shard of it, and
+		the score matrix
+
+	run(Pool, dict, dict, dict, int): search reads with a pool started by
+		init_worker, or in this process, and write their results
+
+	init_worker(dict), query_batch(tuple), search_batch(tuple): the worker
+		side of run() and Searcher.search()
+
+	search_frames, search_strands: search one read in 6 frames or, with a
+		frameshift penalty, in 2 strands
+
+	sort_hits(list, dict): the order of the hits of a read in its .summary
+'''
+#%%
+import os
+import time
+import tempfile
+import multiprocessing
+from collections import namedtuple, deque
+from functools import partial
+
+# custom src
+import src.file_io as fio
+import src.six_frame_translation as sft
+from src.seed_and_extend import seed_frames, seed
+from src.local_alignment_affine import LocalAlignment
+from src.frameshift_alignment import FrameshiftAlignment
+from src.aligners import get_aligner, align_all, GAP_MODELS
+from src.query_profile import QueryProfile
+from src.hits import Alignment, HitRecord, ref_order
+from src.score_matrix import score_matrix, e_value_cal
+from src.scheduler import estimate_cost, make_batches, utilization
+from src.stats import QueryStats, write_stats, start_profile, stop_profile, \
+	merge_profiles
+import src.long_read as lr
+from src.redundancy import load_database, total_residues
+from src.prefilter import load_filter
+from src.shards import read_manifest, shard_db
+from src.journal import Journal, open_results
+from src.columnar import TableWriter, check_format, prune_tables
+#%%
+def open_database(db, shard=None, sm_name='BLOSUM62'):
+	'''
+	Load a pre-indexed protein database, collapsed or not, or one shard of a
+	sharded database
+
+	Args:
+		db (str): 			database base name
+		shard (int): 		shard to load of a sharded database
+		sm_name (str): 		score matrix name
+
+	Returns:
+		database (dict): 	db, shard, sm_name, k, prot_db, sm, prot_seq, n,
+							the total residues of the (whole) database, and
+							filter, its KmerFilter or None
+
+	Raises:
+		ValueError: 		when shard does not match the database, or an
+							unsharded dictionary index has no k-mers
+	'''
+	manifest = read_manifest(db)
+	if manifest is None and shard is not None:
+		raise ValueError('--shard needs a sharded database')
+	if manifest is not None and shard is None:
+		raise ValueError('{} has {} shards, choose one with --shard'.format( \
+			db, len(manifest['shards'])))
+	name = db if manifest is None else shard_db(db, manifest, shard)
+	prot_db, prot_seq = load_database(name)
+	# k of the manifest or the index, or of a k-mer of a dictionary index
+	k = manifest['k'] if manifest is not None else getattr(prot_db, 'k', None)
+	if k is None:
+		kmer = next(iter(prot_db.keys()), None)
+		if kmer is None:
+			raise ValueError('{} has no k-mers, build it again'.format(name))
+		k = len(kmer)
+
+	return {
+		'db': db,
+		'shard': shard,
+		'sm_name': sm_name,
+		'k': k,
+		'prot_db': prot_db,
+		'sm': score_matrix(sm_name),
+		'prot_seq': prot_seq,
+		# total length of protein database, of all shards when sharded
+		'n': total_residues(prot_seq) if manifest is None else manifest['residues'],
+		'filter': load_filter(name),
+	}
+#%%
+def run(pool, database, reads, options, num_batches, on_read=None):
+	'''
+	Search reads with a pool started with init_worker(database) and write
+	the .out and .summary files of every read
+
+	Args:
+		pool (Pool): 		worker pool, or None to search in this process
+		database (dict): 	output of open_database()
+		reads (dict): 		a dictionary of read identifiers to sequences
+		options (dict): 	run options: out_dir, stats (STATS base name or
+							None), profile (PROFILE base name or None),
+							long_read, window, overlap, frameshift (penalty
+							or None), aligner (backend name), gap_model
+							(see src.aligners.GAP_MODELS), max_evalue
+							(report hits up to this e-value, all when
+							missing or None), resume
+							(skip the reads done by an earlier run in
+							out_dir, see src.journal) and columnar (npz or
+							parquet tables of the hits, see src.columnar,
+							or None)
+		num_batches (int): 	number of read batches
+		on_read (func): 	called with each read_id once its results are
+							written
+
+	Returns:
+		workers (dict): 	per-worker utilization, see scheduler.utilization()
+
+	Raises:
+		ValueError: 		when resuming a run with other options, or when
+							the columnar format cannot be written
+	'''
+	k, prot_db, prot_seq = database['k'], database['prot_db'], database['prot_seq']
+	out_dir = options['out_dir']
+	columnar = options.get('columnar')
+	if columnar is not None:
+		check_format(columnar)
+	if not os.path.exists(out_dir):
+		os.makedirs(out_dir)
+	# the options that change the results of a read
+	settings = {key: database[key] for key in ['shard', 'sm_name']}
+	settings['db'] = os.path.abspath(database['db'])
+	settings.update({key: options[key] for key in \
+		['frameshift', 'long_read', 'window', 'overlap', 'gap_model']})
+	max_evalue = options.get('max_evalue')
+	if max_evalue is not None:
+		# journals of runs without a cutoff stay valid
+		settings['max_evalue'] = max_evalue
+	settings['columnar'] = columnar
+	journal = Journal(out_dir, settings, options.get('resume', False))
+	# the reads searched again must not keep rows of an earlier run
+	prune_tables(out_dir, journal.done)
+	reads = {read_id: seq for read_id, seq in reads.items() \
+		if read_id not in journal.done}
+
+	# group reads (or windows of long reads) into size-balanced batches, 
+	# longest work first
+	if options['long_read']:
+		tasks = [((read_id, w_start, len(seq)), w_seq, \
+			estimate_cost(w_seq, prot_db, k)) for read_id, seq in reads.items() \
+			for w_start, w_seq in lr.windows(seq, options['window'], options['overlap'])]
+		pending = {}
+		for (read_id, _, _), _, _ in tasks:
+			pending[read_id] = pending.get(read_id, 0) + 1
+		read_hits = {read_id: [] for read_id in pending}
+	else:
+		tasks = [(read_id, seq, estimate_cost(seq, prot_db, k)) \
+			for read_id, seq in reads.items()]
+	batches = make_batches(tasks, num_batches)
+
+	prof_dir = tempfile.mkdtemp(prefix='6tbsps-profile-') if options['profile'] else None
+	worker_options = {
+		'out_dir': out_dir,
+		'stats': options['stats'] is not None,
+		'prof_dir': prof_dir,
+		'long_read': options['long_read'],
+		'frameshift': options['frameshift'],
+		'aligner': options['aligner'],
+		'gap_model': options['gap_model'],
+		'max_evalue': max_evalue,
+		'columnar': columnar,
+	}
+
+	p_time = time.time()
+	reports = []
+	tasks = [(b_num, batch, worker_options) for b_num, batch in enumerate(batches)]
+	if pool is None:
+		results = map(partial(query_batch, database=database), tasks)
+	else:
+		results = pool.imap_unordered(query_batch, tasks)
+	# the rows of long reads, written by this process
+	table = TableWriter(out_dir, columnar, database['sm_name']) \
+		if columnar is not None and options['long_read'] else None
+	for report in results:
+		reports.append(report[:5])
+		# write a long read once all of its windows are searched
+		written = report[6]
+		for read_id, hits in report[5]:
+			read_hits[read_id].extend(hits)
+			pending[read_id] -= 1
+			if pending[read_id] == 0:
+				write_long_read(read_id, read_hits.pop(read_id), prot_seq, out_dir, \
+					table, max_evalue)
+				written.append(read_id)
+		if table is not None:
+			table.close()
+		journal.record(written)
+		if on_read is not None:
+			for read_id in written:
+				on_read(read_id)
+	journal.close()
+	workers = utilization([r[:3] for r in reports], time.time() - p_time)
+
+	if options['stats']:
+		write_stats([rec for r in reports for rec in r[3]], options['stats'])
+	if options['profile']:
+		dumps = [os.path.join(prof_dir, name) for name in sorted(os.listdir(prof_dir))]
+		merge_profiles(dumps, [r[4] for r in reports], options['profile'])
+		for name in dumps:
+			os.remove(name)
+		os.rmdir(prof_dir)
+
+	return workers
+#%%
+# per-worker copy of the database, set once by init_worker
+_worker = {}
+
+def init_worker(database):
+	'''Store the database once per worker process'''
+	_worker['db'] = database
+
+	return
+#%%
+def query_batch(batch, database=None):
+	'''
+	Query a batch of reads in a worker process
+
+	Args:
+		batch (tuple): 		(batch number, list of tuples of (read_id, seq),
+							run options), where read_id is (read_id, window
+							start, read length) for windows of long reads,
+							see run() for the options
+		database (dict): 	the database, that of init_worker when None
+
+	Returns:
+		report (tuple): 	(pid, busy time in seconds, number of reads,
+							list of stats records, profile memory summary,
+							list of (read_id, hits) of long-read windows,
+							list of read_id of the written reads, whose
+							rows are in a table with a columnar format)
+	'''
+	b_num, batch, options = batch
+	db = _worker['db'] if database is None else database
+	args = (db['k'], db['prot_db'], db['sm'], db['prot_seq'], db['n'])
+	aligner = get_aligner(options['aligner'])
+	gaps = GAP_MODELS[options['gap_model']]
+	table = TableWriter(options['out_dir'], options['columnar'], db['sm_name']) \
+		if options['columnar'] is not None and not options['long_read'] else None
+	records = []
+	memory = None
+	window_hits = []
+	if options['prof_dir']:
+		profiler = start_profile()
+	b_time = time.time()
+	for read_id, seq in batch:
+		if options['long_read']:
+			read_id, w_start, read_len = read_id
+			stats = QueryStats('{}:{}'.format(read_id, w_start), len(seq)) \
+				if options['stats'] else None
+			output = search_frames(read_id, seq, *args, stats, aligner, db['filter'], \
+				gaps, db['sm_name'])
+			window_hits.append((read_id, \
+				lr.window_hits(output, w_start, w_start + len(seq), read_len)))
+		else:
+			stats = QueryStats(read_id, len(seq)) if options['stats'] else None
+			query(read_id, seq, options['out_dir'], *args, stats=stats, \
+				frameshift=options['frameshift'], aligner=aligner, \
+				kmer_filter=db['filter'], gaps=gaps, table=table, sm_name=db['sm_name'], \
+				max_evalue=options['max_evalue'])
+		if stats is not None:
+			records.append(stats.record())
+	if table is not None:
+		table.close()
+	b_time = time.time() - b_time
+	if options['prof_dir']:
+		memory = stop_profile(profiler, \
+			os.path.join(options['prof_dir'], '{}.prof'.format(b_num)))
+
+	written = [] if options['long_read'] else [read_id for read_id, _ in batch]
+	return os.getpid(), b_time, len(batch), records, memory, window_hits, written
+#%%
+def sort_hits(output, prot_seq):
+	'''
+	Sort HitRecords by evalue, then by raw score, and hits of equal evalue
+	and score by frame and database order of the reference, so that the
+	results of a sharded database merge into those of an unsharded search
+	'''
+	order = ref_order(prot_seq)
+	return sorted(output, key=lambda h: (h.evalue, h.score, h.frame, order[h.ref_id]))
+
+def search_frames(read_id, seq, k, prot_db, sm, prot_seq, n, stats=None, \
+	aligner=LocalAlignment, kmer_filter=None, gaps=GAP_MODELS['affine'], \
+	sm_name='BLOSUM62', max_evalue=None):
+	'''
+	Translate a DNA sequence in 6 frames, seed and extend each frame and 
+	align it against the candidate regions with the aligner class and the
+	(gap_open, gap_ext) penalties of gaps; frames whose seeds are all
+	rejected by the kmer_filter are not seeded. E-values use the
+	Karlin-Altschul constants of sm_name, the name of sm. Hits above
+	max_evalue are not reported, and candidate regions whose score upper
+	bound cannot reach it are not aligned
+
+	Returns:
+		output (list):		HitRecord of every candidate region, sorted by
+							sort_hits()
+	'''
+	frames = sft.six_frames(seq)
+	output = [] # store output
+	# 6-frame translation
+	if stats is not None: stats.start('translation')
+	queries = {f: sft.translation(sft.transcription(frames[f])) for f in frames}
+	if stats is not None: stats.stop('translation')
+	# seed and extend the frames that may have seed hits, at once
+	if stats is not None: stats.start('seed')
+	hopeful = frames if kmer_filter is None else kmer_filter.passing(queries)
+	frame_regions = seed_frames({f: queries[f] for f in hopeful}, prot_db, k)
+	if stats is not None: stats.stop('seed')
+	# for each of the 6 frames:
+	for f in [-3, -2, -1, 1, 2, 3]:
+		query = queries[f]
+		# calculate query length
+		m = len(query)
+		regions = frame_regions.get(f, [])
+		if stats is not None:
+			seeds = seed(query, k)
+			stats.add(f, 'residues', m)
+			stats.add(f, 'seeds', len(seeds))
+			stats.add(f, 'postings', sum([len(prot_db.get(sd, [])) for sd in seeds]))
+			stats.add(f, 'candidates', len(regions))
+			stats.add(f, 'dp_cells', m * sum([len(u) for u in \
+				set([prot_seq[ref_id][s:e] for ref_id, (s, e) in regions])]))
+			stats.start('align')
+		# local alignment against all distinct candidate regions of the frame,
+		# identical regions of several references share one alignment, which
+		# is traced back at once so that its matrices are freed
+		subjects = [prot_seq[ref_id][s:e] for ref_id, (s, e) in regions]
+		unique = list(dict.fromkeys(subjects))
+		profile = QueryProfile(query, sm)
+		if max_evalue is not None:
+			unique = [u for u in unique if \
+				e_value_cal(m, n, profile.upper_bound(u), sm_name) <= max_evalue]
+		alignments = {subject: Alignment(la) for subject, la in \
+			zip(unique, align_all(aligner, query, unique, sm, *gaps, profile))} \
+			if unique else {}
+		for (ref_id, (s, e)), subject in zip(regions, subjects):
+			if subject not in alignments:
+				continue
+			alignment = alignments[subject]
+			S = alignment.score
+			evalue = e_value_cal(m, n, S, sm_name)
+			if max_evalue is not None and evalue > max_evalue:
+				continue
+			
+			output.append(HitRecord(f, read_id, query, ref_id, len(prot_seq[ref_id]), \
+				s, alignment, S, evalue))
+		if stats is not None: stats.stop('align')
+
+	return sort_hits(output, prot_seq)
+#%%
+def search_strands(read_id, seq, k, prot_db, sm, prot_seq, n, frameshift, \
+	stats=None, kmer_filter=None, gaps=GAP_MODELS['affine'], sm_name='BLOSUM62', \
+	max_evalue=None):
+	'''
+	Seed the 3 frames of each strand of a DNA sequence and align the strand
+	once per candidate reference with a frameshift-aware alignment, over the
+	union of the candidate regions of its frames, with the e-values of
+	sm_name as search_frames(). Hits above max_evalue are not reported; the
+	query side of a strand mixes its frames, so candidates are all aligned
+
+	Returns:
+		output (list):		HitRecord of every candidate reference, whose
+							query is the strand and frame that of the first
+							aligned codon, sorted by sort_hits()
+	'''
+	frames = sft.six_frames(seq)
+	output = [] # store output
+	if stats is not None: stats.start('translation')
+	queries = {f: sft.translation(sft.transcription(frames[f])) for f in frames}
+	if stats is not None: stats.stop('translation')
+	if stats is not None: stats.start('seed')
+	hopeful = frames if kmer_filter is None else kmer_filter.passing(queries)
+	frame_regions = seed_frames({f: queries[f] for f in hopeful}, prot_db, k)
+	if stats is not None: stats.stop('seed')
+	for sign, strand in [(-1, frames[-1]), (1, frames[1])]:
+		# m is the number of codons of a frame of the strand
+		m = len(strand) // 3
+		regions = {}
+		for f in [sign, 2 * sign, 3 * sign]:
+			query = queries[f]
+			for ref_id, (s, e) in frame_regions.get(f, []):
+				if ref_id in regions:
+					s = min(s, regions[ref_id][0])
+					e = max(e, regions[ref_id][1])
+				regions[ref_id] = (s, e)
+			if stats is not None:
+				seeds = seed(query, k)
+				stats.add(f, 'residues', len(query))
+				stats.add(f, 'seeds', len(seeds))
+				stats.add(f, 'postings', sum([len(prot_db.get(sd, [])) for sd in seeds]))
+		subjects = [prot_seq[ref_id][s:e] for ref_id, (s, e) in regions.items()]
+		if stats is not None:
+			stats.add(sign, 'candidates', len(regions))
+			stats.add(sign, 'dp_cells', \
+				max(len(strand) - 2, 0) * sum([len(u) for u in set(subjects)]))
+			stats.start('align')
+		# one alignment of the strand per distinct candidate region
+		alignments = {}
+		for (ref_id, (s, e)), subject in zip(regions.items(), subjects):
+			if subject not in alignments:
+				la = FrameshiftAlignment(strand, subject, sm, *gaps, frameshift=frameshift)
+				la.fill_matrix()
+				alignments[subject] = Alignment(la)
+			alignment = alignments[subject]
+			S = alignment.score
+			evalue = e_value_cal(m, n, S, sm_name)
+			if max_evalue is not None and evalue > max_evalue:
+				continue
+			f = sign * (alignment.max_loc_x_list[0][0] % 3 + 1)
+
+			output.append(HitRecord(f, read_id, strand, ref_id, len(prot_seq[ref_id]), \
+				s, alignment, S, evalue))
+		if stats is not None: stats.stop('align')
+
+	return sort_hits(output, prot_seq)
+#%%
+def query(read_id, seq, out_dir, k, prot_db, sm, prot_seq, n, stats=None, \
+	frameshift=None, aligner=LocalAlignment, kmer_filter=None, \
+	gaps=GAP_MODELS['affine'], table=None, sm_name='BLOSUM62', max_evalue=None):
+	# query
+	# make directory
+	if not os.path.exists(out_dir):
+		os.makedirs(out_dir)
+	with open_results(out_dir, read_id) as (out_file, sum_file):
+		if frameshift is None:
+			output = search_frames(read_id, seq, k, prot_db, sm, prot_seq, n, stats, \
+				aligner, kmer_filter, gaps, sm_name, max_evalue)
+		else:
+			output = search_strands(read_id, seq, k, prot_db, sm, prot_seq, n, \
+				frameshift, stats, kmer_filter, gaps, sm_name, max_evalue)
+		
+		if stats is not None: stats.start('output')
+		fio.align_out(output, out_file, sum_file, stats)
+		if stats is not None:
+			stats.stop('output')
+			stats.output_bytes = out_file.tell() + sum_file.tell()
+	# the rows of the .summary lines, for the TableWriter of the batch
+	if table is not None:
+		for h in output:
+			table.add(read_id, h.frame, h.ref_id, *hit_range(h), h.score, h.evalue)
+	
+	return
+#%%
+def write_long_read(read_id, hits, prot_seq, out_dir, table=None, max_evalue=None):
+	'''
+	Merge the collinear window hits of a long read and write its results up
+	to max_evalue, and their rows to a TableWriter
+	'''
+	merged = lr.merge_hits(hits)
+	if max_evalue is not None:
+		merged = [h for h in merged if h['evalue'] <= max_evalue]
+	with open_results(out_dir, read_id) as (out_file, sum_file):
+		lr.write_hits(read_id, merged, prot_seq, out_file, sum_file)
+	if table is not None:
+		for h in lr.sort_hits(merged, prot_seq):
+			table.add(read_id, h['frame'], h['ref_id'], h['q0'], h['q1'], h['s0'], \
+				h['s1'], h['score'], h['evalue'])
+
+	return
+#%%
+# the hit record of one .summary line: query coordinates are codons of the
+# frame (bases of the strand with a frameshift penalty), reference
+# coordinates are residues, both as in the .out alignment; alignment is
+# (aligned query, match line, aligned reference) when requested, or None
+Hit = namedtuple('Hit', ['read_id', 'frame', 'ref_id', 'query_start', \
+	'query_end', 'ref_start', 'ref_end', 'score', 'evalue', 'alignment'])
+
+def hit_range(h):
+	'''Query and reference coordinates of the first alignment of a HitRecord'''
+	q0, q1 = h.alignment.max_loc_x_list[0]
+	s0, s1 = h.alignment.max_loc_y_list[0]
+	return q0, q1, s0 + h.start, s1 + h.start
+
+def search_read(read_id, seq, database, options):
+	'''
+	Search one read and return its hit records, sorted as in its .summary,
+	see Searcher.search() for the options
+	'''
+	args = (database['k'], database['prot_db'], database['sm'], \
+		database['prot_seq'], database['n'])
+	gaps = GAP_MODELS[options['gap_model']]
+	hits = []
+	if options['long_read']:
+		window_hits = []
+		for w_start, w_seq in lr.windows(seq, options['window'], options['overlap']):
+			output = search_frames(read_id, w_seq, *args, \
+				aligner=get_aligner(options['aligner']), kmer_filter=database['filter'], \
+				gaps=gaps, sm_name=database['sm_name'])
+			window_hits.extend(lr.window_hits(output, w_start, w_start + len(w_seq), \
+				len(seq)))
+		for h in lr.sort_hits(lr.merge_hits(window_hits), database['prot_seq']):
+			if options['max_evalue'] is not None and h['evalue'] > options['max_evalue']:
+				continue
+			hits.append(Hit(read_id, h['frame'], h['ref_id'], h['q0'], h['q1'], \
+				h['s0'], h['s1'], h['score'], h['evalue'], \
+				(h['align_x'], h['xscript'], h['align_y']) \
+				if options['alignment'] else None))
+		return hits
+
+	if options['frameshift'] is None:
+		output = search_frames(read_id, seq, *args, \
+			aligner=get_aligner(options['aligner']), kmer_filter=database['filter'], \
+			gaps=gaps, sm_name=database['sm_name'], max_evalue=options['max_evalue'])
+	else:
+		output = search_strands(read_id, seq, *args, options['frameshift'], \
+			kmer_filter=database['filter'], gaps=gaps, sm_name=database['sm_name'], \
+			max_evalue=options['max_evalue'])
+	for h in output:
+		# the first alignment of the .out entry
+		a = h.alignment
+		hits.append(Hit(read_id, h.frame, h.ref_id, *hit_range(h), h.score, \
+			h.evalue, (a.align_seq_x_list[0], a.xscript_list[0], \
+			a.align_seq_y_list[0]) if options['alignment'] else None))
+	return hits
+
+def search_batch(batch, database=None):
+	'''
+	Search a batch of reads in a worker process
+
+	Args:
+		batch (tuple): 		(list of tuples of (read_id, seq), options)
+		database (dict): 	the database, that of init_worker when None
+
+	Returns:
+		hits (list): 		hit records of all reads, in read order
+	'''
+	reads, options = batch
+	db = _worker['db'] if database is None else database
+	return [hit for read_id, seq in reads for hit in search_read(read_id, seq, db, options)]
+#%%
+class Searcher:
+	def __init__(self, db, shard=None, sm_name='BLOSUM62', processes=1):
+		'''
+		Open a database and start the worker pool once for many searches
+
+		Args:
+			db (str): 			database base name
+			shard (int): 		shard to search of a sharded database
+			sm_name (str): 		score matrix name
+			processes (int): 	number of worker processes, 1 to search in
+								this process
+
+		self:
+			database (dict): 	output of open_database()
+			pool (Pool): 		worker pool, None with one process
+
+		Raises:
+			ValueError: 		when shard does not match the database
+		'''
+		self.database = open_database(db, shard, sm_name)
+		self.processes = processes
+		self.pool = multiprocessing.Pool(processes=processes, initializer=init_worker, \
+			initargs=(self.database,)) if processes > 1 else None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		'''Stop the worker pool'''
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+
+	def search(self, reads, aligner='reference', frameshift=None, long_read=False, \
+		window=3000, overlap=300, alignment=False, batch_size=8, gap_model='affine', \
+		max_evalue=None):
+		'''
+		Search reads and yield their hit records, as the .summary files of a
+		run with the same options would list them
+
+		Args:
+			reads (iterable): 	tuples of (read_id, seq), consumed as the
+								search goes
+			aligner (str): 		local alignment backend, see src.aligners
+			frameshift (float): frameshift penalty, None for 6 frames
+			long_read (bool): 	search reads in overlapping windows
+			window (int): 		long-read window length in bases
+			overlap (int): 		overlap of long-read windows in bases
+			alignment (bool): 	keep the alignment of every hit
+			batch_size (int): 	number of reads sent to a worker at once
+			gap_model (str): 	affine or linear gap penalties, see
+								src.aligners.GAP_MODELS
+			max_evalue (float): report hits up to this e-value, all when None
+
+		Yields:
+			hit (Hit): 			hit records, read by read in input order
+		'''
+		options = {'aligner': aligner, 'frameshift': frameshift, \
+			'long_read': long_read, 'window': window, 'overlap': overlap, \
+			'alignment': alignment, 'gap_model': gap_model, 'max_evalue': max_evalue}
+		get_aligner(aligner)
+		if gap_model not in GAP_MODELS:
+			raise ValueError('unknown gap model {}, choose from {}'.format( \
+				gap_model, ', '.join(sorted(GAP_MODELS))))
+		if frameshift is not None and long_read:
+			raise ValueError('frameshift cannot be combined with long_read')
+		# a few batches per worker in flight, so that reads are consumed
+		# lazily and every worker stays busy
+		pending = deque()
+		batch = []
+		for read in reads:
+			batch.append(read)
+			if len(batch) < batch_size:
+				continue
+			pending.append(self._submit(batch, options))
+			batch = []
+			if len(pending) > 2 * self.processes:
+				yield from pending.popleft()()
+		if batch:
+			pending.append(self._submit(batch, options))
+		while pending:
+			yield from pending.popleft()()
+
+	def _submit(self, batch, options):
+		'''Start searching a batch, return a function waiting for its hits'''
+		if self.pool is None:
+			hits = search_batch((batch, options), self.database)
+			return lambda: hits
+		return self.pool.apply_async(search_batch, ((batch, options),)).get
+
+	def write(self, reads, options, batches=4, on_read=None):
+		'''
+		Search reads and write the .out and .summary files of every read, as
+		6tbsps-query.py does
+
+		Args:
+			reads (dict): 		a dictionary of read identifiers to sequences
+			options (dict): 	run options, see run()
+			batches (int): 		number of read batches per process
+			on_read (func): 	called with each read_id once its results are
+								written
+
+		Returns:
+			workers (dict): 	per-worker utilization, see scheduler.utilization()
+		'''
+		return run(self.pool, self.database, reads, options, \
+			self.processes * batches, on_read)
@@ -21,6 +21,9 @@ Attributes:
         extend, given a seed length that is compatible with the pre-built
         dictionary and a gap length
 
+    seed_frames(dict, dict, int): naive_seed_and_extend of several frames,
+        in one lookup with an integer-encoded index
+
 """
 #%%
 def hamming_dist(str1, str2):
@@ -115,3 +118,23 @@ def naive_seed_and_extend(query, subject, k):
     """     
     seeds = seed(query, k)
     return extend(seeds, subject)
+#%%
+def seed_frames(queries, subject, k):
+    """Seed and extend the frames of a read.
+        An integer-encoded index (src.kmer_index) looks up the seeds of all
+        frames at once, other indices one seed at a time.
+
+    Args:
+        queries (dict):     protein sequence of each reading frame
+        subject (dict):     pre-index kmer dictionary (protein database)
+        k (int):            length of seeds
+
+    Returns:
+        regions (dict):     list of tuples of (ref_id, (start, end)) in the
+                            protein reference of each frame
+
+    """
+    if hasattr(subject, 'seed_regions'):
+        return subject.seed_regions(queries)
+    return {f: naive_seed_and_extend(query, subject, k)
+            for f, query in queries.items()}
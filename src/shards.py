@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Sharded protein databases.
+
+This module splits a protein database into shards that are indexed and
+    searched independently, e.g. one per node, and merges the per-shard
+    query results. A JSON manifest next to the shards records the total
+    number of residues of the whole database, which every shard search
+    uses as the n of its e-values, so merged e-values are those of an
+    unsharded search.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-build.py --shards, 6tbsps-query.py --shard and
+    6tbsps-merge.py.
+
+Attributes:
+    split_shards(dict, int): split references into non-empty shards of
+        similar numbers of residues, keeping their order
+
+    write_manifest(str, list, int), read_manifest(str): the manifest of a
+        sharded database
+
+    shard_db(str, dict, int): base name of one shard
+
+    read_hits(str, str): hit entries of one read in a result directory
+
+    merge_results(list, str): merge the result directories of all shards
+
+"""
+#%%
+import os
+import json
+#%%
+FRAMES = [-3, -2, -1, 1, 2, 3]
+#%%
+def split_shards(seqs, num_shards):
+    """Split references into contiguous shards of similar numbers of
+        residues, so that the references of shard i precede those of
+        shard i + 1 in the order of seqs. No shard is empty: a reference
+        longer than a shard moves the following ones to the next shard,
+        and there are at most as many shards as references.
+
+    Args:
+        seqs (dict):        protein dictionary
+        num_shards (int):   number of shards
+
+    Returns:
+        shards (list):      list of protein dictionaries, min(num_shards,
+                            len(seqs)) of them
+    """
+    num_shards = max(1, min(num_shards, len(seqs)))
+    total = sum([len(s) for s in seqs.values()])
+    shards = [{} for _ in range(num_shards)]
+    done = 0
+    i = 0
+    for n, (ref_id, seq) in enumerate(seqs.items()):
+        # the shard of the residues done so far, without skipping a shard,
+        # and leaving a reference to each of the shards after it
+        target = min(num_shards - 1, done * num_shards // max(total, 1))
+        if shards[i]:
+            i = max(i, min(target, i + 1), num_shards - (len(seqs) - n))
+        shards[i][ref_id] = seq
+        done += len(seq)
+    return shards
+
+def write_manifest(db, shards, k):
+    """Write the manifest of a sharded database to <db>.manifest.json.
+
+    Args:
+        db (str):           database base name
+        shards (list):      protein dictionaries of the shards
+        k (int):            k-mer length
+
+    Returns:
+        manifest (dict):    the manifest
+    """
+    base = os.path.basename(db)
+    manifest = {
+        'k': k,
+        'refs': sum([len(s) for s in shards]),
+        'residues': sum([len(seq) for s in shards for seq in s.values()]),
+        'shards': [{'db': '{}.{}'.format(base, i), 'refs': len(s),
+                    'residues': sum([len(seq) for seq in s.values()])}
+                   for i, s in enumerate(shards)],
+    }
+    with open(db + '.manifest.json', 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+    return manifest
+
+def read_manifest(db):
+    """The manifest of a sharded database, or None when db is not sharded"""
+    if not os.path.exists(db + '.manifest.json'):
+        return None
+    with open(db + '.manifest.json') as fh:
+        return json.load(fh)
+
+def shard_db(db, manifest, i):
+    """Base name of shard i, next to the manifest"""
+    if not 0 <= i < len(manifest['shards']):
+        raise ValueError('shard {} out of range 0-{}'.format(
+            i, len(manifest['shards']) - 1))
+    return os.path.join(os.path.dirname(db), manifest['shards'][i]['db'])
+#%%
+def read_hits(out_name, sum_name):
+    """Read the hit entries of one read from its .out and .summary files.
+
+    Args:
+        out_name (str):     .out file name
+        sum_name (str):     .summary file name
+
+    Returns:
+        hits (list):        list of tuples of (evalue, score, frame index,
+                            .out entry, .summary line), in file order
+    """
+    entries = []
+    with open(out_name) as fh:
+        for line in fh:
+            if line.startswith('Frame:'):
+                entries.append([])
+            entries[-1].append(line)
+    with open(sum_name) as fh:
+        lines = fh.readlines()
+    hits = []
+    for entry, line in zip(entries, lines):
+        fields = line.rstrip('\n').split('\t')
+        frame = int(entry[0].split()[1])
+        hits.append((float(fields[-1]), int(fields[-2]), FRAMES.index(frame),
+                     ''.join(entry), line))
+    return hits
+
+def merge_results(shard_dirs, out_dir):
+    """Merge the result directories of all shards into out_dir.
+        Hits of a read are sorted by e-value then raw score, then frame,
+        as in an unsharded search. Each shard writes ties of a frame in the
+        order of its references (src.hits.ref_order) and shards hold
+        contiguous ranges of the references of the database, so shard then
+        position within the shard is the order of the references in the
+        whole database, that of the unsharded search.
+
+    Args:
+        shard_dirs (list):  result directories, in shard order
+        out_dir (str):      merged result directory
+
+    Returns:
+        reads (int):        number of merged reads
+    """
+    names = sorted(set([os.path.splitext(name)[0] for d in shard_dirs
+                        for name in os.listdir(d) if name.endswith('.summary')]))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for name in names:
+        hits = []
+        for i, d in enumerate(shard_dirs):
+            out_name = os.path.join(d, name + '.out')
+            if os.path.exists(out_name):
+                hits.extend([(h[0], h[1], h[2], i, pos, h[3], h[4]) for pos, h in
+                             enumerate(read_hits(out_name, os.path.join(d, name + '.summary')))])
+        hits.sort(key=lambda h: h[:5])
+        with open(os.path.join(out_dir, name + '.out'), 'w') as out_file, \
+            open(os.path.join(out_dir, name + '.summary'), 'w') as sum_file:
+            for h in hits:
+                out_file.write(h[5])
+                sum_file.write(h[6])
+    return len(names)
@@ -23,6 +23,24 @@ Attributes:
 #%%
 import sys
 #%%
+# standard codon table, '.' marks stop codons
+AMINO_ACID_TABLE = {'AUG':'M', 'UUG':'L', 'GUG':'V', 'CUG':'L',
+					'AUA':'I', 'UUA':'L', 'GUA':'V', 'CUA':'L',
+					'AUC':'I', 'UUC':'F', 'GUC':'V', 'CUC':'L',
+					'AUU':'I', 'UUU':'F', 'GUU':'V', 'CUU':'L',
+					'AGG':'R', 'UGG':'W', 'GGG':'G', 'CGG':'R',
+					'AGA':'R', 'UGA':'.', 'GGA':'G', 'CGA':'R',
+					'AGC':'S', 'UGC':'C', 'GGC':'G', 'CGC':'R',
+					'AGU':'S', 'UGU':'C', 'GGU':'G', 'CGU':'R',
+					'ACG':'T', 'UCG':'S', 'GCG':'A', 'CCG':'P',
+					'ACA':'T', 'UCA':'S', 'GCA':'A', 'CCA':'P',
+					'ACC':'T', 'UCC':'S', 'GCC':'A', 'CCC':'P',
+					'ACU':'T', 'UCU':'S', 'GCU':'A', 'CCU':'P',
+					'AAG':'K', 'UAG':'.', 'GAG':'E', 'CAG':'Q',
+					'AAA':'K', 'UAA':'.', 'GAA':'E', 'CAA':'Q',
+					'AAC':'N', 'UAC':'Y', 'GAC':'D', 'CAC':'H',
+					'AAU':'N', 'UAU':'Y', 'GAU':'D', 'CAU':'H'}
+#%%
 def reverse_complement(dna):
 	'''
 	Reverse complement of DNA string
@@ -102,33 +120,17 @@ def translation(rna):
 	Returns:
 		dict: a dictinoary of keys: codon and values: amino acids letters
 	'''
-	amino_acid_table = {'AUG':'M', 'UUG':'L', 'GUG':'V', 'CUG':'L', 
-						'AUA':'I', 'UUA':'L', 'GUA':'V', 'CUA':'L',
-						'AUC':'I', 'UUC':'F', 'GUC':'V', 'CUC':'L', 
-						'AUU':'I', 'UUU':'F', 'GUU':'V', 'CUU':'L', 
-						'AGG':'R', 'UGG':'W', 'GGG':'G', 'CGG':'R', 
-				  		'AGA':'R', 'UGA':'.', 'GGA':'G', 'CGA':'R', 
-				  		'AGC':'S', 'UGC':'C', 'GGC':'G', 'CGC':'R',
-				  		'AGU':'S', 'UGU':'C', 'GGU':'G', 'CGU':'R', 
-				  		'ACG':'T', 'UCG':'S', 'GCG':'A', 'CCG':'P', 
-				  		'ACA':'T', 'UCA':'S', 'GCA':'A', 'CCA':'P', 
-				  		'ACC':'T', 'UCC':'S', 'GCC':'A', 'CCC':'P', 
-				  		'ACU':'T', 'UCU':'S', 'GCU':'A', 'CCU':'P',
-				  		'AAG':'K', 'UAG':'.', 'GAG':'E', 'CAG':'Q', 
-				  		'AAA':'K', 'UAA':'.', 'GAA':'E', 'CAA':'Q', 
-				  		'AAC':'N', 'UAC':'Y', 'GAC':'D', 'CAC':'H', 
-				  		'AAU':'N', 'UAU':'Y', 'GAU':'D', 'CAU':'H'}			  						  						  						  				  						  						  		 				  		
 	protein = ''
 	loc = 0
 	while(loc+3 <= len(rna)):
 		codon = rna[loc:loc+3]
 		# skip uncommon condon
-		if codon not in amino_acid_table:
+		if codon not in AMINO_ACID_TABLE:
 			continue
 		# stop codon
-		if amino_acid_table[codon] == '.':
+		if AMINO_ACID_TABLE[codon] == '.':
 			break
-		protein += amino_acid_table[codon]
+		protein += AMINO_ACID_TABLE[codon]
 		loc += 3
 
 	return protein
\ No newline at end of file
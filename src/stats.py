@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""Per-read and per-stage instrumentation of the query.
+
+This module records counters for each read and frame and the wall time of
+    each query stage, and merges the cProfile/tracemalloc results of the
+    worker processes. Everything here is opt-in: query() only touches a
+    QueryStats object when 6tbsps-query.py runs with --stats.
+
+Usage:
+    This is a module for internal pipline, no external usage.
+    See 6tbsps-query.py --stats and --profile.
+
+Attributes:
+    QueryStats: counters and stage timers of one read
+
+    write_stats(list, str): write per-frame rows to <base>.tsv and the
+        aggregate over all reads to <base>.json
+
+    start_profile(), stop_profile(tuple, str): run cProfile and tracemalloc
+        around a batch of reads in a worker
+
+    merge_profiles(list, str): merge the worker profiles into <base>.prof
+        and a readable <base>.txt report
+
+"""
+#%%
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+#%%
+FRAMES = [-3, -2, -1, 1, 2, 3]
+FRAME_COUNTERS = ['residues', 'seeds', 'postings', 'candidates', 'dp_cells',
+                  'hits', 'traceback_len']
+STAGES = ['translation', 'seed', 'align', 'output']
+
+class QueryStats:
+    def __init__(self, read_id, length):
+        '''
+        Init counters of one read
+
+        Args:
+            read_id (str): read identifier
+            length (int): read length in bases
+
+        self:
+            frames (dict): a dictionary that maps each frame to its counters
+            times (dict): a dictionary that maps each stage to its wall time
+            output_bytes (int): bytes written to the .out and .summary files
+        '''
+        self.read_id = read_id
+        self.length = length
+        self.frames = {f: dict.fromkeys(FRAME_COUNTERS, 0) for f in FRAMES}
+        self.times = dict.fromkeys(STAGES, 0.)
+        self.output_bytes = 0
+        self._start = {}
+
+    def start(self, stage):
+        '''Start the wall clock of a stage'''
+        self._start[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        '''Stop the wall clock of a stage and add the elapsed time'''
+        self.times[stage] += time.perf_counter() - self._start.pop(stage)
+
+    def add(self, f, counter, value):
+        '''Add value to a counter of frame f'''
+        self.frames[f][counter] += value
+
+    def record(self):
+        '''
+        Return a plain dictionary of this read, which is cheap to pickle
+        back from a worker process
+        '''
+        return {
+            'read_id': self.read_id,
+            'length': self.length,
+            'pid': os.getpid(),
+            'time': sum(self.times.values()),
+            'times': self.times,
+            'output_bytes': self.output_bytes,
+            'frames': self.frames,
+        }
+#%%
+def write_stats(records, base):
+    '''
+    Write per-read/frame counters to <base>.tsv and aggregated counters,
+    stage times and the slowest reads to <base>.json
+
+    Args:
+        records (list): list of QueryStats.record() dictionaries
+        base (str): output base name
+
+    Returns:
+        summary (dict): the aggregate written to <base>.json
+    '''
+    with open(base + '.tsv', 'w') as fh:
+        header = ['read_id', 'length', 'pid', 'frame'] + FRAME_COUNTERS + \
+            ['time'] + ['time_' + s for s in STAGES] + ['output_bytes']
+        print('\t'.join(header), file=fh)
+        for r in records:
+            # read-level fields are reported on the row of frame 0
+            row = [r['read_id'], r['length'], r['pid'], 0] + \
+                [sum([r['frames'][f][c] for f in FRAMES]) for c in FRAME_COUNTERS] + \
+                ['{:.6f}'.format(r['time'])] + \
+                ['{:.6f}'.format(r['times'][s]) for s in STAGES] + \
+                [r['output_bytes']]
+            print('\t'.join(map(str, row)), file=fh)
+            for f in FRAMES:
+                row = [r['read_id'], r['length'], r['pid'], f] + \
+                    [r['frames'][f][c] for c in FRAME_COUNTERS] + \
+                    [''] * (len(STAGES) + 2)
+                print('\t'.join(map(str, row)), file=fh)
+
+    summary = {
+        'reads': len(records),
+        'bases': sum([r['length'] for r in records]),
+        'time': sum([r['time'] for r in records]),
+        'times': {s: sum([r['times'][s] for r in records]) for s in STAGES},
+        'counters': {c: sum([r['frames'][f][c] for r in records for f in FRAMES])
+                     for c in FRAME_COUNTERS},
+        'output_bytes': sum([r['output_bytes'] for r in records]),
+        'workers': {},
+        'slowest': [],
+    }
+    for r in records:
+        w = summary['workers'].setdefault(str(r['pid']), {'reads': 0, 'time': 0.})
+        w['reads'] += 1
+        w['time'] += r['time']
+    for r in sorted(records, key=lambda x: -x['time'])[:10]:
+        summary['slowest'].append({
+            'read_id': r['read_id'],
+            'time': r['time'],
+            'dp_cells': sum([r['frames'][f]['dp_cells'] for f in FRAMES]),
+            'candidates': sum([r['frames'][f]['candidates'] for f in FRAMES]),
+        })
+    with open(base + '.json', 'w') as fh:
+        json.dump(summary, fh, indent=2)
+
+    return summary
+#%%
+def start_profile():
+    '''
+    Start cProfile and tracemalloc in a worker
+
+    Returns:
+        profiler (cProfile.Profile): the running profiler
+    '''
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def stop_profile(profiler, dump_name, top=25):
+    '''
+    Stop profiling, dump the cProfile data and summarize allocations
+
+    Args:
+        profiler (cProfile.Profile): profiler returned by start_profile()
+        dump_name (str): file name of the cProfile dump
+        top (int): number of allocation sites to keep
+
+    Returns:
+        memory (dict): peak traced memory and the largest allocation sites
+            still alive at the end of the batch
+    '''
+    profiler.disable()
+    profiler.dump_stats(dump_name)
+    snapshot = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'pid': os.getpid(),
+        'peak': peak,
+        'sites': [(str(s.traceback), s.size, s.count)
+                  for s in snapshot.statistics('lineno')[:top]],
+    }
+
+def merge_profiles(dump_names, memory, base, top=30):
+    '''
+    Merge the cProfile dumps of all workers into <base>.prof and write the
+    top functions and allocation sites to <base>.txt
+
+    Args:
+        dump_names (list): cProfile dump file names
+        memory (list): list of stop_profile() dictionaries
+        base (str): output base name
+        top (int): number of functions to report
+
+    Returns:
+        None
+    '''
+    if not dump_names:
+        return
+    stream = io.StringIO()
+    stats = pstats.Stats(*dump_names, stream=stream)
+    stats.dump_stats(base + '.prof')
+    stats.sort_stats('cumulative').print_stats(top)
+
+    peaks = {}
+    sites = {}
+    for mem in memory:
+        peaks[mem['pid']] = max(peaks.get(mem['pid'], 0), mem['peak'])
+        for site, size, count in mem['sites']:
+            s = sites.setdefault(site, [0, 0])
+            s[0] += size
+            s[1] += count
+    with open(base + '.txt', 'w') as fh:
+        print(stream.getvalue(), file=fh)
+        print('peak traced memory per worker (bytes)', file=fh)
+        for pid in sorted(peaks):
+            print('\t'.join([str(pid), str(peaks[pid])]), file=fh)
+        print(file=fh)
+        print('allocation sites alive at end of batch (bytes, blocks)', file=fh)
+        for site, (size, count) in sorted(sites.items(), key=lambda x: -x[1][0])[:top]:
+            print('\t'.join([str(size), str(count), site]), file=fh)
+
+    return